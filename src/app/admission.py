@@ -0,0 +1,289 @@
+"""
+Admission control and load shedding.
+
+Each route belongs to a class, with a limit on the requests of that class in flight at a time:
+read (one resource), list (pages, searches and rankings), write, bulk and export. An operation_id given its own limit in ADMISSION_CONCURRENCY gets a separate
+limit instead of its class's. Requests over the limit wait in a bounded FIFO queue, up to
+ADMISSION_QUEUE_TIMEOUT seconds. They are rejected right away, with a 503 and a Retry-After, when
+the queue is full or when the wait it predicts (from the recent time requests hold their slot)
+would outlast that deadline. A burst of exports or large order writes thus queues up or is turned
+away on its own, while single-resource reads keep their share of the database connections.
+
+With ADMISSION_RATE set, each client also has a token bucket refilled at that many tokens per
+second, up to ADMISSION_BURST. A request takes tokens by the cost of its class (see ROUTE_COSTS),
+and is rejected with a 429 and a Retry-After when there are not enough. Clients are told apart by
+their address, or by the ADMISSION_CLIENT_HEADER header when set (e.g. behind a proxy).
+
+The API calls the MCP tools make in-process (marked in their ASGI scope, see app/mcp_server.py) are
+charged to no client, since the /mcp request that makes them already was, but they are subject to
+the concurrency limits. The operations of a batch are admitted one by one, like requests of their
+own (see app/batch.py), so the batch request itself only takes a token. /mcp and the change feed,
+whose requests wait on other work, have no concurrency limit either. Limits and buckets are per
+process.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .metrics import is_mcp_call, request_timings
+
+ADMISSION_CONTROL: bool = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_CONCURRENCY: dict[str, int] = {"read": 32, "list": 8, "write": 8, "bulk": 2, "export": 2}
+# requests in flight per route class, or per operation_id, e.g. "list=4,read_orders=2"
+ADMISSION_CONCURRENCY: dict[str, int] = {
+    **DEFAULT_CONCURRENCY,
+    **{
+        key.strip(): int(value)
+        for key, _, value in (item.partition("=") for item in os.getenv("ADMISSION_CONCURRENCY", "").split(","))
+        if key.strip()
+    },
+}
+ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))  # requests waiting per limit
+ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "3"))  # seconds
+ADMISSION_RATE: float = float(os.getenv("ADMISSION_RATE", "0"))  # tokens per second per client, 0 to disable
+ADMISSION_BURST: float = float(os.getenv("ADMISSION_BURST", "50"))
+ADMISSION_CLIENT_HEADER: str = os.getenv("ADMISSION_CLIENT_HEADER", "")
+
+# tokens a request of each class takes from its client's bucket; routes without a class take 1
+ROUTE_COSTS: dict[str, float] = {"read": 1, "list": 2, "write": 2, "bulk": 10, "export": 10}
+
+# requests that mostly wait on other work (the MCP tool calls, the change feed, the batches)
+# (the operations of a batch are admitted one by one instead, see app/batch.py)
+UNLIMITED_OPERATIONS: frozenset[str] = frozenset({"mcp_http", "stream_changes", "poll_changes", "run_batch"})
+
+# buckets kept before the full ones are dropped
+MAX_CLIENTS = 10_000
+
+
+def route_class(route: APIRoute) -> Optional[str]:
+    """The class of a route, or None for routes without a concurrency limit."""
+    operation_id = route.operation_id or route.name
+    if operation_id in UNLIMITED_OPERATIONS:
+        return None
+    if operation_id.startswith("export_"):
+        return "export"
+    if operation_id.endswith("_bulk"):
+        return "bulk"
+    if route.methods - {"GET", "HEAD"}:
+        return "write"
+    if any(param.name == "limit" for param in route.dependant.query_params):
+        return "list"
+    return "read"
+
+
+class ConcurrencyLimit:
+    """At most `limit` requests at a time; the others wait their turn in a bounded queue."""
+
+    def __init__(self, name: str, limit: int, queue_size: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.service_time = 0.0  # moving average of the time a request holds a slot
+
+    def expected_wait(self, position: int) -> float:
+        return position * self.service_time / self.limit
+
+    async def acquire(self, timeout: float) -> Optional[float]:
+        """Take a slot, waiting up to timeout; returns None once it is taken, or the seconds to retry after."""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return None
+        position = len(self.waiters) + 1
+        expected = self.expected_wait(position)
+        if position > self.queue_size or expected > timeout:
+            return expected
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            # the slot may have been handed over as the deadline passed
+            if waiter.done() and not waiter.cancelled():
+                return None
+            self._leave(waiter)
+            return self.expected_wait(len(self.waiters) + 1)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._leave(waiter)
+            raise
+        return None
+
+    def release(self, duration: Optional[float] = None) -> None:
+        """Give the slot back, to the first request waiting if any."""
+        if duration is not None:
+            self.service_time = duration if not self.service_time else 0.9 * self.service_time + 0.1 * duration
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _leave(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class TokenBuckets:
+    """A token bucket per client."""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.buckets: dict[str, tuple[float, float]] = {}  # client -> (tokens, when they were counted)
+
+    def take(self, client: str, cost: float) -> float:
+        """Take cost tokens from the client's bucket; returns 0, or the seconds until there are enough."""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        cost = min(cost, self.burst)
+        if tokens < cost:
+            self.buckets[client] = (tokens, now)
+            return (cost - tokens) / self.rate
+        if len(self.buckets) >= MAX_CLIENTS and client not in self.buckets:
+            self._prune(now)
+        self.buckets[client] = (tokens - cost, now)
+        return 0.0
+
+    def _prune(self, now: float) -> None:
+        # a bucket that has refilled is the same as no bucket
+        full = self.burst / self.rate
+        self.buckets = {client: entry for client, entry in self.buckets.items() if now - entry[1] < full}
+
+
+class Admission:
+    """The concurrency limits and the client buckets of the routes, shared by the middleware and /batch."""
+
+    def __init__(
+        self,
+        concurrency: dict[str, int],
+        queue_size: int,
+        queue_timeout: float,
+        rate: float,
+        burst: float,
+        client_header: str = "",
+    ) -> None:
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.buckets = TokenBuckets(rate, burst) if rate > 0 else None
+        self.client_header = client_header.lower()
+        self.limits: dict[str, ConcurrencyLimit] = {}
+        # by id(), as routes are unhashable; they live as long as the app
+        self.routes: dict[int, tuple[Optional[ConcurrencyLimit], float]] = {}
+
+    def route_limit(self, route: APIRoute) -> tuple[Optional[ConcurrencyLimit], float]:
+        """The concurrency limit of a route (None if it has none) and the tokens its requests take."""
+        entry = self.routes.get(id(route))
+        if entry is None:
+            name = route_class(route)
+            limit = None
+            if name is not None:
+                key = route.operation_id if route.operation_id in self.concurrency else name
+                limit = self.limits.get(key)
+                if limit is None:
+                    limit = self.limits[key] = ConcurrencyLimit(key, self.concurrency[key], self.queue_size)
+            entry = self.routes[id(route)] = (limit, ROUTE_COSTS.get(name or "", 1))
+        return entry
+
+    def client(self, scope: Scope) -> str:
+        headers = Headers(scope=scope)
+        if self.client_header and self.client_header in headers:
+            return headers[self.client_header]
+        return scope["client"][0] if scope.get("client") else ""
+
+    async def admit(
+        self, scope: Scope, route: Optional[APIRoute]
+    ) -> tuple[Optional[ConcurrencyLimit], Optional[tuple[int, str, float]]]:
+        """
+        Charge a request to its client and take a slot of its route's limit.
+
+        Returns the limit to release once the request is done (None if it has none), or the status
+        code, detail and seconds to retry after of its rejection.
+        """
+        limit, cost = self.route_limit(route) if route is not None else (None, 1)
+        if self.buckets is not None and not is_mcp_call(scope):
+            wait = self.buckets.take(self.client(scope), cost)
+            if wait:
+                return None, (429, "Too many requests", wait)
+        if limit is not None:
+            retry_after = await limit.acquire(self.queue_timeout)
+            if retry_after is not None:
+                return None, (503, f"Too many {limit.name} requests in progress", retry_after)
+        return limit, None
+
+
+admission: Optional[Admission] = (
+    Admission(
+        ADMISSION_CONCURRENCY,
+        ADMISSION_QUEUE_SIZE,
+        ADMISSION_QUEUE_TIMEOUT,
+        ADMISSION_RATE,
+        ADMISSION_BURST,
+        ADMISSION_CLIENT_HEADER,
+    )
+    if ADMISSION_CONTROL
+    else None
+)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting the requests to the routes of a router, or rejecting them with a Retry-After."""
+
+    def __init__(self, app: ASGIApp, router: Router, admission: Admission) -> None:
+        self.app = app
+        self.router = router
+        self.admission = admission
+        self.routes: Optional[list[APIRoute]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.routes is None:
+            # once every route is declared
+            self.routes = [route for route in self.router.routes if isinstance(route, APIRoute)]
+        route = next((route for route in self.routes if route.matches(scope)[0] == Match.FULL), None)
+
+        limit, rejection = await self.admission.admit(scope, route)
+        if rejection is not None:
+            status_code, detail, retry_after = rejection
+            # rejections are counted against their route in the metrics
+            timings = request_timings.get()
+            if timings is not None and route is not None:
+                timings.route = route.path
+            response = JSONResponse(
+                status_code=status_code,
+                content={"detail": detail},
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release(time.perf_counter() - start)
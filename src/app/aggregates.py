@@ -0,0 +1,183 @@
+"""
+Materialized sales aggregates.
+
+The customer_stats, product_sales and daily_sales tables hold running totals over every order
+that is not cancelled. The order routes call apply_order() in the same transaction as the order
+write, adding an order's totals when it is placed (or un-cancelled) and subtracting them when it
+is cancelled or deleted, so the aggregate endpoints read a handful of rows instead of scanning
+orders and order items. rebuild_aggregates() recomputes every table from scratch, from the orders
+and the archived orders.
+
+The migration that adds these tables to an existing database computes them (see app/migrations.py).
+To rebuild them, e.g. after editing orders by hand, execute (from src/):
+    python -m app.aggregates
+"""
+
+from datetime import date, datetime
+from typing import Any, Iterable
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+# dialects with an INSERT ... ON CONFLICT DO UPDATE construct; others update, then insert what is missing
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+# order statuses that are left out of the aggregates
+EXCLUDED_STATUSES: tuple[str, ...] = ("cancelled",)
+
+
+def counts_towards_aggregates(status: str) -> bool:
+    return status not in EXCLUDED_STATUSES
+
+
+async def _add(db: AsyncSession, model: Any, key: str, rows: list[dict]) -> None:
+    """Add the values of each row to the matching row of a summary table, creating it if missing."""
+    table = model.__table__
+    now = datetime.utcnow()
+    dialect = db.bind.dialect.name
+    if dialect not in _UPSERT_INSERTS:
+        # other databases: update each row, and insert the ones that are not there yet
+        for row in rows:
+            totals = {name: table.c[name] + value for name, value in row.items() if name != key}
+            result = await db.execute(update(table).where(table.c[key] == row[key]).values(**totals, updated_at=now))
+            if not result.rowcount:
+                await db.execute(insert(table).values(**row, updated_at=now))
+        return
+    stmt = _UPSERT_INSERTS[dialect](table)
+    totals = {name: table.c[name] + stmt.excluded[name] for name in rows[0] if name != key}
+    stmt = stmt.on_conflict_do_update(index_elements=[key], set_={**totals, "updated_at": stmt.excluded.updated_at})
+    await db.execute(stmt, [{**row, "updated_at": now} for row in rows])
+
+
+async def apply_order(
+    db: AsyncSession, order: models.Order, items: Iterable[tuple[int, int, float]], sign: int = 1
+) -> None:
+    """
+    Add an order to the aggregates (sign=1) or take it out again (sign=-1), without committing.
+
+    `items` are the order's (product_id, quantity, price_at_time) lines; the order must be flushed
+    so that its order_date is set.
+    """
+    products: dict[int, list[float]] = {}
+    for product_id, quantity, price in items:
+        units, revenue = products.setdefault(product_id, [0, 0.0])
+        products[product_id] = [units + quantity, revenue + quantity * price]
+
+    total_amount = order.total_amount or 0.0
+    await _add(
+        db,
+        models.CustomerStats,
+        "customer_id",
+        [{"customer_id": order.customer_id, "order_count": sign, "total_spent": sign * total_amount}],
+    )
+    await _add(
+        db,
+        models.DailySales,
+        "day",
+        [
+            {
+                "day": order.order_date.date(),
+                "order_count": sign,
+                "units_sold": sign * sum(units for units, _ in products.values()),
+                "revenue": sign * total_amount,
+            }
+        ],
+    )
+    if products:
+        await _add(
+            db,
+            models.ProductSales,
+            "product_id",
+            [
+                {"product_id": product_id, "order_count": sign, "units_sold": sign * units, "revenue": sign * revenue}
+                for product_id, (units, revenue) in products.items()
+            ],
+        )
+
+
+def order_lines(order: models.Order) -> list[tuple[int, int, float]]:
+    """The (product_id, quantity, price_at_time) lines of an order with its items loaded."""
+    return [(item.product_id, item.quantity, item.price_at_time) for item in order.items]
+
+
+def rebuild_aggregates(db: Session) -> None:
+    """Recompute every summary table from the orders and archived orders, replacing its contents."""
+    order_columns = ("id", "customer_id", "order_date", "status", "total_amount")
+    item_columns = ("order_id", "product_id", "quantity", "price_at_time")
+    orders = union_all(
+        select(*(getattr(models.Order, column) for column in order_columns)),
+        select(*(getattr(models.ArchivedOrder, column) for column in order_columns)),
+    ).subquery("all_orders")
+    items = union_all(
+        select(*(getattr(models.OrderItem, column) for column in item_columns)),
+        select(*(getattr(models.ArchivedOrderItem, column) for column in item_columns)),
+    ).subquery("all_items")
+    counted = orders.c.status.notin_(EXCLUDED_STATUSES)
+    now = datetime.utcnow()
+
+    for model in (models.CustomerStats, models.ProductSales, models.DailySales):
+        db.execute(delete(model))
+
+    db.execute(
+        insert(models.CustomerStats).from_select(
+            ["customer_id", "order_count", "total_spent", "updated_at"],
+            select(
+                orders.c.customer_id,
+                func.count(orders.c.id),
+                func.coalesce(func.sum(orders.c.total_amount), 0.0),
+                literal(now, DateTime()),
+            )
+            .where(counted)
+            .group_by(orders.c.customer_id),
+        )
+    )
+
+    db.execute(
+        insert(models.ProductSales).from_select(
+            ["product_id", "order_count", "units_sold", "revenue", "updated_at"],
+            select(
+                items.c.product_id,
+                func.count(items.c.order_id.distinct()),
+                func.sum(items.c.quantity),
+                func.sum(items.c.quantity * items.c.price_at_time),
+                literal(now, DateTime()),
+            )
+            .join(orders, orders.c.id == items.c.order_id)
+            .where(counted)
+            .group_by(items.c.product_id),
+        )
+    )
+
+    units = select(items.c.order_id, func.sum(items.c.quantity).label("units")).group_by(items.c.order_id).subquery()
+    day = func.date(orders.c.order_date)
+    rows = db.execute(
+        select(
+            day.label("day"),
+            func.count(orders.c.id).label("order_count"),
+            func.coalesce(func.sum(units.c.units), 0).label("units_sold"),
+            func.coalesce(func.sum(orders.c.total_amount), 0.0).label("revenue"),
+        )
+        .outerjoin(units, units.c.order_id == orders.c.id)
+        .where(counted)
+        .group_by(day)
+    )
+    daily = []
+    for row in rows:
+        # date() returns a string on SQLite
+        day = row.day if isinstance(row.day, date) else date.fromisoformat(row.day)
+        daily.append({**row._asdict(), "day": day, "updated_at": now})
+    if daily:
+        db.execute(insert(models.DailySales), daily)
+    db.commit()
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    with SessionLocal() as session:
+        rebuild_aggregates(session)
+    print("Sales aggregates rebuilt.")
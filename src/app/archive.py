@@ -0,0 +1,129 @@
+"""
+Order archiving.
+
+Delivered and cancelled orders placed before the last ORDER_ARCHIVE_MONTHS months are moved, with
+their items, from orders and order_items_detail to orders_archive and order_items_archive. The
+order tables and their indexes then only hold recent and open orders, which is what the API reads
+and writes, whatever the size of the history.
+
+Orders are moved month by month, oldest first, ORDER_ARCHIVE_BATCH_SIZE orders per transaction,
+so the writer lock is only held briefly and an interrupted run resumes where it stopped. Archived
+orders are final: GET /orders/{order_id} still finds them, but they are left out of the order
+lists and exports and cannot be updated or deleted. The sales aggregates keep counting them.
+
+To archive the orders of a database, execute (from src/), e.g. from a monthly cron job:
+    python -m app.archive
+    python -m app.archive --months 3
+"""
+
+import argparse
+import os
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+from . import models
+
+ORDER_ARCHIVE_MONTHS: int = int(os.getenv("ORDER_ARCHIVE_MONTHS", "12"))
+ORDER_ARCHIVE_BATCH_SIZE: int = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "5000"))
+
+# order statuses that no longer change
+ARCHIVED_STATUSES: tuple[str, ...] = ("delivered", "cancelled")
+
+_ORDER_COLUMNS = ("id", "customer_id", "order_date", "status", "total_amount", "created_at", "updated_at")
+_ITEM_COLUMNS = ("id", "order_id", "product_id", "quantity", "price_at_time")
+
+
+def month_start(day: date, months_back: int = 0) -> datetime:
+    """Midnight on the first day of the month `months_back` months before the month of `day`."""
+    month = day.year * 12 + day.month - 1 - months_back
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def _move(db: Session, order_ids: list[int], now: datetime) -> None:
+    orders = [getattr(models.Order, column) for column in _ORDER_COLUMNS]
+    items = [getattr(models.OrderItem, column) for column in _ITEM_COLUMNS]
+    db.execute(
+        insert(models.ArchivedOrder).from_select(
+            [*_ORDER_COLUMNS, "archived_at"],
+            select(*orders, literal(now, DateTime())).where(models.Order.id.in_(order_ids)),
+        )
+    )
+    db.execute(
+        insert(models.ArchivedOrderItem).from_select(
+            _ITEM_COLUMNS, select(*items).where(models.OrderItem.order_id.in_(order_ids))
+        )
+    )
+    db.execute(delete(models.OrderItem).where(models.OrderItem.order_id.in_(order_ids)))
+    db.execute(delete(models.StockReservation).where(models.StockReservation.order_id.in_(order_ids)))
+    db.execute(delete(models.Order).where(models.Order.id.in_(order_ids)))
+
+
+def archive_orders(
+    db: Session, before: datetime, batch_size: int = ORDER_ARCHIVE_BATCH_SIZE, verbose: bool = False
+) -> int:
+    """Move the delivered and cancelled orders placed before `before` to the archive; returns their count."""
+    oldest = db.scalar(
+        select(func.min(models.Order.order_date)).where(
+            models.Order.status.in_(ARCHIVED_STATUSES), models.Order.order_date < before
+        )
+    )
+    if oldest is None:
+        return 0
+    now = datetime.utcnow()
+    total = 0
+    start = month_start(oldest)
+    while start < before:
+        end = min(month_start(start, -1), before)
+        moved = 0
+        # walk the month along the order_date index, so that the orders left in place are read once
+        position = (start, 0)
+        order_ids: list[int] = []
+        while True:
+            rows = db.execute(
+                select(models.Order.order_date, models.Order.id, models.Order.status)
+                .where(tuple_(models.Order.order_date, models.Order.id) > position, models.Order.order_date < end)
+                .order_by(models.Order.order_date, models.Order.id)
+                .limit(batch_size)
+            ).all()
+            order_ids += [row.id for row in rows if row.status in ARCHIVED_STATUSES]
+            while len(order_ids) >= batch_size or (order_ids and not rows):
+                chunk, order_ids = order_ids[:batch_size], order_ids[batch_size:]
+                _move(db, chunk, now)
+                db.commit()
+                moved += len(chunk)
+            if not rows:
+                break
+            position = (rows[-1].order_date, rows[-1].id)
+        if verbose and moved:
+            print(f"Archived {moved} orders from {start:%Y-%m}.")
+        total += moved
+        start = end
+    return total
+
+
+async def get_archived_order(db: AsyncSession, order_id: int) -> Optional[models.ArchivedOrder]:
+    return await db.scalar(
+        select(models.ArchivedOrder)
+        .options(selectinload(models.ArchivedOrder.items))
+        .filter(models.ArchivedOrder.id == order_id)
+    )
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--months", type=int, default=ORDER_ARCHIVE_MONTHS, help="months of orders to keep, besides the current one"
+    )
+    parser.add_argument("--batch-size", type=int, default=ORDER_ARCHIVE_BATCH_SIZE, help="orders per transaction")
+    args = parser.parse_args()
+
+    cutoff = month_start(datetime.utcnow().date(), args.months)
+    with SessionLocal() as session:
+        count = archive_orders(session, cutoff, args.batch_size, verbose=True)
+    print(f"Archived {count} orders placed before {cutoff:%Y-%m-%d}.")
@@ -0,0 +1,270 @@
+"""
+Composite requests.
+
+POST /batch runs a list of operations, named by their operation_id (which is also the name of
+their MCP tool), one after the other in a single request. Each operation goes through its route as
+if it had been called on its own, with the same validation, status codes and error responses, but
+the operations share one database session instead of opening one each:
+
+- A batch of read operations runs on a single read session, so it sees one snapshot of the
+  database, and goes through the cache and the catalog snapshot as usual.
+- A batch with writes runs in a single transaction on the primary, which commits once at the end.
+  The commit each route makes only releases a savepoint, and a failed operation (status 400 or
+  above) is rolled back to it, leaving the other operations in place; with `atomic`, the whole
+  batch is rolled back instead and the remaining operations are skipped. The operations read the
+  writes of the earlier ones, so the cache and the catalog snapshot are bypassed, and their
+  invalidations are made once the batch has committed.
+
+Each operation takes its client's tokens and a slot of its route's concurrency limit, as its own
+request would (see app/admission.py), and fails with a 429 or 503 when it cannot have them.
+Operations are limited to BATCH_MAX_OPERATIONS per batch. Streaming endpoints (the exports) cannot
+be batched.
+"""
+
+import json
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Any
+from urllib.parse import quote, urlencode
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.routing import Match
+from starlette.types import Message
+
+from . import cache, database, schemas
+from .admission import admission
+from .changes import feed
+from .database import (
+    DB_QUERY_BUDGET,
+    AsyncReadSessionLocal,
+    AsyncSessionLocal,
+    batch_session,
+    read_engine,
+    read_target,
+)
+from .metrics import request_timings
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_OPERATIONS: int = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+
+BATCH_OPERATION_ID = "run_batch"
+
+# shown in the OpenAPI schema, and to agents as the description of the MCP tool
+BATCH_DESCRIPTION = (
+    "Run several operations in one request. Each operation names an operation_id (the name of an MCP tool), with "
+    "its path and query parameters in params and its request body in body; the results come back in order, with "
+    "the status code and body each operation would have returned on its own. Operations run one after the other: "
+    "a batch with writes runs in a single transaction, in which each operation sees the writes of the earlier ones "
+    "and a failed operation is undone on its own, or, with atomic, undoes the whole batch and skips the rest. "
+    f"At most {BATCH_MAX_OPERATIONS} operations; the exports cannot be batched."
+)
+
+
+@lru_cache
+def batch_routes(app: FastAPI) -> dict[str, APIRoute]:
+    """The routes a batch can run, by operation_id."""
+    return {
+        route.operation_id: route
+        for route in app.routes
+        if isinstance(route, APIRoute)
+        and route.operation_id
+        and route.operation_id != BATCH_OPERATION_ID
+        and not (isinstance(route.response_class, type) and issubclass(route.response_class, StreamingResponse))
+    }
+
+
+def _query_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return [_query_value(item) for item in value]
+    return value
+
+
+def _error(status_code: int, detail: str) -> tuple[int, Any]:
+    return status_code, {"detail": detail}
+
+
+async def call(request: Request, route: APIRoute, operation: schemas.BatchOperation) -> tuple[int, Any]:
+    """Run one operation through its route, in-process; returns its status code and decoded body."""
+    method = min(route.methods)
+    path_params = {name: operation.params[name] for name in route.param_convertors if name in operation.params}
+    missing = [name for name in route.param_convertors if name not in path_params]
+    if missing:
+        return _error(422, f"Missing path parameters: {', '.join(missing)}")
+    path = route.path_format.format(**{name: quote(str(value), safe="") for name, value in path_params.items()})
+    query = {
+        name: _query_value(value)
+        for name, value in operation.params.items()
+        if name not in path_params and value is not None
+    }
+    body = b"" if operation.body is None else json.dumps(operation.body).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if "host" in request.headers:
+        headers.append((b"host", request.headers["host"].encode()))
+
+    scope = {
+        **request.scope,
+        "method": method,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(query, doseq=True).encode(),
+        "headers": headers,
+        "state": {},
+    }
+    match, child_scope = route.matches(scope)
+    if match != Match.FULL:
+        return _error(404, f"Invalid path parameters for {operation.operation_id}")
+    scope.update(child_scope)
+
+    received = False
+
+    async def receive() -> Message:
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    # each operation is admitted like a request of its own (see app/admission.py)
+    limit = None
+    if admission is not None:
+        limit, rejection = await admission.admit(scope, route)
+        if rejection is not None:
+            return _error(*rejection[:2])
+
+    status_code = 500
+    chunks: list[bytes] = []
+
+    async def send(message: Message) -> None:
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    start = time.perf_counter()
+    try:
+        await route.handle(scope, receive, send)
+    finally:
+        if limit is not None:
+            limit.release(time.perf_counter() - start)
+    content = b"".join(chunks)
+    if not content:
+        return status_code, None
+    try:
+        return status_code, json.loads(content)
+    except ValueError:
+        return status_code, content.decode(errors="replace")
+
+
+def _failed(result: dict) -> bool:
+    return result["status_code"] is not None and result["status_code"] >= 400
+
+
+async def run_operations(
+    request: Request, db: AsyncSession, operations: list[schemas.BatchOperation], atomic: bool
+) -> list[dict]:
+    """
+    Run the operations of a batch on a shared session; returns their results.
+
+    Each operation is committed to, or rolled back to, its savepoint; with atomic, the operations
+    after the first failure are skipped, and the caller rolls the batch back.
+    """
+    routes = batch_routes(request.app)
+    results: list[dict] = []
+    failed = False
+    # the operations are accounted to the batch request, not to their own routes
+    token = request_timings.set(None)
+    try:
+        for index, operation in enumerate(operations):
+            result = {"index": index, "operation_id": operation.operation_id, "status_code": None, "body": None}
+            results.append(result)
+            if failed and atomic:
+                continue
+            route = routes.get(operation.operation_id)
+            if route is None:
+                status_code, body = _error(404, f"Unknown operation: {operation.operation_id}")
+            else:
+                try:
+                    status_code, body = await call(request, route, operation)
+                except Exception:
+                    logger.exception("Batch operation %s failed", operation.operation_id)
+                    status_code, body = _error(500, "Internal Server Error")
+            result.update(status_code=status_code, body=body)
+
+            if status_code < 400:
+                if db.in_transaction():
+                    await db.commit()
+            else:
+                await db.rollback()
+                failed = True
+            # later operations read the rows again, since bulk statements bypass the identity map
+            db.expunge_all()
+    finally:
+        request_timings.reset(token)
+    return results
+
+
+async def run_batch(request: Request, batch: schemas.BatchRequest) -> dict:
+    """Run a batch request: its reads on one read session, or everything in one transaction on the primary."""
+    if len(batch.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch can have at most {BATCH_MAX_OPERATIONS} operations")
+    # the query budget (see main.py) applies to each operation
+    request.state.query_budget = DB_QUERY_BUDGET * max(len(batch.operations), 1)
+
+    routes = batch_routes(request.app)
+    writes = any(
+        operation.operation_id in routes and "GET" not in routes[operation.operation_id].methods
+        for operation in batch.operations
+    )
+    committed = True
+    if not writes:
+        bind, target = read_engine(request)
+        target_token = read_target.set(target)
+        try:
+            async with AsyncReadSessionLocal(bind=bind) as db:
+                session_token = batch_session.set(db)
+                try:
+                    results = await run_operations(request, db, batch.operations, batch.atomic)
+                finally:
+                    batch_session.reset(session_token)
+        finally:
+            read_target.reset(target_token)
+    else:
+        request.state.used_primary = True
+        deferred: list[tuple[str, tuple[Any, ...]]] = []
+        tokens = (read_target.set("pinned"), cache.deferred_invalidations.set(deferred))
+        try:
+            async with database.async_engine.connect() as connection:
+                transaction = await connection.begin()
+                # the routes' commits release a savepoint of the batch's transaction
+                async with AsyncSessionLocal(bind=connection, join_transaction_mode="create_savepoint") as db:
+                    session_token = batch_session.set(db)
+                    try:
+                        results = await run_operations(request, db, batch.operations, batch.atomic)
+                    finally:
+                        batch_session.reset(session_token)
+                committed = not (batch.atomic and any(_failed(result) for result in results))
+                if committed:
+                    await transaction.commit()
+                else:
+                    await transaction.rollback()
+        finally:
+            cache.deferred_invalidations.reset(tokens[1])
+            read_target.reset(tokens[0])
+        if committed:
+            for entity, entity_ids in deferred:
+                await cache.invalidate(entity, *entity_ids)
+            # the routes' commits only released savepoints
+            feed.notify()
+
+    failed = sum(1 for result in results if _failed(result))
+    succeeded = sum(1 for result in results if result["status_code"] is not None) - failed
+    return {"committed": committed, "succeeded": succeeded, "failed": failed, "results": results}
@@ -0,0 +1,163 @@
+"""
+Helpers for the bulk endpoints.
+
+Bulk requests carry rows either as a JSON document ({"rows": [...]} or a bare array) or as an
+NDJSON stream with one row per line, which is read incrementally. Rows are validated one by one
+and written in chunks of BULK_CHUNK_SIZE, each chunk in its own transaction, and the response
+reports the outcome of every row.
+"""
+
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BULK_CHUNK_SIZE: int = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+NDJSON_MEDIA_TYPES: tuple[str, ...] = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+ChunkWriter = Callable[[list[tuple[int, Any]]], Awaitable[list[dict]]]
+
+
+class _InvalidRow:
+    """Placeholder for an NDJSON line that could not be parsed."""
+
+    def __init__(self, error: str) -> None:
+        self.error = error
+
+
+def _inline_refs(schema: Any, definitions: dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _inline_refs(definitions[schema["$ref"].split("/")[-1]], definitions)
+        return {key: _inline_refs(value, definitions) for key, value in schema.items() if key != "$defs"}
+    if isinstance(schema, list):
+        return [_inline_refs(value, definitions) for value in schema]
+    return schema
+
+
+def request_body(row_schema: type[BaseModel]) -> dict:
+    """
+    OpenAPI request body for a bulk endpoint, passed as the route's openapi_extra.
+
+    The JSON variant is an object with a "rows" array so that it maps onto MCP tool arguments.
+    Schemas are inlined since the row models are not otherwise part of the OpenAPI components.
+    """
+    row = row_schema.model_json_schema()
+    row = _inline_refs(row, row.get("$defs", {}))
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"rows": {"type": "array", "items": row, "title": "Rows"}},
+                        "required": ["rows"],
+                    }
+                },
+                "application/x-ndjson": {"schema": row},
+            },
+        }
+    }
+
+
+async def read_rows(request: Request) -> AsyncIterator[Any]:
+    """Yield the raw rows of a bulk request body."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_MEDIA_TYPES:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+
+    try:
+        body = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+    if isinstance(body, dict) and isinstance(body.get("rows"), list):
+        body = body["rows"]
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail='Expected a JSON array, an object with a "rows" array, or NDJSON')
+    for row in body:
+        yield row
+
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as err:
+        # reported against the row instead of failing the whole stream
+        return _InvalidRow(str(err))
+
+
+def row_result(index: int, status: str, id: int | None = None, error: str | None = None) -> dict:
+    return {"index": index, "status": status, "id": id, "error": error}
+
+
+def update_batches(rows: list[BaseModel]) -> list[list[dict[str, Any]]]:
+    """
+    The fields each row sets, batched by the columns they set.
+
+    An executemany UPDATE sets the same columns on every row, so rows leaving out different
+    optional fields go in separate batches; the fields a row leaves out keep their value, as with
+    the single-row updates.
+    """
+    batches: dict[frozenset[str], list[dict[str, Any]]] = {}
+    for row in rows:
+        values = row.dict(exclude_unset=True)
+        batches.setdefault(frozenset(values), []).append(values)
+    return list(batches.values())
+
+
+def _validation_error(err: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc']) or 'row'}: {e['msg']}" for e in err.errors())
+
+
+async def run_bulk(request: Request, db: AsyncSession, row_schema: type[BaseModel], write_chunk: ChunkWriter) -> dict:
+    """
+    Validate the rows of a bulk request and hand them to write_chunk in chunks.
+
+    write_chunk receives (index, row) pairs and returns a result per row; it is expected to commit.
+    A database error fails the whole chunk, which is rolled back and reported row by row.
+    """
+    results: list[dict] = []
+
+    async def flush(chunk: list[tuple[int, Any]]) -> None:
+        try:
+            results.extend(await write_chunk(chunk))
+        except SQLAlchemyError as err:
+            await db.rollback()
+            message = str(err.orig if getattr(err, "orig", None) is not None else err)
+            results.extend(row_result(index, "error", error=message) for index, _ in chunk)
+
+    chunk: list[tuple[int, Any]] = []
+    index = 0
+    async for raw in read_rows(request):
+        if isinstance(raw, _InvalidRow):
+            results.append(row_result(index, "error", error=f"Invalid JSON: {raw.error}"))
+        else:
+            try:
+                chunk.append((index, row_schema.model_validate(raw)))
+            except ValidationError as err:
+                results.append(row_result(index, "error", error=_validation_error(err)))
+        index += 1
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+    results.sort(key=lambda result: result["index"])
+    failed = sum(1 for result in results if result["status"] == "error")
+    return {"total": len(results), "succeeded": len(results) - failed, "failed": failed, "results": results}
@@ -0,0 +1,182 @@
+"""
+Read-through cache for product and customer lookups.
+
+Entries are the serialized (JSON-ready) response bodies, keyed by entity id or by the query
+parameters of a list request. Writers call invalidate() after committing: it drops the cached
+entities and moves the entity's list entries to a new generation, so stale pages are never served.
+
+With read replicas, a lookup right after a write may read rows the replica has not received yet, so
+entries filled from a replica only live for REPLICA_LAG_SECONDS, and clients reading their own
+writes (from the primary) bypass the cached entries.
+"""
+
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Hashable, Optional
+
+from .database import REPLICA_LAG_SECONDS, read_target
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+# "memory://" for an in-process LRU, "redis://host:port/db" for a shared cache, "none" to disable
+CACHE_URL: str = os.getenv("CACHE_URL", "memory://")
+CACHE_TTL: int = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+
+class CacheBackend(ABC):
+    """Minimal key/value interface a cache backend has to provide."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Any | None: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None: ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None: ...
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU cache with a per-entry time to live."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float | None, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class RedisBackend(CacheBackend):
+    """Cache shared by every worker and replica, stored in Redis as JSON."""
+
+    def __init__(self, url: str) -> None:
+        if redis is None:
+            raise RuntimeError("CACHE_URL points to Redis but the 'redis' package is not installed")
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        await self.client.set(key, json.dumps(value), ex=ttl)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*keys)
+
+
+def create_backend(url: str) -> CacheBackend | None:
+    """Build the cache backend named by a CACHE_URL value."""
+    if url in ("", "none"):
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+backend: CacheBackend | None = create_backend(CACHE_URL)
+
+# called with (entity, ids) by invalidate(), for the other in-process copies of the data to follow
+invalidation_listeners: list[Callable[[str, tuple[Hashable, ...]], None]] = []
+
+# set while a batch with writes runs (see batch.py): the invalidations are collected here and made
+# once the batch has committed, and nothing is stored meanwhile, since the batch reads its own
+# uncommitted writes
+deferred_invalidations: ContextVar[list[tuple[str, tuple[Hashable, ...]]] | None] = ContextVar(
+    "deferred_invalidations", default=None
+)
+
+
+def _ttl() -> int:
+    if read_target.get() == "replica":
+        return min(CACHE_TTL, REPLICA_LAG_SECONDS)
+    return CACHE_TTL
+
+
+def _entity_key(entity: str, entity_id: Hashable) -> str:
+    return f"{entity}:{entity_id}"
+
+
+async def _list_key(store: CacheBackend, entity: str, params: dict[str, Any]) -> str:
+    # list entries are namespaced by a generation token that invalidate() replaces; a random
+    # token (rather than a counter) stays safe if the generation entry itself is evicted
+    generation_key = f"{entity}:list-generation"
+    generation = await store.get(generation_key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        await store.set(generation_key, generation)
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+    return f"{entity}:list:{generation}:{query}"
+
+
+async def lookup(entity: str, entity_id: Hashable) -> Any | None:
+    """Return the cached response for one entity, or None on a miss."""
+    if backend is None or read_target.get() == "pinned":
+        return None
+    return await backend.get(_entity_key(entity, entity_id))
+
+
+async def store(entity: str, entity_id: Hashable, value: Any) -> None:
+    if backend is not None and deferred_invalidations.get() is None:
+        await backend.set(_entity_key(entity, entity_id), value, _ttl())
+
+
+async def lookup_list(entity: str, params: dict[str, Any]) -> Any | None:
+    """Return the cached response for a list request with the given query parameters, or None on a miss."""
+    if backend is None or read_target.get() == "pinned":
+        return None
+    return await backend.get(await _list_key(backend, entity, params))
+
+
+async def store_list(entity: str, params: dict[str, Any], value: Any) -> None:
+    if backend is not None and deferred_invalidations.get() is None:
+        await backend.set(await _list_key(backend, entity, params), value, _ttl())
+
+
+async def invalidate(entity: str, *entity_ids: Hashable) -> None:
+    """Drop the cached entities with the given ids and every cached list of that entity."""
+    deferred = deferred_invalidations.get()
+    if deferred is not None:
+        deferred.append((entity, entity_ids))
+        return
+    for listener in invalidation_listeners:
+        listener(entity, entity_ids)
+    if backend is None:
+        return
+    await backend.delete(*(_entity_key(entity, entity_id) for entity_id in entity_ids))
+    await backend.set(f"{entity}:list-generation", uuid.uuid4().hex)
@@ -0,0 +1,262 @@
+"""
+In-process snapshot of the product catalog.
+
+With CATALOG_SNAPSHOT enabled, each API process keeps every product in memory as a compact
+__slots__ record, so that product reads and the price lookups of new orders skip the database and
+the ORM. The snapshot is loaded in the background when the app starts (reads go to the database
+until it is ready) and then refreshed every CATALOG_REFRESH_INTERVAL seconds with the rows whose
+updated_at has moved on. Writes made by this process are picked up right away, through the cache
+invalidations the routes already make; writes made by other processes show up after the next
+refresh, so their prices and stock can be that much out of date here.
+
+Every CATALOG_VERIFY_INTERVAL seconds the snapshot is compared with the database (ids and
+updated_at of every row), which catches rows deleted by other processes, and any difference is
+logged and repaired. When the catalog would take more than CATALOG_MAX_MB, the snapshot is dropped
+and reads go to the database.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Hashable, Iterable, Optional
+
+from sqlalchemy import select
+
+from . import cache, models
+from .database import AsyncReadSessionLocal, read_target
+from .pagination import decode_cursor, encode_cursor, page_limit
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT: bool = os.getenv("CATALOG_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+CATALOG_REFRESH_INTERVAL: float = float(os.getenv("CATALOG_REFRESH_INTERVAL", "5"))
+CATALOG_VERIFY_INTERVAL: float = float(os.getenv("CATALOG_VERIFY_INTERVAL", "300"))
+CATALOG_MAX_MB: float = float(os.getenv("CATALOG_MAX_MB", "256"))
+
+# each refresh reads the rows updated since a little before the previous one started, since a
+# row's updated_at is set when it is written, which can be a little before the transaction commits
+REFRESH_OVERLAP = timedelta(seconds=2)
+
+LOAD_BATCH_SIZE = 10_000
+
+# dict slot and sorted id list entry of each record, on top of the record and its values
+_INDEX_OVERHEAD = 120
+
+
+class ProductRecord:
+    """A product row, without the ORM's instrumentation and identity map bookkeeping."""
+
+    __slots__ = ("created_at", "description", "id", "name", "price", "stock", "updated_at")
+
+    def __init__(self, row) -> None:
+        self.id: int = row.id
+        self.name: str = row.name
+        self.description: Optional[str] = row.description
+        self.price: float = row.price
+        self.stock: Optional[int] = row.stock
+        self.created_at: Optional[datetime] = row.created_at
+        self.updated_at: Optional[datetime] = row.updated_at
+
+    def size(self) -> int:
+        """Approximate memory used by the record, in bytes."""
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, name)) for name in self.__slots__)
+
+
+_COLUMNS = [getattr(models.Product, name) for name in ProductRecord.__slots__]
+
+
+class Catalog:
+    """The products of the database, by id, along with their ids in order for list pages."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.records: dict[int, ProductRecord] = {}
+        self.ids: list[int] = []
+        self.bytes = 0
+        self.ready = False
+        # False once the snapshot has been given up
+        self.active = True
+        # when the last successful refresh (or the load) started
+        self.watermark: Optional[datetime] = None
+        # products written by this process, read from the database until the snapshot has them again
+        self.pending: set[int] = set()
+        self.refreshing: set[int] = set()
+        # set when this process created products, which list pages miss until the next refresh
+        self.incomplete = False
+        self.wakeup = asyncio.Event()
+
+    def serves(self) -> bool:
+        # clients reading their own writes from the primary bypass the snapshot like the cache
+        return self.ready and read_target.get() != "pinned"
+
+    def get(self, product_id: int) -> Optional[ProductRecord]:
+        """The record of a product, or None when the database has to be asked."""
+        if not self.serves() or product_id in self.pending or product_id in self.refreshing:
+            return None
+        return self.records.get(product_id)
+
+    def prices(self, product_ids: Iterable[int]) -> dict[int, float]:
+        """Prices of the given products that the snapshot has."""
+        if not self.serves():
+            return {}
+        records, pending, refreshing = self.records, self.pending, self.refreshing
+        return {
+            product_id: records[product_id].price
+            for product_id in product_ids
+            if product_id in records and product_id not in pending and product_id not in refreshing
+        }
+
+    def page(self, skip: int, limit: int, cursor: Optional[str]) -> Optional[dict]:
+        """A page of products as paginate() would return it, or None when the database has to be asked."""
+        if not self.serves() or self.pending or self.refreshing or self.incomplete or skip < 0:
+            return None
+        limit = page_limit(limit)
+        start = bisect_right(self.ids, decode_cursor(cursor)["id"]) if cursor is not None else 0
+        ids = self.ids[start + skip : start + skip + limit + 1]
+        next_cursor = None
+        if len(ids) > limit:
+            ids = ids[:limit]
+            next_cursor = encode_cursor({"id": ids[-1]})
+        return {"items": [self.records[product_id] for product_id in ids], "next_cursor": next_cursor}
+
+    def invalidate(self, entity: str, entity_ids: tuple[Hashable, ...]) -> None:
+        """Cache invalidation listener: re-read the products this process has just written."""
+        if entity != "product" or not self.active:
+            return
+        if entity_ids:
+            self.pending.update(entity_ids)
+        else:
+            self.incomplete = True
+        self.wakeup.set()
+
+    def _put(self, record: ProductRecord) -> None:
+        previous = self.records.get(record.id)
+        if previous is None:
+            self.ids.insert(bisect_right(self.ids, record.id), record.id)
+            self.bytes += _INDEX_OVERHEAD
+        else:
+            self.bytes -= previous.size()
+        self.records[record.id] = record
+        self.bytes += record.size()
+
+    def _remove(self, product_id: int) -> None:
+        record = self.records.pop(product_id, None)
+        if record is not None:
+            self.ids.pop(bisect_right(self.ids, product_id) - 1)
+            self.bytes -= record.size() + _INDEX_OVERHEAD
+
+    def _over_budget(self) -> bool:
+        if self.bytes <= self.max_bytes:
+            return False
+        logger.warning(
+            "The product catalog needs more than CATALOG_MAX_MB (%.0f MB); serving products from the database",
+            self.max_bytes / 2**20,
+        )
+        self.ready = self.active = False
+        self.records, self.ids, self.bytes = {}, [], 0
+        self.pending, self.refreshing = set(), set()
+        return True
+
+    async def load(self) -> bool:
+        """Load every product; returns False if the catalog does not fit in memory."""
+        started = datetime.utcnow()
+        stmt = select(*_COLUMNS).order_by(models.Product.id).execution_options(yield_per=LOAD_BATCH_SIZE)
+        async with AsyncReadSessionLocal() as db:
+            async for rows in (await db.stream(stmt)).partitions():
+                for row in rows:
+                    self._put(ProductRecord(row))
+                if self._over_budget():
+                    return False
+        # rows changed while loading are read again by the first refresh
+        self.watermark = started
+        self.ready = True
+        logger.info(
+            "Loaded %d products into the catalog snapshot (about %.1f MB)", len(self.records), self.bytes / 2**20
+        )
+        return True
+
+    async def refresh(self) -> None:
+        """Apply the products changed since the last refresh, and those this process wrote."""
+        if self.watermark is None:
+            # not loaded yet: the load reads them
+            return
+        self.refreshing, self.pending = self.pending, set()
+        self.incomplete = False
+        started = datetime.utcnow()
+        changed = models.Product.updated_at >= self.watermark - REFRESH_OVERLAP
+        if self.refreshing:
+            changed = changed | models.Product.id.in_(self.refreshing)
+        try:
+            async with AsyncReadSessionLocal() as db:
+                rows = (await db.execute(select(*_COLUMNS).filter(changed))).all()
+        except BaseException:
+            # read them again next time
+            self.pending |= self.refreshing
+            self.refreshing = set()
+            raise
+        missing = set(self.refreshing)
+        for row in rows:
+            self._put(ProductRecord(row))
+            missing.discard(row.id)
+        # written by this process and no longer in the database
+        for product_id in missing:
+            self._remove(product_id)
+        self.refreshing = set()
+        self.watermark = started
+        self._over_budget()
+
+    async def verify(self) -> int:
+        """Compare the snapshot with the database and repair it; returns the number of products that differed."""
+        async with AsyncReadSessionLocal() as db:
+            versions = dict((await db.execute(select(models.Product.id, models.Product.updated_at))).all())
+        stale = [
+            product_id
+            for product_id, updated_at in versions.items()
+            if product_id not in self.records or self.records[product_id].updated_at != updated_at
+        ]
+        removed = [product_id for product_id in self.records if product_id not in versions]
+        for product_id in removed:
+            self._remove(product_id)
+        if stale:
+            self.pending.update(stale)
+            await self.refresh()
+        if stale or removed:
+            logger.warning(
+                "The catalog snapshot differed from the database for %d products; repaired", len(stale) + len(removed)
+            )
+        return len(stale) + len(removed)
+
+    async def run(self) -> None:
+        """Load the snapshot, then keep it up to date until cancelled."""
+        try:
+            if not await self.load():
+                return
+        except Exception:
+            self.active = False
+            logger.exception("Loading the catalog snapshot failed; serving products from the database")
+            return
+        loop = asyncio.get_running_loop()
+        next_verify = loop.time() + CATALOG_VERIFY_INTERVAL
+        while self.ready:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=CATALOG_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                if loop.time() >= next_verify:
+                    next_verify = loop.time() + CATALOG_VERIFY_INTERVAL
+                    await self.verify()
+                else:
+                    await self.refresh()
+            except Exception:
+                logger.exception("Refreshing the catalog snapshot failed")
+
+
+catalog = Catalog(int(CATALOG_MAX_MB * 2**20))
+
+if CATALOG_SNAPSHOT:
+    cache.invalidation_listeners.append(catalog.invalidate)
@@ -0,0 +1,275 @@
+"""
+Change feed.
+
+Writes to products, customers and orders append to the change_log table, in the same transaction:
+the entity and its id, the action (created, updated or deleted), and the fields the change set,
+such as the status of an order or the stock of a product. Stock taken or given back by orders is
+recorded as an update of the product. The id of a change is its position in the feed.
+
+Clients follow the feed instead of polling the resources: GET /changes/ streams the changes as
+server-sent events, resuming after `since` (or the Last-Event-ID of a reconnecting EventSource;
+streams end after CHANGES_STREAM_TIMEOUT seconds, so that they don't hold up a server's shutdown),
+and GET /changes/poll (the poll_changes MCP tool) waits for the changes after `since` and returns
+them.
+
+Each API process reads the log once for all of its subscribers: from the first subscription on, a
+single task reads the new changes every CHANGES_POLL_INTERVAL seconds (and as soon as this process
+commits a change), keeps the last CHANGES_BUFFER_SIZE of them in memory and wakes the subscribers
+up. Clients resuming from further back are served from the table. Changes are kept for
+CHANGES_RETENTION seconds; resuming from an older change fails with 410.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Any, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import AsyncReadSessionLocal, AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED: bool = os.getenv("CHANGE_FEED", "true").lower() in ("1", "true", "yes")
+CHANGES_POLL_INTERVAL: float = float(os.getenv("CHANGES_POLL_INTERVAL", "0.5"))
+CHANGES_BUFFER_SIZE: int = int(os.getenv("CHANGES_BUFFER_SIZE", "10000"))
+CHANGES_RETENTION: int = int(os.getenv("CHANGES_RETENTION", str(7 * 86400)))  # seconds
+CHANGES_SWEEP_INTERVAL: float = float(os.getenv("CHANGES_SWEEP_INTERVAL", "300"))
+CHANGES_HEARTBEAT: float = float(os.getenv("CHANGES_HEARTBEAT", "15"))  # seconds between SSE keep-alives
+CHANGES_MAX_WAIT: float = float(os.getenv("CHANGES_MAX_WAIT", "30"))  # longest long-poll, in seconds
+CHANGES_STREAM_TIMEOUT: float = float(os.getenv("CHANGES_STREAM_TIMEOUT", "300"))  # longest SSE connection
+
+ENTITIES: tuple[str, ...] = ("product", "customer", "order")
+
+# the fields recorded with the changes of each entity
+FIELDS: dict[str, tuple[str, ...]] = {
+    "product": ("name", "price", "stock"),
+    "customer": ("name", "email"),
+    "order": ("customer_id", "status", "total_amount"),
+}
+
+# most changes a single read returns
+PAGE_SIZE = 1000
+
+# how long a missing id is waited for: with several writers (PostgreSQL), a change can commit after
+# changes with higher ids, and a transaction that rolled back leaves its ids unused for good
+GAP_TIMEOUT = 2.0
+
+_COLUMNS = (
+    models.Change.id,
+    models.Change.entity,
+    models.Change.entity_id,
+    models.Change.action,
+    models.Change.data,
+    models.Change.created_at,
+)
+
+
+def fields(entity: str, obj: Any) -> dict[str, Any]:
+    """The recorded fields of an entity, from an ORM object or a schema."""
+    return {name: getattr(obj, name) for name in FIELDS[entity]}
+
+
+async def record(
+    db: AsyncSession, entity: str, action: str, changes: Iterable[tuple[int, Optional[dict[str, Any]]]]
+) -> None:
+    """Append (entity_id, fields) changes to the log, without committing."""
+    if not CHANGE_FEED:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {
+            "entity": entity,
+            "entity_id": entity_id,
+            "action": action,
+            "data": None if data is None else json.dumps(data),
+            "created_at": now,
+        }
+        for entity_id, data in changes
+    ]
+    if rows:
+        await db.execute(insert(models.Change), rows)
+        # wakes the feed up once committed, see _committed()
+        db.info["changes"] = True
+
+
+def _change(row) -> dict[str, Any]:
+    return {
+        "id": row.id,
+        "entity": row.entity,
+        "entity_id": row.entity_id,
+        "action": row.action,
+        "data": None if row.data is None else json.loads(row.data),
+        "created_at": row.created_at.isoformat(),
+    }
+
+
+class ChangeFeed:
+    """The tail of the change log, read by one task and shared by every subscriber of this process."""
+
+    def __init__(self, buffer_size: int) -> None:
+        self.buffer_size = buffer_size
+        # the latest changes, in order; trimmed to buffer_size once it has grown to twice that
+        self.buffer: list[dict[str, Any]] = []
+        # id of the last change read, and of the last one before the buffer
+        self.last_id = 0
+        self.buffer_start = 0
+        # set, and replaced, whenever changes are read
+        self.updated = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        self.gap_since: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.started: Optional[asyncio.Future] = None
+
+    async def start(self) -> None:
+        """Start reading the log, from its current end, unless this process already does."""
+        if self.started is None:
+            self.started = asyncio.get_running_loop().create_future()
+            self.task = asyncio.create_task(self.run(self.started))
+        await asyncio.shield(self.started)
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+        self.task = self.started = None
+        self.buffer, self.last_id, self.buffer_start, self.gap_since = [], 0, 0, None
+        self.updated, self.wakeup = asyncio.Event(), asyncio.Event()
+
+    def notify(self) -> None:
+        """Read the log now, since this process has committed changes."""
+        if self.task is not None:
+            self.wakeup.set()
+
+    async def run(self, started: asyncio.Future) -> None:
+        try:
+            async with AsyncReadSessionLocal() as db:
+                last_id = await db.scalar(select(func.max(models.Change.id)))
+        except (SQLAlchemyError, OSError) as err:
+            started.set_exception(err)
+            self.started = self.task = None
+            return
+        self.last_id = self.buffer_start = last_id or 0
+        started.set_result(None)
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=CHANGES_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.read()
+            except Exception:
+                logger.exception("Reading the change log failed")
+
+    async def read(self) -> None:
+        """Append the new changes to the buffer and wake the subscribers up."""
+        stmt = select(*_COLUMNS).filter(models.Change.id > self.last_id).order_by(models.Change.id)
+        async with AsyncReadSessionLocal() as db:
+            rows = (await db.execute(stmt.limit(PAGE_SIZE))).all()
+        now = asyncio.get_running_loop().time()
+        read = []
+        for row in rows:
+            if row.id != self.last_id + 1:
+                if self.gap_since is None:
+                    self.gap_since = now
+                if now - self.gap_since < GAP_TIMEOUT:
+                    break
+            self.gap_since = None
+            read.append(_change(row))
+            self.last_id = row.id
+        if not read:
+            return
+        self.buffer.extend(read)
+        if len(self.buffer) >= 2 * self.buffer_size:
+            excess = len(self.buffer) - self.buffer_size
+            self.buffer_start = self.buffer[excess - 1]["id"]
+            del self.buffer[:excess]
+        if len(rows) == PAGE_SIZE:
+            # more to read
+            self.wakeup.set()
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def changes_after(
+        self, since: int, entities: Optional[set[str]], limit: int
+    ) -> tuple[list[dict[str, Any]], int]:
+        """Up to `limit` changes after `since`; returns them and the id to resume from."""
+        if since >= self.last_id:
+            return [], since
+        if since < self.buffer_start:
+            changes = await self._read_table(since, entities, limit)
+            # with fewer than limit changes, the table has nothing else up to the end of the buffer
+            return changes, changes[-1]["id"] if len(changes) == limit else self.last_id
+        changes = []
+        resume = since
+        for change in self.buffer[bisect_right(self.buffer, since, key=itemgetter("id")) :]:
+            if entities is None or change["entity"] in entities:
+                if len(changes) == limit:
+                    break
+                changes.append(change)
+            resume = change["id"]
+        return changes, resume
+
+    async def _read_table(self, since: int, entities: Optional[set[str]], limit: int) -> list[dict[str, Any]]:
+        stmt = select(*_COLUMNS).filter(models.Change.id > since, models.Change.id <= self.last_id)
+        if entities is not None:
+            stmt = stmt.filter(models.Change.entity.in_(entities))
+        async with AsyncReadSessionLocal() as db:
+            oldest = await db.scalar(select(func.min(models.Change.id)))
+            if since + 1 < (oldest if oldest is not None else self.last_id + 1):
+                raise HTTPException(
+                    status_code=410, detail="The changes after this id are no longer kept; read the current state again"
+                )
+            rows = (await db.execute(stmt.order_by(models.Change.id).limit(limit))).all()
+        return [_change(row) for row in rows]
+
+    async def wait(
+        self, since: Optional[int], entities: Optional[set[str]], limit: int, timeout: float
+    ) -> tuple[list[dict[str, Any]], int]:
+        """Changes after `since` (or from now on), waiting up to `timeout` seconds for some."""
+        await self.start()
+        if since is None:
+            since = self.last_id
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            updated = self.updated
+            changes, since = await self.changes_after(since, entities, limit)
+            remaining = deadline - loop.time()
+            if changes or remaining <= 0:
+                return changes, since
+            try:
+                await asyncio.wait_for(updated.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+feed = ChangeFeed(CHANGES_BUFFER_SIZE)
+
+
+@event.listens_for(Session, "after_commit")
+def _committed(session: Session) -> None:
+    if session.info.pop("changes", False):
+        feed.notify()
+
+
+async def sweep_changes() -> None:
+    """Delete the changes older than CHANGES_RETENTION every CHANGES_SWEEP_INTERVAL seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(CHANGES_SWEEP_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                cutoff = datetime.utcnow() - timedelta(seconds=CHANGES_RETENTION)
+                await db.execute(delete(models.Change).where(models.Change.created_at < cutoff))
+                await db.commit()
+        except Exception:
+            logger.exception("Deleting old changes failed")
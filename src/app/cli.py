@@ -0,0 +1,67 @@
+"""
+Command line tasks that prepare a deployment, instead of every server doing them as it starts (see
+app/startup.py).
+
+To run them, execute (from src/):
+    python -m app.cli setup                 # migrate, then create the sample data in an empty database
+    python -m app.cli setup --no-seed
+    python -m app.cli migrate
+    python -m app.cli seed
+    python -m app.cli build-schema --output openapi.json
+"""
+
+import argparse
+import json
+import time
+
+
+def setup_database(seed: bool = True) -> None:
+    from .database import engine
+    from .migrations import migrate
+    from .sample_data import create_sample_data
+
+    # Create the tables, or apply the migrations an existing database is missing
+    migrate(engine, verbose=True)
+
+    # Populate the database (only if empty)
+    if seed:
+        create_sample_data()
+
+
+def write_schema(output: str) -> None:
+    from .main import app
+    from .startup import build_schema
+
+    start = time.perf_counter()
+    schema = build_schema(app)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(schema, file, separators=(",", ":"))
+    tools = len(schema["mcp"]["tools"])
+    print(f"Wrote the OpenAPI schema and {tools} MCP tools to {output} ({time.perf_counter() - start:.1f}s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    setup = commands.add_parser("setup", help="bring the schema up to date and create the sample data")
+    setup.add_argument("--no-seed", dest="seed", action="store_false", help="do not create the sample data")
+    commands.add_parser("migrate", help="bring the schema up to date (see app/migrations.py)")
+    commands.add_parser("seed", help="create the sample data, in an empty database")
+    build = commands.add_parser("build-schema", help="write the OpenAPI schema and MCP tools for OPENAPI_SCHEMA_FILE")
+    build.add_argument("--output", default="openapi.json", help="file to write (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "setup":
+        setup_database(args.seed)
+    elif args.command == "migrate":
+        setup_database(seed=False)
+    elif args.command == "seed":
+        from .sample_data import create_sample_data
+
+        create_sample_data()
+    else:
+        write_schema(args.output)
+
+
+if __name__ == "__main__":
+    main()
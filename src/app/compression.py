@@ -0,0 +1,239 @@
+"""
+Negotiated response compression.
+
+Responses are compressed with the best encoding the client accepts (Accept-Encoding, q-values
+honoured) among COMPRESSION_ENCODINGS, in that order of preference: zstd and br (brotli) when their
+packages are installed, and gzip. Bodies smaller than COMPRESSION_MIN_SIZE are sent as they are,
+as are media types that do not compress (only text, JSON, NDJSON, CSV and XML are compressed).
+
+Streaming responses (the exports) are compressed chunk by chunk, flushing the compressor after
+each chunk, so that rows still reach the client as they are produced instead of waiting for the
+compressor's buffer to fill; this is also what lets an HTTP/2 proxy in front of the app forward
+them as DATA frames right away. Server-sent event streams are left alone, since some proxies and
+clients buffer compressed event streams.
+
+The API calls the MCP tools make in-process are not compressed; the /mcp responses carrying their
+results are.
+"""
+
+import os
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import MCP_API_HOST
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+AVAILABLE_ENCODINGS: tuple[str, ...] = tuple(
+    encoding
+    for encoding, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True))
+    if available
+)
+
+# in order of preference; "none" disables compression
+COMPRESSION_ENCODINGS: list[str] = [
+    encoding.strip().lower()
+    for encoding in os.getenv("COMPRESSION_ENCODINGS", ",".join(AVAILABLE_ENCODINGS)).split(",")
+    if encoding.strip() and encoding.strip().lower() != "none"
+]
+COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # bytes
+COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))  # 1-9
+COMPRESSION_BROTLI_LEVEL: int = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))  # 0-11
+COMPRESSION_ZSTD_LEVEL: int = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))  # 1-22
+
+for _encoding in COMPRESSION_ENCODINGS:
+    if _encoding not in ("zstd", "br", "gzip"):
+        raise ValueError(f"Unsupported encoding in COMPRESSION_ENCODINGS: {_encoding}")
+    if _encoding not in AVAILABLE_ENCODINGS:
+        package = "zstandard" if _encoding == "zstd" else "brotli"
+        raise RuntimeError(f"COMPRESSION_ENCODINGS includes {_encoding} but the '{package}' package is not installed")
+
+COMPRESSIBLE_TYPES: tuple[str, ...] = (
+    "application/json",
+    "application/x-ndjson",
+    "application/ndjson",
+    "application/jsonl",
+    "application/xml",
+    "application/javascript",
+)
+
+
+class Compressor:
+    """Incremental compressor for one encoding."""
+
+    def __init__(self, encoding: str, level: Optional[int] = None) -> None:
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._gzip = zlib.compressobj(COMPRESSION_GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_LEVEL if level is None else level)
+        else:
+            level = COMPRESSION_ZSTD_LEVEL if level is None else level
+            self._zstd = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self._gzip.compress(data)
+        if self.encoding == "br":
+            return self._brotli.process(data)
+        return self._zstd.compress(data)
+
+    def flush(self) -> bytes:
+        """Output everything compressed so far, keeping the stream open."""
+        if self.encoding == "gzip":
+            return self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._brotli.flush()
+        return self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._gzip.flush()
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zstd.flush()
+
+
+def negotiate(accept_encoding: str, encodings: list[str]) -> Optional[str]:
+    """The encoding to use for an Accept-Encoding header: the client's highest q-value, then our preference."""
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    wildcard = accepted.get("*", 0.0)
+    best: Optional[str] = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(headers: Headers) -> bool:
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type == "text/event-stream":
+        return False
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES or media_type.endswith("+json")
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing the responses of clients that accept it."""
+
+    def __init__(self, app: ASGIApp, encodings: list[str], minimum_size: int) -> None:
+        self.app = app
+        self.encodings = encodings
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if headers.get("host", "").split(":")[0] == MCP_API_HOST:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(headers.get("accept-encoding", ""), self.encodings)
+        await CompressedResponder(encoding, self.minimum_size, send).run(self.app, scope, receive)
+
+
+class CompressedResponder:
+    """
+    Compresses one response.
+
+    The start message is held back along with the body until either the whole body or
+    minimum_size bytes of it have been seen: a complete body is sent with a Content-Length,
+    compressed only if it is large enough, while a longer stream is compressed chunk by chunk.
+    Responses that announce their Content-Length are always buffered whole, since the app has
+    their body in memory anyway (the middlewares in main.py pass it on in several messages).
+    """
+
+    def __init__(self, encoding: Optional[str], minimum_size: int, send: Send) -> None:
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = send
+        # the start message held back, its headers and the encoding to use, until the body is seen
+        self.held: Optional[tuple[Message, MutableHeaders, str]] = None
+        self.streaming = True
+        self.buffer = bytearray()
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def run(self, app: ASGIApp, scope: Scope, receive: Receive) -> None:
+        await app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: Message) -> None:
+        if self.passthrough:
+            await self.send(message)
+        elif message["type"] == "http.response.start":
+            await self.start_response(message)
+        elif message["type"] != "http.response.body":
+            await self.send(message)
+        elif self.compressor is not None:
+            await self.send_chunk(self.compressor, message.get("body", b""), message.get("more_body", False))
+        elif self.held is not None:
+            self.buffer += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if not more_body or (self.streaming and len(self.buffer) >= self.minimum_size):
+                await self.send_buffered(*self.held, more_body)
+        else:
+            await self.send(message)
+
+    async def send_buffered(self, start: Message, headers: MutableHeaders, encoding: str, more_body: bool) -> None:
+        body, self.buffer = bytes(self.buffer), bytearray()
+        if not more_body and len(body) < self.minimum_size:
+            # small enough to go out as it is
+            self.passthrough = True
+            await self.send(start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+        self.compressor = compressor = Compressor(encoding)
+        headers["Content-Encoding"] = encoding
+        if more_body:
+            del headers["Content-Length"]
+            await self.send(start)
+            await self.send_chunk(compressor, body, True)
+        else:
+            data = compressor.compress(body) + compressor.finish()
+            headers["Content-Length"] = str(len(data))
+            await self.send(start)
+            await self.send({"type": "http.response.body", "body": data})
+
+    async def start_response(self, message: Message) -> None:
+        headers = MutableHeaders(raw=message["headers"])
+        if compressible(headers) and "content-encoding" not in headers:
+            # the response depends on Accept-Encoding even when it is not compressed this time
+            headers.add_vary_header("Accept-Encoding")
+            if self.encoding is not None:
+                self.held = (message, headers, self.encoding)
+                self.streaming = "content-length" not in headers
+                return
+        self.passthrough = True
+        await self.send(message)
+
+    async def send_chunk(self, compressor: Compressor, body: bytes, more_body: bool) -> None:
+        data = compressor.compress(body)
+        # flushing keeps a stream flowing as it is produced, at the cost of a few bytes per chunk
+        data += compressor.flush() if more_body else compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,56 @@
+"""
+Conditional request support (ETag, If-None-Match, If-Match).
+
+ETags are weak validators built from a row's id and updated_at column, so they can be computed
+without serializing the response body. A list ETag covers the ids of the page, the newest
+updated_at among them and the next cursor.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+from fastapi import HTTPException, Request, Response, status
+
+
+def _version(updated_at: Optional[datetime]) -> str:
+    return updated_at.strftime("%Y%m%d%H%M%S%f") if updated_at else "0"
+
+
+def entity_etag(row: Any) -> str:
+    """Weak ETag for a single row."""
+    return f'W/"{row.id}-{_version(row.updated_at)}"'
+
+
+def page_etag(rows: Iterable[Any], next_cursor: Optional[str] = None) -> str:
+    """Weak ETag for a page of rows."""
+    rows = list(rows)
+    newest = max((row.updated_at for row in rows if row.updated_at), default=None)
+    ids = ",".join(str(row.id) for row in rows)
+    digest = hashlib.sha1(f"{ids}|{_version(newest)}|{next_cursor}".encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def _matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ETag against an If-None-Match / If-Match header value."""
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def conditional_get(request: Request, response: Response, etag: str, body: Any) -> Any:
+    """Return the body, or an empty 304 response when the client already holds this version."""
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return body
+
+
+def check_if_match(request: Request, etag: str) -> None:
+    """Reject a write with 412 when If-Match is sent and the row has changed since the client read it."""
+    header = request.headers.get("if-match")
+    if header is not None and not _matches(header, etag):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Resource has been modified")
@@ -1,27 +1,327 @@
+import itertools
 import os
-from typing import Any, Generator
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Iterator
 
-from sqlalchemy import Engine, create_engine
+from fastapi import Request
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .startup import FAST_START
 
 SQLALCHEMY_DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
-# Use connect_args only for SQLite
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    engine: Engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Read replicas (comma separated URLs) for the read-only routes, used in turn
+DATABASE_READ_URLS: list[str] = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+# Seconds a client keeps reading from the primary after a write, to cover the replication lag
+REPLICA_LAG_SECONDS: int = int(os.getenv("REPLICA_LAG_SECONDS", "5"))
+# Clients send this header (or keep the cookie set after their writes) to read from the primary
+READ_PRIMARY_HEADER = "X-Read-Primary"
+READ_PRIMARY_COOKIE = "read_primary"
+
+# Connection pool settings for the async engine (ignored by SQLite)
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Count the queries run by each request ("true" reports them, "strict" also fails requests over budget)
+DB_QUERY_DEBUG: str = os.getenv("DB_QUERY_DEBUG", "false").lower()
+DB_QUERY_BUDGET: int = int(os.getenv("DB_QUERY_BUDGET", "10"))
+
+# SQLite tuning: WAL lets reads proceed while an order is written, and the API writes through a
+# single connection so that concurrent writes queue up instead of failing with "database is locked"
+SQLITE_TUNING: bool = os.getenv("SQLITE_TUNING", "true").lower() in ("1", "true", "yes")
+SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", str(64 * 1024)))  # KiB per connection
+SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+SQLITE_READ_POOL_SIZE: int = int(os.getenv("SQLITE_READ_POOL_SIZE", "8"))
+
+# Async drivers used when DATABASE_URL names a sync (or no) driver
+ASYNC_DRIVERS: dict[str, str] = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def get_async_url(url: str) -> str:
+    """Return the async driver variant of a database URL, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    sa_url = make_url(url)
+    backend = sa_url.get_backend_name()
+    if backend in ASYNC_DRIVERS and sa_url.get_driver_name() != ASYNC_DRIVERS[backend]:
+        sa_url = sa_url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return sa_url.render_as_string(hide_password=False)
+
+
+def is_tuned_sqlite(url: str) -> bool:
+    """Whether the tuning profile applies: a SQLite database file (in-memory databases are per connection)."""
+    sa_url = make_url(url)
+    return SQLITE_TUNING and sa_url.get_backend_name() == "sqlite" and sa_url.database not in (None, "", ":memory:")
+
+
+def tune_sqlite(sync_engine: Engine, writer: bool = False, read_only: bool = False) -> None:
+    """
+    Set the tuning pragmas on every new connection of an engine.
+
+    Writer connections take the write lock when their transaction begins (BEGIN IMMEDIATE), so a
+    transaction that reads before it writes cannot fail halfway when another process holds the lock;
+    they wait up to busy_timeout instead. Read-only connections refuse writes.
+    """
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record) -> None:
+        if writer:
+            # let SQLAlchemy emit BEGIN itself, see the "begin" listener below
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    if writer:
+
+        @event.listens_for(sync_engine, "begin")
+        def _begin_immediate(conn) -> None:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+SQLALCHEMY_ASYNC_DATABASE_URL: str = get_async_url(SQLALCHEMY_DATABASE_URL)
+SQLITE_TUNED: bool = is_tuned_sqlite(SQLALCHEMY_DATABASE_URL)
+
+# The engines (created by create_engines, at import unless FAST_START defers it to their first use):
+# a sync engine, used by scripts (schema creation, sample data), and async engines, used by the API
+engine: Engine
+async_engine: AsyncEngine
+async_read_engine: AsyncEngine
+replica_engines: list[AsyncEngine]
+async_engines: set[AsyncEngine]
+_replicas: Iterator[AsyncEngine]
+_ENGINES = ("engine", "async_engine", "async_read_engine", "replica_engines", "async_engines")
+_engines_lock = threading.Lock()
+_engines_created = False
 
-SessionLocal: sessionmaker[Session] = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def create_read_engine(url: str) -> AsyncEngine:
+    """Async engine for read-only sessions; for a tuned SQLite file, a pool of query_only connections."""
+    async_url = get_async_url(url)
+    if is_tuned_sqlite(url):
+        read_engine = create_async_engine(
+            async_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=SQLITE_READ_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+        tune_sqlite(read_engine.sync_engine, read_only=True)
+        return read_engine
+    if url.startswith("sqlite"):
+        return create_async_engine(async_url)
+    return create_async_engine(
+        async_url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+
+class _EnginesOnFirstUse:
+    """Creates the engines (see create_engines) before the first session of a session factory."""
+
+    def __call__(self, **local_kw: Any) -> Any:
+        create_engines()
+        return super().__call__(**local_kw)
+
+
+class LazySessionMaker(_EnginesOnFirstUse, sessionmaker):
+    pass
+
+
+class LazyAsyncSessionMaker(_EnginesOnFirstUse, async_sessionmaker):
+    pass
+
+
+SessionLocal: sessionmaker[Session] = LazySessionMaker(autocommit=False, autoflush=False)
+
+AsyncSessionLocal: async_sessionmaker[AsyncSession] = LazyAsyncSessionMaker(autoflush=False, expire_on_commit=False)
+
+AsyncReadSessionLocal: async_sessionmaker[AsyncSession] = LazyAsyncSessionMaker(autoflush=False, expire_on_commit=False)
 
 Base: Any = declarative_base()
 
 
-def get_db() -> Generator[Session, Any, None]:
-    db: Session = SessionLocal()
+class QueryCounter:
+    """SQL statements run within a request (or a count_queries block), their duration and the ORM rows loaded."""
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.duration: float = 0.0
+        self.rows: int = 0
+
+
+query_counter: ContextVar[QueryCounter | None] = ContextVar("query_counter", default=None)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    counter = query_counter.get()
+    if counter is not None:
+        counter.count += 1
+        context._query_started = time.perf_counter()
+
+
+def _time_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    counter = query_counter.get()
+    started = getattr(context, "_query_started", None)
+    if counter is not None and started is not None:
+        counter.duration += time.perf_counter() - started
+
+
+def create_engines() -> None:
+    """Create the engines and bind the session factories to them; later calls do nothing."""
+    global engine, async_engine, async_read_engine, replica_engines, async_engines, _replicas, _engines_created
+    if _engines_created:
+        return
+    with _engines_lock:
+        if _engines_created:
+            return
+
+        # Use connect_args only for SQLite
+        if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+            engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+        else:
+            engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+        # writes go through async_engine and reads through async_read_engine, which are the same
+        # engine unless SQLite is tuned
+        if SQLITE_TUNED:
+            # a single writer connection serializes the writes of this process (aiosqlite defaults to no pooling)
+            async_engine = create_async_engine(
+                SQLALCHEMY_ASYNC_DATABASE_URL,
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=DB_POOL_TIMEOUT,
+            )
+            async_read_engine = create_read_engine(SQLALCHEMY_DATABASE_URL)
+            tune_sqlite(engine)
+            tune_sqlite(async_engine.sync_engine, writer=True)
+        else:
+            async_engine = async_read_engine = create_read_engine(SQLALCHEMY_DATABASE_URL)
+
+        # Replicas serve the read-only routes, except for clients reading their own writes
+        replica_engines = [create_read_engine(url) for url in DATABASE_READ_URLS]
+        _replicas = itertools.cycle(replica_engines)
+        async_engines = {async_engine, async_read_engine, *replica_engines}
+
+        for _engine in {engine, *(async_engine.sync_engine for async_engine in async_engines)}:
+            event.listen(_engine, "before_cursor_execute", _count_query)
+            event.listen(_engine, "after_cursor_execute", _time_query)
+
+        SessionLocal.configure(bind=engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+        AsyncReadSessionLocal.configure(bind=async_read_engine)
+        _engines_created = True
+
+
+def __getattr__(name: str) -> Any:
+    # the engines are looked up through the module until they exist (see create_engines)
+    if name in _ENGINES:
+        create_engines()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if not FAST_START:
+    create_engines()
+
+
+@event.listens_for(Base, "load", propagate=True)
+def _count_row(target, context) -> None:
+    counter = query_counter.get()
+    if counter is not None:
+        counter.rows += 1
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    """Count the queries run inside the block, e.g. to assert an endpoint stays within a query budget in tests."""
+    counter = QueryCounter()
+    token = query_counter.set(counter)
     try:
+        yield counter
+    finally:
+        query_counter.reset(token)
+
+
+async def dispose_engines() -> None:
+    """Close the pooled connections of the async engines (aiosqlite connections keep a thread each)."""
+    if not _engines_created:
+        return
+    for async_engine in async_engines:
+        await async_engine.dispose()
+
+
+# where the read session of the current request reads from: "replica", "pinned" (the primary, for a
+# client reading its own writes), or None when no replicas are configured
+read_target: ContextVar[str | None] = ContextVar("read_target", default=None)
+
+# the session shared by the operations of a batch request (see batch.py)
+batch_session: ContextVar[AsyncSession | None] = ContextVar("batch_session", default=None)
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Whether a client asked to read from the primary, or wrote recently (see main.py)."""
+    return (
+        request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true", "yes")
+        or READ_PRIMARY_COOKIE in request.cookies
+    )
+
+
+def read_engine(request: Request) -> tuple[AsyncEngine, str | None]:
+    """Pick the engine for a read-only request: the next replica in turn, or the primary."""
+    create_engines()
+    if not replica_engines:
+        return async_read_engine, None
+    if reads_from_primary(request):
+        return async_read_engine, "pinned"
+    return next(_replicas), "replica"
+
+
+async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # lets the client read its own writes from the primary while the replicas catch up
+    request.state.used_primary = True
+    db = batch_session.get()
+    if db is not None:
+        yield db
+        return
+    async with AsyncSessionLocal() as db:
         yield db
+
+
+async def get_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only routes, on a replica when configured; it never waits for the SQLite writer."""
+    db = batch_session.get()
+    if db is not None:
+        yield db
+        return
+    bind, target = read_engine(request)
+    token = read_target.set(target)
+    try:
+        async with AsyncReadSessionLocal(bind=bind) as db:
+            yield db
     finally:
-        db.close()
+        read_target.reset(token)
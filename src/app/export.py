@@ -0,0 +1,85 @@
+"""
+Streaming export of full tables as NDJSON or CSV.
+
+Rows are read through a server-side cursor in batches of EXPORT_BATCH_SIZE as plain tuples,
+without building ORM objects or pydantic models, and written out batch by batch, so memory use
+does not grow with the size of the table.
+"""
+
+import csv
+import io
+import json
+import os
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .database import read_engine
+
+EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+# OpenAPI description of an export response, passed as the route's responses
+EXPORT_RESPONSES: dict[int | str, dict[str, Any]] = {
+    200: {
+        "description": "All rows of the table, one per line",
+        "content": {NDJSON_MEDIA_TYPE: {}, CSV_MEDIA_TYPE: {}},
+    }
+}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def _batches(engine: AsyncEngine, model: Any) -> AsyncIterator[list[tuple]]:
+    columns = model.__table__.columns
+    stmt = select(*columns).order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        async for batch in result.partitions():
+            yield batch
+
+
+async def _ndjson(engine: AsyncEngine, model: Any) -> AsyncIterator[str]:
+    names = model.__table__.columns.keys()
+    # closed along with the stream (e.g. when the client disconnects), so that its connection is released at once
+    async with aclosing(_batches(engine, model)) as batches:
+        async for batch in batches:
+            yield "".join(json.dumps(dict(zip(names, row)), default=_json_default) + "\n" for row in batch)
+
+
+async def _csv(engine: AsyncEngine, model: Any) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(model.__table__.columns.keys())
+    async with aclosing(_batches(engine, model)) as batches:
+        async for batch in batches:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    # header only, for an empty table
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(request: Request, model: Any, filename: str) -> StreamingResponse:
+    """Stream every row of a model's table in the format asked for by the Accept header (NDJSON by default)."""
+    engine, _ = read_engine(request)
+    if CSV_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(
+            _csv(engine, model),
+            media_type=CSV_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        )
+    return StreamingResponse(_ndjson(engine, model), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,221 @@
+"""
+Idempotency keys for the write endpoints.
+
+A write request carrying an `Idempotency-Key` header (or, for the MCP tools, an `idempotency_key`
+query parameter) is run once: the first request claims the key in the idempotency_keys table, and
+its response is stored there for IDEMPOTENCY_TTL seconds. Retries with the same key get the stored
+response back without the endpoint running again, and duplicates arriving while the first request
+is still running wait for it to finish. A key reused for a different request (method, path, query
+or body) is rejected with 422.
+
+Server errors (5xx) are not stored, so that the request can be retried. A claim left behind by a
+process that died mid-request expires after IDEMPOTENCY_LOCK_TIMEOUT seconds.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Header, Query, Request, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+from .database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds responses are kept; 0 disables keys
+IDEMPOTENCY_LOCK_TIMEOUT: int = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "300"))  # should exceed the slowest write
+IDEMPOTENCY_SWEEP_INTERVAL: float = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "60"))
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_PARAM = "idempotency_key"
+MAX_KEY_LENGTH = 255
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# how often a duplicate checks whether the request it waits on (in another process) has finished
+_POLL_INTERVAL = 0.1
+
+# keys claimed by requests running in this process, set once their response is stored
+_in_flight: dict[str, asyncio.Event] = {}
+
+# response headers that are recomputed when the response is replayed
+_SKIPPED_HEADERS = (b"content-length",)
+
+
+def idempotency_key(
+    idempotency_key: Optional[str] = Query(
+        None, max_length=MAX_KEY_LENGTH, description="Run the request once for this key; retries replay its response"
+    ),
+    idempotency_key_header: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, max_length=MAX_KEY_LENGTH),
+) -> None:
+    """Declares the idempotency key parameters of a route; the keys are handled by the middleware in main.py."""
+
+
+def request_key(request: Request) -> Optional[str]:
+    """The idempotency key of a write request, if it has one."""
+    if request.method not in WRITE_METHODS:
+        return None
+    return request.headers.get(IDEMPOTENCY_HEADER) or request.query_params.get(IDEMPOTENCY_PARAM)
+
+
+def request_hash(request: Request, body: bytes) -> bytes:
+    """Fingerprint of everything a request does apart from its idempotency key."""
+    query = sorted((name, value) for name, value in request.query_params.multi_items() if name != IDEMPOTENCY_PARAM)
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (request.method, request.url.path, json.dumps(query), request.headers.get("content-type", "")):
+        digest.update(part.encode() + b"\0")
+    digest.update(body)
+    return digest.digest()
+
+
+def _response(body: bytes, status_code: int, raw_headers: list[tuple[bytes, bytes]]) -> Response:
+    """A response with these headers, repeated ones such as Set-Cookie included."""
+    response = Response(body, status_code=status_code)
+    response.raw_headers.extend((name, value) for name, value in raw_headers if name not in _SKIPPED_HEADERS)
+    return response
+
+
+def _replay(row: models.IdempotencyKey) -> Response:
+    headers = json.loads(row.headers)
+    if isinstance(headers, dict):
+        # stored as a JSON object by earlier releases
+        headers = headers.items()
+    raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    raw_headers.append((b"idempotent-replayed", b"true"))
+    return _response(zlib.decompress(row.body), row.status_code, raw_headers)
+
+
+def _conflict(status_code: int, detail: str, **headers: str) -> Response:
+    return JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers or None)
+
+
+async def _claim(key: str, fingerprint: bytes) -> Optional[Response]:
+    """
+    Claim a key for this request, waiting while another request holds it.
+
+    Returns None once the key is claimed, or the response to send instead: the stored response of
+    an earlier request, or an error when the key was used for another request.
+    """
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_LOCK_TIMEOUT
+    while True:
+        now = datetime.utcnow()
+        claim = {
+            "request_hash": fingerprint,
+            "status_code": None,
+            "headers": None,
+            "body": None,
+            "expires_at": now + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT),
+        }
+        async with AsyncSessionLocal() as db:
+            try:
+                db.add(models.IdempotencyKey(key=key, **claim))
+                await db.commit()
+                return None
+            except IntegrityError:
+                await db.rollback()
+
+            row = await db.get(models.IdempotencyKey, key, populate_existing=True)
+            if row is not None and row.expires_at <= now:
+                # an expired response, or the claim of a request that never finished
+                taken = await db.execute(
+                    update(models.IdempotencyKey)
+                    .where(models.IdempotencyKey.key == key, models.IdempotencyKey.expires_at <= now)
+                    .values(**claim)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if taken.rowcount:
+                    return None
+                continue
+            if row is not None and row.request_hash != fingerprint:
+                return _conflict(422, f"{IDEMPOTENCY_HEADER} was already used for a different request")
+            if row is not None and row.status_code is not None:
+                return _replay(row)
+
+        # the first request is still running (or has just failed and released the key)
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return _conflict(409, "A request with this key is still in progress", **{"Retry-After": "1"})
+        event = _in_flight.get(key)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            else:
+                await asyncio.sleep(min(_POLL_INTERVAL, remaining))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _release(key: str, fingerprint: bytes, response: Optional[Response], body: bytes) -> None:
+    """Store the response of a claimed key, or give the key up when the request failed."""
+    async with AsyncSessionLocal() as db:
+        owned = (models.IdempotencyKey.key == key, models.IdempotencyKey.request_hash == fingerprint)
+        if response is None or response.status_code >= 500:
+            await db.execute(delete(models.IdempotencyKey).where(*owned, models.IdempotencyKey.status_code.is_(None)))
+        else:
+            # name, value pairs, since headers such as Set-Cookie can be repeated
+            headers = [
+                (name.decode("latin-1"), value.decode("latin-1"))
+                for name, value in response.headers.raw
+                if name not in _SKIPPED_HEADERS
+            ]
+            await db.execute(
+                update(models.IdempotencyKey)
+                .where(*owned, models.IdempotencyKey.status_code.is_(None))
+                .values(
+                    status_code=response.status_code,
+                    headers=json.dumps(headers),
+                    body=zlib.compress(body),
+                    expires_at=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL),
+                )
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+
+
+async def handle(request: Request, key: str, call_next) -> Response:
+    """Run a write request with an idempotency key once, replaying its response for duplicates."""
+    if len(key) > MAX_KEY_LENGTH:
+        return _conflict(400, f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters")
+    fingerprint = request_hash(request, await request.body())
+    replayed = await _claim(key, fingerprint)
+    if replayed is not None:
+        return replayed
+
+    event = _in_flight[key] = asyncio.Event()
+    response: Optional[Response] = None
+    body = b""
+    try:
+        response = await call_next(request)
+        # the response is buffered, to store it
+        body = b"".join([chunk async for chunk in response.body_iterator])
+    finally:
+        try:
+            await _release(key, fingerprint, response, body)
+        finally:
+            event.set()
+            _in_flight.pop(key, None)
+    return _response(body, response.status_code, response.headers.raw)
+
+
+async def sweep_idempotency_keys() -> None:
+    """Delete expired keys every IDEMPOTENCY_SWEEP_INTERVAL seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= datetime.utcnow())
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Deleting expired idempotency keys failed")
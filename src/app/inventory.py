@@ -0,0 +1,160 @@
+"""
+Stock reservation.
+
+Orders take their stock with a single conditional UPDATE over all of their products, which only
+decrements the rows that still have enough stock, so concurrent orders cannot oversell; they give
+it back with a single UPDATE when they are cancelled or deleted. Every change is recorded in the
+stock_ledger table.
+
+With RESERVATION_TTL set, pending orders hold their stock for that many seconds only: a sweeper
+running in each API process cancels the pending orders whose reservation has expired, returning
+their stock. Moving an order out of pending confirms its reservation.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from . import cache, changes, models
+from .aggregates import apply_order, order_lines
+from .database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL: int = int(os.getenv("RESERVATION_TTL", "0"))  # seconds; 0 keeps pending orders indefinitely
+RESERVATION_SWEEP_INTERVAL: float = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+
+
+def holds_stock(status: str) -> bool:
+    """Whether an order with this status keeps its products' stock taken."""
+    return status != "cancelled"
+
+
+def order_quantities(order: models.Order) -> dict[int, int]:
+    """Total quantity per product of an order with its items loaded."""
+    quantities: dict[int, int] = {}
+    for item in order.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+async def _record(db: AsyncSession, quantities: dict[int, int], order_id: int, reason: str) -> None:
+    now = datetime.utcnow()
+    await db.execute(
+        insert(models.StockMovement),
+        [
+            {"product_id": product_id, "order_id": order_id, "quantity": quantity, "reason": reason, "created_at": now}
+            for product_id, quantity in quantities.items()
+        ],
+    )
+
+
+async def take_stock(db: AsyncSession, quantities: dict[int, int], order_id: int, reason: str) -> set[int]:
+    """
+    Take stock for an order in one statement, without committing.
+
+    Returns the ids of the products that are missing or short of stock; the caller must then roll
+    back, since the stock of the other products has been taken.
+    """
+    if not quantities:
+        return set()
+    amounts = case(quantities, value=models.Product.id)
+    taken = (
+        await db.execute(
+            update(models.Product)
+            .where(models.Product.id.in_(quantities), models.Product.stock >= amounts)
+            .values(stock=models.Product.stock - amounts)
+            .returning(models.Product.id, models.Product.stock)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    short = set(quantities) - {product_id for product_id, _ in taken}
+    if not short:
+        await _record(db, {product_id: -quantity for product_id, quantity in quantities.items()}, order_id, reason)
+        await changes.record(db, "product", "updated", [(product_id, {"stock": stock}) for product_id, stock in taken])
+    return short
+
+
+async def return_stock(db: AsyncSession, quantities: dict[int, int], order_id: int, reason: str) -> None:
+    """Give an order's stock back in one statement, without committing."""
+    if not quantities:
+        return
+    amounts = case(quantities, value=models.Product.id)
+    returned = await db.execute(
+        update(models.Product)
+        .where(models.Product.id.in_(quantities))
+        .values(stock=models.Product.stock + amounts)
+        .returning(models.Product.id, models.Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    await _record(db, quantities, order_id, reason)
+    await changes.record(db, "product", "updated", [(product_id, {"stock": stock}) for product_id, stock in returned])
+
+
+async def hold(db: AsyncSession, order: models.Order) -> None:
+    """Start the reservation of a new pending order, when reservations expire."""
+    if RESERVATION_TTL and order.status == "pending":
+        expires_at = datetime.utcnow() + timedelta(seconds=RESERVATION_TTL)
+        await db.execute(insert(models.StockReservation).values(order_id=order.id, expires_at=expires_at))
+
+
+async def end_holds(db: AsyncSession, order_ids: Iterable[int]) -> None:
+    """Drop the reservations of orders that are no longer pending."""
+    await db.execute(delete(models.StockReservation).where(models.StockReservation.order_id.in_(list(order_ids))))
+
+
+async def expire_reservations(db: AsyncSession) -> set[int]:
+    """
+    Cancel the pending orders whose reservation has expired and return their stock, without committing.
+
+    The status change is a conditional UPDATE, so an order is only cancelled once when several
+    processes sweep at the same time. Returns the ids of the products whose stock changed.
+    """
+    now = datetime.utcnow()
+    expired = select(models.StockReservation.order_id).where(models.StockReservation.expires_at <= now)
+    order_ids = (
+        await db.scalars(
+            update(models.Order)
+            .where(models.Order.id.in_(expired), models.Order.status == "pending")
+            .values(status="cancelled", updated_at=now)
+            .returning(models.Order.id)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    await db.execute(delete(models.StockReservation).where(models.StockReservation.expires_at <= now))
+    if not order_ids:
+        return set()
+    await changes.record(db, "order", "updated", [(order_id, {"status": "cancelled"}) for order_id in order_ids])
+
+    orders = await db.scalars(
+        select(models.Order).options(selectinload(models.Order.items)).where(models.Order.id.in_(order_ids))
+    )
+    changed: set[int] = set()
+    for order in orders:
+        quantities = order_quantities(order)
+        await return_stock(db, quantities, order.id, "expired")
+        # counted in the aggregates while pending, and no longer now that it is cancelled
+        await apply_order(db, order, order_lines(order), -1)
+        changed |= set(quantities)
+    logger.info("Cancelled %d orders with expired stock reservations", len(order_ids))
+    return changed
+
+
+async def sweep_reservations() -> None:
+    """Expire reservations every RESERVATION_SWEEP_INTERVAL seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                changed = await expire_reservations(db)
+                await db.commit()
+            if changed:
+                await cache.invalidate("product", *changed)
+        except Exception:
+            logger.exception("Expiring stock reservations failed")
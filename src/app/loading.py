@@ -0,0 +1,50 @@
+"""Eager-loading options derived from the response models."""
+
+import typing
+from functools import lru_cache
+from typing import Any
+
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import Load, joinedload, selectinload
+
+
+def _nested_schema(annotation: Any) -> type[BaseModel] | None:
+    """Return the pydantic model inside an annotation such as Order, List[Order] or Optional[Order]."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        schema = _nested_schema(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def _options(model: Any, schema: type[BaseModel]) -> list[Load]:
+    relationships = inspect(model).relationships
+    options = []
+    for name, field in schema.model_fields.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+        # collections are loaded with one extra IN query; many-to-one references are joined in
+        loader = selectinload(attribute) if relationship.uselist else joinedload(attribute)
+        nested = _nested_schema(field.annotation)
+        if nested is not None:
+            nested_options = _options(relationship.mapper.class_, nested)
+            if nested_options:
+                loader = loader.options(*nested_options)
+        options.append(loader)
+    return options
+
+
+@lru_cache
+def loader_options(model: Any, schema: type[BaseModel]) -> tuple[Load, ...]:
+    """
+    Build the loader options needed to serialize `model` instances as `schema`.
+
+    Every relationship the schema reads is loaded eagerly, recursively, so serialization does not
+    issue a lazy load per row (which is not possible on an AsyncSession anyway).
+    """
+    return tuple(_options(model, schema))
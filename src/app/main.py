@@ -1,13 +1,74 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_mcp import FastApiMCP
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from .admission import AdmissionMiddleware, admission
+from .catalog import CATALOG_SNAPSHOT, catalog
+from .changes import CHANGE_FEED, CHANGES_RETENTION, feed, sweep_changes
+from .compression import COMPRESSION_ENCODINGS, COMPRESSION_MIN_SIZE, CompressionMiddleware
+from .database import (
+    DATABASE_READ_URLS,
+    DB_QUERY_BUDGET,
+    DB_QUERY_DEBUG,
+    READ_PRIMARY_COOKIE,
+    REPLICA_LAG_SECONDS,
+    count_queries,
+    dispose_engines,
+)
+from .idempotency import IDEMPOTENCY_TTL, handle, request_key, sweep_idempotency_keys
+from .inventory import RESERVATION_TTL, sweep_reservations
+from .metrics import (
+    MCP_API_HOST,
+    METRICS_ENABLED,
+    PROFILE_SLOW_MS,
+    InstrumentedRoute,
+    RequestTimings,
+    profiler,
+    record,
+    render_metrics,
+    request_timings,
+    save_profile,
+    server_timing,
+)
+from .routes import batch_router, changes_router, customer_router, order_router, product_router
+from .serialization import DefaultResponse
+from .startup import FAST_START, LazyMCP, load_schema
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # pending orders give their stock back once their reservation expires
+    sweepers = [asyncio.create_task(sweep_reservations())] if RESERVATION_TTL else []
+    if IDEMPOTENCY_TTL:
+        sweepers.append(asyncio.create_task(sweep_idempotency_keys()))
+    # the product catalog snapshot loads in the background; reads use the database until it is ready
+    if CATALOG_SNAPSHOT:
+        sweepers.append(asyncio.create_task(catalog.run()))
+    if CHANGE_FEED and CHANGES_RETENTION:
+        sweepers.append(asyncio.create_task(sweep_changes()))
+    # with FAST_START, the MCP server is set up once the server is up (see app/startup.py)
+    if lazy_mcp is not None:
+        sweepers.append(asyncio.create_task(lazy_mcp.transport()))
+    yield
+    for sweeper in sweepers:
+        sweeper.cancel()
+    # the change feed is started by its first subscriber
+    await feed.stop()
+    await dispose_engines()
 
-from .routes import customer_router, order_router, product_router
 
 # create FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=DefaultResponse,
     description="A FastAPI application using MCP",
     title="My FastAPI Application",
     version=os.environ.get("IMAGE_TAG", "1.0.0"),
@@ -22,10 +83,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# routes declared on the app itself (including the MCP endpoint) are instrumented too
+app.router.route_class = InstrumentedRoute
+
+# Writes carrying an idempotency key run once, and their retries replay the response (see
+# app/idempotency.py). Added first so that replays are measured too. The MCP endpoint's own requests
+# are left alone: its tools pass their key on to the API calls they make.
+if IDEMPOTENCY_TTL:
+
+    @app.middleware("http")
+    async def idempotent_writes(request: Request, call_next):
+        key = request_key(request)
+        if key is None or request.url.path.startswith("/mcp"):
+            return await call_next(request)
+        return await handle(request, key, call_next)
+
+
+# Per-route concurrency limits with bounded queues, and per-client rate limits (see app/admission.py),
+# so that a burst of expensive requests is queued or shed instead of slowing every route down. Inside
+# the instrumentation, so that rejections and the time spent queued are measured.
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, router=app.router, admission=admission)
+
+
+# Measure every request (see app/metrics.py), and report the number of queries each request runs
+# to catch N+1 query patterns
+if METRICS_ENABLED or profiler is not None or DB_QUERY_DEBUG in ("true", "strict"):
+
+    @app.middleware("http")
+    async def instrument_request(request: Request, call_next):
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        profile_started = profiler.start_request() if profiler is not None else None
+        start = time.perf_counter()
+        try:
+            with count_queries() as counter:
+                response = await call_next(request)
+        finally:
+            duration = time.perf_counter() - start
+            samples = (
+                profiler.end_request(profile_started) if profiler is not None and profile_started is not None else None
+            )
+            request_timings.reset(token)
+
+        if DB_QUERY_DEBUG in ("true", "strict"):
+            # batches get the budget of each of their operations
+            budget = getattr(request.state, "query_budget", DB_QUERY_BUDGET)
+            if counter.count > budget:
+                message = f"{request.method} {request.url.path} ran {counter.count} queries (budget: {budget})"
+                if DB_QUERY_DEBUG == "strict":
+                    response = JSONResponse(status_code=500, content={"detail": f"Query budget exceeded: {message}"})
+                else:
+                    logger.warning("Query budget exceeded: %s", message)
+            response.headers["X-Query-Count"] = str(counter.count)
+
+        if METRICS_ENABLED and request.url.path != "/metrics":
+            request_phases = record(request, response.status_code, duration, timings, counter)
+            response.headers["Server-Timing"] = server_timing(duration, request_phases, counter)
+
+        if samples and duration * 1000 >= PROFILE_SLOW_MS:
+            await save_profile(request, timings.route, duration, samples)
+        return response
+
+
+# With read replicas, a client that has just written reads from the primary until the replicas have
+# caught up. The MCP tools share one HTTP client (and cookie jar) between every session, so their
+# calls are left out.
+if DATABASE_READ_URLS:
+
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        response = await call_next(request)
+        wrote = getattr(request.state, "used_primary", False) and response.status_code < 400
+        if wrote and request.url.hostname != MCP_API_HOST:
+            response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=REPLICA_LAG_SECONDS, httponly=True, samesite="lax")
+        return response
+
+
+# Compress responses for the clients that accept it (see app/compression.py). Added last, so that it
+# wraps every other middleware and compresses the final response, headers included.
+if COMPRESSION_ENCODINGS:
+    app.add_middleware(CompressionMiddleware, encodings=COMPRESSION_ENCODINGS, minimum_size=COMPRESSION_MIN_SIZE)
+
+
 # Include the routers for products, customers, and orders
 app.include_router(product_router)
 app.include_router(customer_router)
 app.include_router(order_router)
+# runs any of the operations above, several in one request (see app/batch.py)
+app.include_router(batch_router)
+# changes made to the resources above, for clients to follow instead of polling (see app/changes.py)
+if CHANGE_FEED:
+    app.include_router(changes_router)
+
+
+if METRICS_ENABLED:
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -36,11 +192,33 @@ def read_root():
             "products": "/products",
             "customers": "/customers",
             "orders": "/orders",
+            "batch": "/batch",
+            "changes": "/changes",
             "docs": "/docs",
         },
     }
 
 
-mcp = FastApiMCP(app)
-# mcp.mount()
-mcp.mount_http()
+# The OpenAPI schema and MCP tools built ahead of time, if any (see app/startup.py)
+prebuilt = load_schema(app)
+if prebuilt is not None:
+    app.openapi_schema = prebuilt["openapi"]
+
+# The MCP server (see app/mcp_server.py), set up on first use with FAST_START
+lazy_mcp: LazyMCP | None = None
+if FAST_START:
+    lazy_mcp = LazyMCP(app, prebuilt)
+    app.add_api_route(
+        "/mcp",
+        lazy_mcp.handle_request,
+        methods=["GET", "POST", "DELETE"],
+        include_in_schema=False,
+        operation_id="mcp_http",
+    )
+
+else:
+    from .mcp_server import create_mcp
+
+    mcp = create_mcp(app, prebuilt["mcp"] if prebuilt else None)
+    # mcp.mount()
+    mcp.mount_http()
@@ -0,0 +1,85 @@
+"""
+The MCP server, which exposes the API operations as tools.
+
+fastapi_mcp derives the tools from the OpenAPI schema of the app. Importing it (and the mcp SDK)
+and generating the schema are a large part of the startup time, so with FAST_START this module is
+only imported once the server is up (see app/startup.py), and the tools can be loaded from a
+schema file built ahead of time instead of being generated.
+"""
+
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import httpx
+from fastapi import FastAPI
+from fastapi_mcp import FastApiMCP
+from fastapi_mcp.transport.http import FastApiHttpSessionManager
+from mcp import types
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .metrics import MCP_API_HOST, MCP_CALL_SCOPE_KEY
+
+# Full-table exports and the change stream are streamed for HTTP clients, and are not usable as MCP
+# tool results (the tools follow changes with poll_changes)
+EXCLUDED_OPERATIONS: list[str] = ["export_products", "export_customers", "export_orders", "stream_changes"]
+
+
+class PrebuiltFastApiMCP(FastApiMCP):
+    """FastApiMCP taking its tools from a prebuilt schema (see app/startup.py) when one is given."""
+
+    def __init__(self, fastapi: FastAPI, prebuilt: Optional[dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._prebuilt = prebuilt
+        super().__init__(fastapi, **kwargs)
+
+    def setup_server(self) -> None:
+        if self._prebuilt is None:
+            super().setup_server()
+            return
+        # register the MCP handlers on an app without routes, which has no schema to generate, then
+        # give them the prebuilt tools; the app is left alone since it may already serve requests
+        fastapi = self.fastapi
+        self.fastapi = SimpleNamespace(
+            title=fastapi.title,
+            version=fastapi.version,
+            openapi_version=fastapi.openapi_version,
+            description=fastapi.description,
+            routes=[],
+        )
+        try:
+            super().setup_server()
+        finally:
+            self.fastapi = fastapi
+        self.tools = [types.Tool.model_validate(tool) for tool in self._prebuilt["tools"]]
+        self.operation_map = self._prebuilt["operations"]
+
+
+def mark_mcp_calls(app: ASGIApp) -> ASGIApp:
+    """The app, with the requests it is given marked in their scope as made by the MCP tools."""
+
+    async def marked(scope: Scope, receive: Receive, send: Send) -> None:
+        await app({**scope, MCP_CALL_SCOPE_KEY: True}, receive, send)
+
+    return marked
+
+
+def create_mcp(app: FastAPI, prebuilt: Optional[dict[str, Any]] = None) -> PrebuiltFastApiMCP:
+    # the client fastapi_mcp would create, through which the tools call the API in-process
+    http_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mark_mcp_calls(app), raise_app_exceptions=False),
+        base_url=f"http://{MCP_API_HOST}",
+        timeout=10.0,
+    )
+    return PrebuiltFastApiMCP(app, prebuilt, exclude_operations=EXCLUDED_OPERATIONS, http_client=http_client)
+
+
+def mcp_schema(mcp: FastApiMCP) -> dict[str, Any]:
+    """The tools of an MCP server, in the form PrebuiltFastApiMCP takes them."""
+    return {
+        "tools": [tool.model_dump(mode="json", exclude_none=True) for tool in mcp.tools],
+        "operations": mcp.operation_map,
+    }
+
+
+def create_transport(mcp: FastApiMCP) -> FastApiHttpSessionManager:
+    """The streamable HTTP transport mount_http() would create, to serve /mcp requests lazily."""
+    return FastApiHttpSessionManager(mcp_server=mcp.server)
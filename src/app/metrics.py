@@ -0,0 +1,317 @@
+"""
+Request metrics and profiling.
+
+The instrumentation middleware in main.py measures every request, split into phases:
+- db: time spent executing SQL (see the engine events in database.py)
+- app: the rest of the endpoint function, ORM hydration included
+- serialize: request parsing and response validation/serialization around the endpoint
+along with the number of queries and ORM rows loaded. Totals are kept per route and exposed in
+the Prometheus text format at /metrics, and each response carries a Server-Timing header.
+
+Requests made by the MCP tools (which call the API in-process) are labelled transport="mcp"; the
+time of a /mcp request minus the time of the API call it makes is the cost of the MCP translation.
+
+With PROFILE_SLOW_MS set, a sampling profiler records the stacks of the event loop thread while
+requests are in flight, and writes those of requests slower than the threshold to PROFILE_DIR in
+the folded format read by flamegraph.pl and speedscope. Samples cover everything the event loop
+did during the request, so with concurrent requests they include some of the work of the others.
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from starlette.types import Scope
+
+from .database import QueryCounter
+
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# sampling profiler, disabled unless a threshold is set
+PROFILE_SLOW_MS: float = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+
+DURATION_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# host the MCP tools use to call the API in-process
+MCP_API_HOST = "apiserver"
+# set in the ASGI scope of those calls (see app/mcp_server.py), where clients cannot forge it
+MCP_CALL_SCOPE_KEY = "app.mcp_call"
+
+
+class RequestTimings:
+    """Phase timings of a single request, filled in by InstrumentedRoute."""
+
+    __slots__ = ("endpoint", "handler", "route")
+
+    def __init__(self) -> None:
+        self.route: Optional[str] = None
+        self.handler: float = 0.0
+        self.endpoint: float = 0.0
+
+
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def is_mcp_call(scope: Scope) -> bool:
+    """Whether a request is an API call made in-process by an MCP tool."""
+    return bool(scope.get(MCP_CALL_SCOPE_KEY))
+
+
+# the endpoint functions _timed_endpoint() returned
+_timed_endpoints: weakref.WeakSet[Callable] = weakref.WeakSet()
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    """Wrap a route's endpoint function to record its duration, keeping it sync or async as it was."""
+    if endpoint in _timed_endpoints:
+        # include_router() builds new routes around the endpoints of the included ones
+        return endpoint
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                timings = request_timings.get()
+                if timings is not None:
+                    timings.endpoint += time.perf_counter() - start
+
+        _timed_endpoints.add(timed)
+        return timed
+
+    @functools.wraps(endpoint)
+    def timed_sync(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            # sync endpoints run in a worker thread, which gets a copy of the request's context
+            timings = request_timings.get()
+            if timings is not None:
+                timings.endpoint += time.perf_counter() - start
+
+    _timed_endpoints.add(timed_sync)
+    return timed_sync
+
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute recording the route template and the time spent in the handler and in the endpoint function."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, _timed_endpoint(endpoint) if METRICS_ENABLED else endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not METRICS_ENABLED:
+            return handler
+
+        async def timed_handler(request: Request) -> Response:
+            timings = request_timings.get()
+            if timings is None:
+                return await handler(request)
+            timings.route = self.path
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                timings.handler += time.perf_counter() - start
+
+        return timed_handler
+
+
+class RouteStats:
+    """Running totals for one (method, route, transport)."""
+
+    __slots__ = ("buckets", "count", "duration", "phases", "queries", "rows", "statuses")
+
+    def __init__(self) -> None:
+        self.statuses: Counter[int] = Counter()
+        self.buckets: list[int] = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.phases: dict[str, float] = {"db": 0.0, "app": 0.0, "serialize": 0.0}
+        self.queries = 0
+        self.rows = 0
+
+
+_routes: dict[tuple[str, str, str], RouteStats] = {}
+
+
+def phases(timings: RequestTimings, queries: QueryCounter) -> dict[str, float]:
+    """Split a request's time into db, app (endpoint minus SQL) and serialize (handler minus endpoint)."""
+    return {
+        "db": queries.duration,
+        "app": max(timings.endpoint - queries.duration, 0.0),
+        "serialize": max(timings.handler - timings.endpoint, 0.0),
+    }
+
+
+def record(
+    request: Request, status_code: int, duration: float, timings: RequestTimings, queries: QueryCounter
+) -> dict[str, float]:
+    """Add a finished request to the totals of its route; returns its phase timings."""
+    transport = "mcp" if request.url.hostname == MCP_API_HOST else "http"
+    # unmatched paths are grouped, so that scanning for URLs cannot blow up the number of series
+    key = (request.method, timings.route or "<unmatched>", transport)
+    stats = _routes.get(key)
+    if stats is None:
+        stats = _routes[key] = RouteStats()
+    stats.statuses[status_code] += 1
+    stats.count += 1
+    stats.duration += duration
+    for index, bound in enumerate(DURATION_BUCKETS):
+        if duration <= bound:
+            stats.buckets[index] += 1
+    request_phases = phases(timings, queries)
+    for phase, seconds in request_phases.items():
+        stats.phases[phase] += seconds
+    stats.queries += queries.count
+    stats.rows += queries.rows
+    return request_phases
+
+
+def server_timing(duration: float, request_phases: dict[str, float], queries: QueryCounter) -> str:
+    """Server-Timing header value; durations are in milliseconds."""
+    parts = [f'db;desc="{queries.count} queries, {queries.rows} rows";dur={request_phases["db"] * 1000:.2f}']
+    parts += [f"{phase};dur={request_phases[phase] * 1000:.2f}" for phase in ("app", "serialize")]
+    parts.append(f"total;dur={duration * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def _labels(**labels: str) -> str:
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP http_requests_total Requests handled.",
+        "# TYPE http_requests_total counter",
+    ]
+    routes = sorted(_routes.items())
+    for (method, route, transport), stats in routes:
+        for status_code, count in sorted(stats.statuses.items()):
+            labels = _labels(method=method, route=route, transport=transport, status=str(status_code))
+            lines.append(f"http_requests_total{labels} {count}")
+
+    lines += [
+        "# HELP http_request_duration_seconds Time to handle a request, until the response starts.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route, transport), stats in routes:
+        for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+            labels = _labels(method=method, route=route, transport=transport, le=str(bound))
+            lines.append(f"http_request_duration_seconds_bucket{labels} {count}")
+        labels = _labels(method=method, route=route, transport=transport, le="+Inf")
+        lines.append(f"http_request_duration_seconds_bucket{labels} {stats.count}")
+        labels = _labels(method=method, route=route, transport=transport)
+        lines.append(f"http_request_duration_seconds_sum{labels} {stats.duration:.6f}")
+        lines.append(f"http_request_duration_seconds_count{labels} {stats.count}")
+
+    lines += [
+        "# HELP http_request_phase_seconds_total Time spent in each phase of a request (db, app, serialize).",
+        "# TYPE http_request_phase_seconds_total counter",
+    ]
+    for (method, route, transport), stats in routes:
+        for phase, seconds in stats.phases.items():
+            labels = _labels(method=method, route=route, transport=transport, phase=phase)
+            lines.append(f"http_request_phase_seconds_total{labels} {seconds:.6f}")
+
+    for name, help_text, attribute in (
+        ("db_queries_total", "SQL statements executed.", "queries"),
+        ("db_rows_loaded_total", "ORM rows loaded.", "rows"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (method, route, transport), stats in routes:
+            labels = _labels(method=method, route=route, transport=transport)
+            lines.append(f"{name}{labels} {getattr(stats, attribute)}")
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples the stack of the event loop thread while requests are in flight."""
+
+    def __init__(self, interval: float, max_samples: int = 100_000) -> None:
+        self.interval = interval
+        self.samples: deque[tuple[float, str]] = deque(maxlen=max_samples)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start_request(self) -> float:
+        if self._sampler is None:
+            # the event loop thread, which starts the requests
+            thread_id = threading.get_ident()
+            self._sampler = threading.Thread(target=self._run, args=(thread_id,), name="request-profiler", daemon=True)
+            self._sampler.start()
+        self.in_flight += 1
+        return time.monotonic()
+
+    def end_request(self, started: float) -> list[tuple[float, str]]:
+        """Stop tracking a request; returns the samples taken since it started."""
+        self.in_flight -= 1
+        # samples are in time order: walk back from the newest, rather than through the whole deque
+        samples = []
+        with self._lock:
+            for sample in reversed(self.samples):
+                if sample[0] < started:
+                    break
+                samples.append(sample)
+        samples.reverse()
+        return samples
+
+    def _run(self, thread_id: int) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self.in_flight:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                sample = (time.monotonic(), _folded(frame))
+                with self._lock:
+                    self.samples.append(sample)
+
+
+def _folded(frame: Any) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+profiler: SamplingProfiler | None = SamplingProfiler(PROFILE_INTERVAL_MS / 1000) if PROFILE_SLOW_MS > 0 else None
+
+
+def _write_profile(path: str, root: str, samples: list[tuple[float, str]]) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    counts = Counter(stack for _, stack in samples)
+    with open(path, "w") as file:
+        file.writelines(f"{root};{stack} {count}\n" for stack, count in counts.items())
+
+
+async def save_profile(request: Request, route: Optional[str], duration: float, samples: list) -> None:
+    """Write the samples of a slow request as folded stacks, rooted at the request's route."""
+    if not samples:
+        return
+    root = f"{request.method} {route or request.url.path}"
+    name = re.sub(r"[^A-Za-z0-9]+", "-", root).strip("-")
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{duration * 1000:.0f}ms.folded")
+    await asyncio.to_thread(_write_profile, path, root, samples)
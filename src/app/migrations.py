@@ -0,0 +1,166 @@
+"""
+Schema migrations.
+
+The schema_version table records the migrations applied to a database. migrate() applies the
+missing ones in order, each in its own transaction along with its schema_version row, so an
+interrupted upgrade resumes where it stopped.
+
+Migration 1 creates the tables of the models that do not exist yet, with their current indexes,
+and computes the sales aggregates of a database created before them (see app/aggregates.py): that
+is all a new database needs, and the later migrations find nothing left to do on it. They
+bring databases created before them up to date, and must therefore be safe to run on a schema that
+already has their changes (create with checkfirst, IF NOT EXISTS).
+
+To upgrade a database, or show its version, execute (from src/):
+    python -m app.migrations
+    python -m app.migrations --status
+"""
+
+import argparse
+import time
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Connection, Engine, Table, func, insert, inspect, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+from . import models
+from .aggregates import rebuild_aggregates
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+# summary tables computed from the orders (see app/aggregates.py)
+_AGGREGATE_TABLES = (
+    models.CustomerStats.__tablename__,
+    models.ProductSales.__tablename__,
+    models.DailySales.__tablename__,
+)
+
+
+def _create_tables(connection: Connection) -> None:
+    existing = set(inspect(connection).get_table_names())
+    models.Base.metadata.create_all(connection)
+    # summary tables added to a database that already has orders start from them, not from zero
+    if not existing.issuperset(_AGGREGATE_TABLES):
+        with Session(bind=connection) as db:
+            rebuild_aggregates(db)
+
+
+def _index_orders(connection: Connection) -> None:
+    # relationship loads and restocks look order items up by order, per-customer and date range
+    # queries look orders up by customer, status and date
+    indexes = [*models.Order.__table__.indexes, *models.OrderItem.__table__.indexes]
+    for index in sorted(indexes, key=lambda index: index.name):
+        index.create(connection, checkfirst=True)
+
+
+def _create_archive_tables(connection: Connection) -> None:
+    models.Base.metadata.create_all(
+        connection, tables=[models.ArchivedOrder.__table__, models.ArchivedOrderItem.__table__]
+    )
+
+
+def _autoincrement(connection: Connection, table: Table, archive: Table) -> None:
+    # SQLite cannot add AUTOINCREMENT to a table: rebuild it, keeping its rows and ids. With
+    # legacy_alter_table, renaming the old table leaves the foreign keys to it in other tables alone.
+    sql = connection.scalar(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+    )
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return
+    old = f"{table.name}_old"
+    columns = ", ".join(f'"{column.name}"' for column in table.columns)
+    connection.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+    try:
+        for reflected in inspect(connection).get_indexes(table.name):
+            connection.exec_driver_sql(f'DROP INDEX "{reflected["name"]}"')
+        connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old}"')
+        connection.execute(CreateTable(table))
+        for index in table.indexes:
+            index.create(connection)
+        connection.exec_driver_sql(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{old}"')
+        connection.exec_driver_sql(f'DROP TABLE "{old}"')
+    finally:
+        connection.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+    # new ids start after the archived ones as well as the remaining ones
+    last_id = max(
+        connection.scalar(select(func.max(table.c.id))) or 0,
+        connection.scalar(select(func.max(archive.c.id))) or 0,
+    )
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": table.name})
+    connection.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)"), {"name": table.name, "seq": last_id}
+    )
+
+
+def _keep_archived_order_ids(connection: Connection) -> None:
+    # other databases do not reuse the ids their sequences hand out
+    if connection.dialect.name != "sqlite":
+        return
+    _autoincrement(connection, models.Order.__table__, models.ArchivedOrder.__table__)
+    _autoincrement(connection, models.OrderItem.__table__, models.ArchivedOrderItem.__table__)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "Create the tables", _create_tables),
+    Migration(2, "Index orders by customer, status and date, and order items by order and product", _index_orders),
+    Migration(3, "Add the order archive tables", _create_archive_tables),
+    Migration(4, "Stop SQLite from reusing the ids of archived orders and order items", _keep_archived_order_ids),
+]
+
+LATEST_VERSION: int = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> int:
+    """The latest migration applied to the database; 0 for a database without schema_version."""
+    with engine.connect() as connection:
+        if not inspect(connection).has_table(models.SchemaVersion.__tablename__):
+            return 0
+        versions = connection.scalars(select(models.SchemaVersion.version)).all()
+    return max(versions, default=0)
+
+
+def migrate(engine: Engine, verbose: bool = False) -> list[int]:
+    """Apply the migrations the database is missing; returns their versions."""
+    models.SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        applied = set(connection.scalars(select(models.SchemaVersion.version)))
+
+    done = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(
+                insert(models.SchemaVersion).values(version=migration.version, description=migration.description)
+            )
+        done.append(migration.version)
+        if verbose:
+            seconds = time.perf_counter() - start
+            print(f"Applied migration {migration.version}: {migration.description} ({seconds:.1f}s)")
+    return done
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true", help="show the schema version without migrating")
+    args = parser.parse_args()
+
+    if args.status:
+        version = current_version(engine)
+        pending = [migration for migration in MIGRATIONS if migration.version > version]
+        print(f"Schema version {version} of {LATEST_VERSION}.")
+        for migration in pending:
+            print(f"Pending migration {migration.version}: {migration.description}")
+    else:
+        applied = migrate(engine, verbose=True)
+        print(f"Schema version {LATEST_VERSION}." if applied else "Schema up to date.")
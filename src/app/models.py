@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, Table
+from sqlalchemy import Column, Date, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Table, event
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -45,10 +45,18 @@ class Product(Base):
 
 class Order(Base):
     __tablename__: str = "orders"
+    # a customer's orders by date, and the orders in a status in the order of the list endpoint;
+    # AUTOINCREMENT keeps SQLite from handing out the ids of archived orders again. Existing
+    # databases get both from app/migrations.py
+    __table_args__ = (
+        Index("ix_orders_customer_id_order_date", "customer_id", "order_date"),
+        Index("ix_orders_status_id", "status", "id"),
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
-    order_date = Column(DateTime, default=datetime.utcnow)
+    order_date = Column(DateTime, default=datetime.utcnow, index=True)
     status = Column(String, default="pending")
     total_amount = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -56,17 +64,189 @@ class Order(Base):
 
     customer = relationship("Customer", back_populates="orders")
     products = relationship("Product", secondary=order_items, back_populates="orders")
-    items = relationship("OrderItem", back_populates="order")
+    items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
 
 class OrderItem(Base):
     __tablename__: str = "order_items_detail"
+    # archived with their ids, like orders
+    __table_args__ = ({"sqlite_autoincrement": True},)
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
     quantity = Column(Integer, default=1, nullable=False)
     price_at_time = Column(Float, nullable=False)
 
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
+
+
+# Delivered and cancelled orders moved out of the orders tables once they are old enough (see
+# app/archive.py), so that the hot tables only hold recent orders. Same columns, without foreign keys.
+class ArchivedOrder(Base):
+    __tablename__: str = "orders_archive"
+
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(Integer, nullable=False, index=True)
+    order_date = Column(DateTime, index=True)
+    status = Column(String)
+    total_amount = Column(Float, default=0.0)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    items = relationship("ArchivedOrderItem", order_by="ArchivedOrderItem.id")
+
+
+class ArchivedOrderItem(Base):
+    __tablename__: str = "order_items_archive"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders_archive.id"), nullable=False, index=True)
+    product_id = Column(Integer, nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
+    price_at_time = Column(Float, nullable=False)
+
+
+# Stock changes made by orders, for auditing (see app/inventory.py). Rows are kept when the product
+# or order they refer to is deleted, hence no foreign keys.
+class StockMovement(Base):
+    __tablename__: str = "stock_ledger"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False, index=True)
+    order_id = Column(Integer, index=True)
+    quantity = Column(Integer, nullable=False)  # negative when stock is taken
+    reason = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Stock held by pending orders, released when the order has not moved on by expires_at
+class StockReservation(Base):
+    __tablename__: str = "stock_reservations"
+
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Changes to products, customers and orders, in the order they were made (see app/changes.py).
+# AUTOINCREMENT keeps SQLite from handing out the ids of deleted changes again.
+class Change(Base):
+    __tablename__: str = "change_log"
+    __table_args__ = ({"sqlite_autoincrement": True},)
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)  # created, updated or deleted
+    data = Column(String)  # JSON object of the fields the change set
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+# Summary tables, kept up to date incrementally by the order routes (see app/aggregates.py).
+# Cancelled orders are not counted.
+class CustomerStats(Base):
+    __tablename__: str = "customer_stats"
+
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    total_spent = Column(Float, default=0.0, nullable=False, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ProductSales(Base):
+    __tablename__: str = "product_sales"
+
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    units_sold = Column(Integer, default=0, nullable=False, index=True)
+    revenue = Column(Float, default=0.0, nullable=False, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DailySales(Base):
+    __tablename__: str = "daily_sales"
+
+    day = Column(Date, primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    units_sold = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0.0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# Responses to requests made with an idempotency key (see app/idempotency.py). status_code is null
+# while the first request is running; bodies are zlib-compressed.
+class IdempotencyKey(Base):
+    __tablename__: str = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    request_hash = Column(LargeBinary, nullable=False)
+    status_code = Column(Integer)
+    headers = Column(String)  # JSON object
+    body = Column(LargeBinary)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Migrations applied to the database (see app/migrations.py)
+class SchemaVersion(Base):
+    __tablename__: str = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Full-text search indexes for the search endpoints (see app/search.py): columns indexed per table
+SEARCH_COLUMNS: dict[str, tuple[str, ...]] = {
+    "products": ("name", "description"),
+    "customers": ("name", "email"),
+}
+
+
+def search_document(table: str) -> str:
+    """The PostgreSQL tsvector expression a table's search index is built on (queries must use the same one)."""
+    text = " || ' ' || ".join(f"coalesce({column}, '')" for column in SEARCH_COLUMNS[table])
+    return f"to_tsvector('simple', {text})"
+
+
+def _sqlite_search_index(connection, table: str) -> None:
+    # an external content FTS5 table, kept in sync by triggers; updates that leave the indexed
+    # columns alone (such as stock changes) do not touch it
+    columns = SEARCH_COLUMNS[table]
+    fts = f"{table}_fts"
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values});"
+
+    exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).first()
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+    connection.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+    connection.exec_driver_sql(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END"
+    )
+    if not exists:
+        # index the rows of an existing database
+        connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_indexes(target, connection, **kw) -> None:
+    """Create the search indexes along with the tables, and on existing databases that lack them."""
+    for table in SEARCH_COLUMNS:
+        if connection.dialect.name == "sqlite":
+            _sqlite_search_index(connection, table)
+        elif connection.dialect.name == "postgresql":
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin ({search_document(table)})"
+            )
+            # case-insensitive name prefix matches
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_name_prefix ON {table} (lower(name) text_pattern_ops)"
+            )
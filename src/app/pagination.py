@@ -0,0 +1,107 @@
+"""Keyset (cursor) pagination for the list endpoints."""
+
+import base64
+import binascii
+import json
+import numbers
+import os
+from typing import Any, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import ColumnElement, Select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# The most rows a page holds, whatever limit is asked for; clients follow next_cursor for the rest
+MAX_PAGE_LIMIT: int = int(os.getenv("MAX_PAGE_LIMIT", "1000"))
+LIMIT_DESCRIPTION = f"Number of rows to return (at most {MAX_PAGE_LIMIT})"
+
+
+def encode_cursor(position: dict[str, Any]) -> str:
+    """Encode the position of the last row of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict[str, Any]:
+    """Decode a cursor produced by encode_cursor, raising a 400 if it is malformed."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(position, dict) or type(position.get("id")) is not int:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+def page_limit(limit: int) -> int:
+    """The number of rows a page asked for with limit holds: at least one, at most MAX_PAGE_LIMIT."""
+    return max(1, min(limit, MAX_PAGE_LIMIT))
+
+
+def _valid_key(sort_key: ColumnElement, key: Any) -> bool:
+    """Whether a cursor's sort key can be compared with sort_key: None, or a value of its type."""
+    if key is None:
+        return True
+    if isinstance(key, bool) or not isinstance(key, (str, int, float)):
+        return False
+    try:
+        expected = sort_key.type.python_type
+    except NotImplementedError:
+        # untyped expressions are the relevance scores, which are numbers
+        return not isinstance(key, str)
+    if issubclass(expected, numbers.Number):
+        return isinstance(key, (int, float)) and (expected is not int or isinstance(key, int))
+    return isinstance(key, expected)
+
+
+async def paginate(db: AsyncSession, stmt: Select, model: Any, skip: int, limit: int, cursor: Optional[str]) -> dict:
+    """
+    Run a list query one page at a time, ordered by the model's primary key.
+
+    With a cursor the query seeks past the last id of the previous page using the primary key
+    index, rather than scanning and discarding every skipped row; skip still applies on top of
+    it. One extra row is fetched to tell whether a next page exists.
+    """
+    limit = page_limit(limit)
+    if cursor is not None:
+        stmt = stmt.filter(model.id > decode_cursor(cursor)["id"])
+    rows = (await db.scalars(stmt.order_by(model.id).offset(skip).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"id": rows[-1].id})
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+async def paginate_sorted(
+    db: AsyncSession,
+    stmt: Select,
+    model: Any,
+    sort_key: ColumnElement,
+    descending: bool,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+) -> dict:
+    """
+    Like paginate, for a query ordered by sort_key and then by the primary key.
+
+    The cursor holds the sort key and the id of the last row of the previous page, and the query
+    seeks past both. `stmt` must select only the model.
+    """
+    limit = page_limit(limit)
+    stmt = stmt.add_columns(sort_key.label("sort_key"))
+    if cursor is not None:
+        position = decode_cursor(cursor)
+        if "key" not in position or not _valid_key(sort_key, position["key"]):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        past_key = sort_key < position["key"] if descending else sort_key > position["key"]
+        stmt = stmt.filter(or_(past_key, and_(sort_key == position["key"], model.id > position["id"])))
+    order = sort_key.desc() if descending else sort_key.asc()
+    rows = (await db.execute(stmt.order_by(order, model.id).offset(skip).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"id": rows[-1][0].id, "key": rows[-1].sort_key})
+    return {"items": [row[0] for row in rows], "next_cursor": next_cursor}
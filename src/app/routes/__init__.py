@@ -1,3 +1,7 @@
+from .batch import router as batch_router
+from .changes import router as changes_router
 from .customer import router as customer_router
 from .order import router as order_router
 from .product import router as product_router
+
+__all__ = ["batch_router", "changes_router", "customer_router", "order_router", "product_router"]
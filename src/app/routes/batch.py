@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Request
+
+from .. import schemas
+from ..batch import BATCH_DESCRIPTION, BATCH_OPERATION_ID, run_batch
+from ..idempotency import idempotency_key
+from ..metrics import InstrumentedRoute
+from ..serialization import render
+
+router = APIRouter(
+    prefix="/batch",
+    tags=["Batch"],
+    route_class=InstrumentedRoute,
+)
+
+
+@router.post(
+    "/",
+    response_model=schemas.BatchResult,
+    operation_id=BATCH_OPERATION_ID,
+    description=BATCH_DESCRIPTION,
+    dependencies=[Depends(idempotency_key)],
+)
+async def batch(batch: schemas.BatchRequest, request: Request):
+    return render(schemas.BatchResult, await run_batch(request, batch))
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from .. import schemas
+from ..changes import CHANGES_HEARTBEAT, CHANGES_MAX_WAIT, CHANGES_STREAM_TIMEOUT, ENTITIES, PAGE_SIZE, feed
+from ..metrics import MCP_API_HOST, InstrumentedRoute
+from ..serialization import render
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["Changes"],
+    route_class=InstrumentedRoute,
+)
+
+# the MCP tools call the API with a 10 second timeout
+MCP_MAX_WAIT = 8.0
+
+SINCE_DESCRIPTION = "Return the changes after this id (next_since of the previous call); omit to start from now"
+ENTITIES_DESCRIPTION = f"Comma-separated entities to follow ({', '.join(ENTITIES)}); all by default"
+
+
+def _entities(entities: Optional[str]) -> Optional[set[str]]:
+    if entities is None:
+        return None
+    names = {name.strip() for name in entities.split(",") if name.strip()}
+    unknown = names - set(ENTITIES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown entities: {', '.join(sorted(unknown))}")
+    return names
+
+
+def _events(changes: list[dict]) -> str:
+    return "".join(
+        f"id: {change['id']}\nevent: {change['entity']}\ndata: {json.dumps(change)}\n\n" for change in changes
+    )
+
+
+@router.get(
+    "/",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}, "description": "Server-sent events, one per change"}},
+    operation_id="stream_changes",
+)
+async def stream_changes(
+    since: Optional[int] = Query(None, description=SINCE_DESCRIPTION),
+    entities: Optional[str] = Query(None, description=ENTITIES_DESCRIPTION),
+    last_event_id: Optional[int] = Header(None),
+):
+    followed = _entities(entities)
+    # a reconnecting EventSource resumes after the last event it received
+    if last_event_id is not None:
+        since = last_event_id
+    # read before the response starts, so that a since that is too old still fails with 410
+    changes, since = await feed.wait(since, followed, PAGE_SIZE, 0)
+
+    async def events():
+        nonlocal changes, since
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CHANGES_STREAM_TIMEOUT
+        yield "retry: 1000\n\n"
+        while True:
+            # a comment line every CHANGES_HEARTBEAT seconds keeps proxies from closing an idle stream
+            yield _events(changes) if changes else ": keep-alive\n\n"
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # the client reconnects, with the Last-Event-ID header
+                return
+            changes, since = await feed.wait(since, followed, PAGE_SIZE, min(CHANGES_HEARTBEAT, remaining))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/poll", response_model=schemas.ChangePage, operation_id="poll_changes")
+async def poll_changes(
+    request: Request,
+    since: Optional[int] = Query(None, description=SINCE_DESCRIPTION),
+    entities: Optional[str] = Query(None, description=ENTITIES_DESCRIPTION),
+    wait: float = Query(CHANGES_MAX_WAIT, ge=0, le=CHANGES_MAX_WAIT, description="Seconds to wait for changes"),
+    limit: int = Query(100, ge=1, le=PAGE_SIZE),
+):
+    if request.url.hostname == MCP_API_HOST:
+        wait = min(wait, MCP_MAX_WAIT)
+    changes, next_since = await feed.wait(since, _entities(entities), limit, wait)
+    return render(schemas.ChangePage, {"changes": changes, "next_since": next_since})
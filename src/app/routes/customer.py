@@ -1,69 +1,316 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import models, schemas
-from ..database import get_db
+from .. import cache, changes, models, schemas
+from ..bulk import request_body, row_result, run_bulk, update_batches
+from ..conditional import check_if_match, conditional_get, entity_etag, page_etag
+from ..database import get_db, get_read_db
+from ..export import EXPORT_RESPONSES, export_response
+from ..idempotency import idempotency_key
+from ..metrics import InstrumentedRoute
+from ..pagination import LIMIT_DESCRIPTION, page_limit, paginate
+from ..search import search_page
+from ..serialization import render
 
 router = APIRouter(
     prefix="/customers",
     tags=["Customers"],
     responses={404: {"description": "Customer not found"}},
+    route_class=InstrumentedRoute,
 )
 
 
-@router.post("/", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED, operation_id="create_customer")
-def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db)):
-    db_customer = db.query(models.Customer).filter(models.Customer.email == customer.email).first()
+@router.post(
+    "/",
+    response_model=schemas.Customer,
+    status_code=status.HTTP_201_CREATED,
+    operation_id="create_customer",
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_customer(customer: schemas.CustomerCreate, response: Response, db: AsyncSession = Depends(get_db)):
+    db_customer = await db.scalar(select(models.Customer).filter(models.Customer.email == customer.email))
     if db_customer:
         raise HTTPException(status_code=400, detail="Email already registered")
     db_customer = models.Customer(**customer.dict())
     db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    await db.flush()
+    await changes.record(db, "customer", "created", [(db_customer.id, changes.fields("customer", db_customer))])
+    await db.commit()
+    await db.refresh(db_customer)
+    await cache.invalidate("customer")
+    response.headers["ETag"] = entity_etag(db_customer)
+    return render(schemas.Customer, db_customer, response, status.HTTP_201_CREATED)
+
+
+async def _registered_emails(db: AsyncSession, emails: list[str]) -> dict[str, int]:
+    """Map each of the given emails that is already registered to the id of its customer."""
+    rows = await db.execute(select(models.Customer.email, models.Customer.id).filter(models.Customer.email.in_(emails)))
+    return {email: customer_id for email, customer_id in rows}
+
+
+@router.post(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="create_customers_bulk",
+    openapi_extra=request_body(schemas.CustomerCreate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_customers_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        registered = await _registered_emails(db, [row.email for _, row in rows])
+        results, accepted = {}, []
+        for index, row in rows:
+            if row.email in registered:
+                results[index] = row_result(index, "error", error="Email already registered")
+            else:
+                registered[row.email] = 0  # also rejects duplicates later in the chunk
+                accepted.append((index, row))
+
+        if accepted:
+            ids = (
+                await db.scalars(
+                    insert(models.Customer).returning(models.Customer.id, sort_by_parameter_order=True),
+                    [row.dict() for _, row in accepted],
+                )
+            ).all()
+            await changes.record(
+                db,
+                "customer",
+                "created",
+                [(id, changes.fields("customer", row)) for (_, row), id in zip(accepted, ids)],
+            )
+            await db.commit()
+            await cache.invalidate("customer")
+            for (index, _), customer_id in zip(accepted, ids):
+                results[index] = row_result(index, "created", id=customer_id)
+        return list(results.values())
+
+    return await run_bulk(request, db, schemas.CustomerCreate, write_chunk)
+
+
+@router.put(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="update_customers_bulk",
+    openapi_extra=request_body(schemas.CustomerBulkUpdate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_customers_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        existing = set((await db.scalars(select(models.Customer.id).filter(models.Customer.id.in_(ids)))).all())
+        registered = await _registered_emails(db, [row.email for _, row in rows])
+        results, accepted = {}, []
+        for index, row in rows:
+            if row.id not in existing:
+                results[index] = row_result(index, "error", id=row.id, error="Customer not found")
+            elif registered.get(row.email, row.id) != row.id:
+                results[index] = row_result(index, "error", id=row.id, error="Email already registered")
+            else:
+                registered[row.email] = row.id
+                accepted.append((index, row))
+
+        if accepted:
+            for batch in update_batches([row for _, row in accepted]):
+                await db.execute(update(models.Customer), batch)
+            await changes.record(
+                db, "customer", "updated", [(row.id, changes.fields("customer", row)) for _, row in accepted]
+            )
+            await db.commit()
+            await cache.invalidate("customer", *(row.id for _, row in accepted))
+            for index, row in accepted:
+                results[index] = row_result(index, "updated", id=row.id)
+        return list(results.values())
+
+    return await run_bulk(request, db, schemas.CustomerBulkUpdate, write_chunk)
+
 
+@router.post(
+    "/bulk/delete",
+    response_model=schemas.BulkResult,
+    operation_id="delete_customers_bulk",
+    openapi_extra=request_body(schemas.BulkDelete),
+    dependencies=[Depends(idempotency_key)],
+)
+async def delete_customers_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        existing = set((await db.scalars(select(models.Customer.id).filter(models.Customer.id.in_(ids)))).all())
+        # customers with orders cannot be deleted, as with delete_customer
+        with_orders = set(
+            (await db.scalars(select(models.Order.customer_id).filter(models.Order.customer_id.in_(ids)))).all()
+        )
+        deletable = existing - with_orders
+        if deletable:
+            await db.execute(delete(models.Customer).filter(models.Customer.id.in_(deletable)))
+            await changes.record(db, "customer", "deleted", [(id, None) for id in deletable])
+            await db.commit()
+            await cache.invalidate("customer", *deletable)
+
+        results = []
+        for index, row in rows:
+            if row.id in deletable:
+                results.append(row_result(index, "deleted", id=row.id))
+            elif row.id in existing:
+                results.append(row_result(index, "error", id=row.id, error="Customer has orders"))
+            else:
+                results.append(row_result(index, "error", id=row.id, error="Customer not found"))
+        return results
+
+    return await run_bulk(request, db, schemas.BulkDelete, write_chunk)
+
+
+@router.get("/", response_model=schemas.Page[schemas.Customer], operation_id="read_customers")
+async def read_customers(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, description=LIMIT_DESCRIPTION),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    params = {"skip": skip, "limit": limit, "cursor": cursor}
+    cached = await cache.lookup_list("customer", params)
+    if cached is None:
+        page = await paginate(db, select(models.Customer), models.Customer, skip, limit, cursor)
+        cached = {
+            "etag": page_etag(page["items"], page["next_cursor"]),
+            "body": schemas.Page[schemas.Customer].model_validate(page, from_attributes=True).model_dump(mode="json"),
+        }
+        await cache.store_list("customer", params, cached)
+    return render(
+        schemas.Page[schemas.Customer], conditional_get(request, response, cached["etag"], cached["body"]), response
+    )
+
+
+@router.get("/search", response_model=schemas.Page[schemas.Customer], operation_id="search_customers")
+async def search_customers(
+    request: Request,
+    response: Response,
+    q: Optional[str] = Query(None, description="Words to find in the name or email (prefixes match too)"),
+    prefix: Optional[str] = Query(None, description="Start of the name (case-insensitive)"),
+    sort: Literal["relevance", "name", "email", "id"] = "relevance",
+    order: Literal["asc", "desc"] = "asc",
+    skip: int = 0,
+    limit: int = Query(100, ge=1, description=LIMIT_DESCRIPTION),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    sort_columns = {"name": models.Customer.name, "email": models.Customer.email, "id": models.Customer.id}
+    stmt = select(models.Customer)
+    page = await search_page(db, stmt, models.Customer, q, prefix, sort_columns, sort, order, skip, limit, cursor)
+    etag = page_etag(page["items"], page["next_cursor"])
+    return render(schemas.Page[schemas.Customer], conditional_get(request, response, etag, page), response)
 
-@router.get("/", response_model=List[schemas.Customer], operation_id="read_customers")
-def read_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    customers = db.query(models.Customer).offset(skip).limit(limit).all()
-    return customers
+
+@router.get("/export", response_class=StreamingResponse, responses=EXPORT_RESPONSES, operation_id="export_customers")
+async def export_customers(request: Request):
+    return export_response(request, models.Customer, "customers")
+
+
+@router.get("/top", response_model=List[schemas.CustomerStats], operation_id="read_top_customers")
+async def read_top_customers(
+    limit: int = Query(10, ge=1, description=LIMIT_DESCRIPTION), db: AsyncSession = Depends(get_read_db)
+):
+    rows = await db.execute(
+        select(
+            models.CustomerStats.customer_id,
+            models.Customer.name,
+            models.CustomerStats.order_count,
+            models.CustomerStats.total_spent,
+        )
+        .join(models.Customer, models.Customer.id == models.CustomerStats.customer_id)
+        .filter(models.CustomerStats.order_count > 0)
+        .order_by(models.CustomerStats.total_spent.desc(), models.CustomerStats.customer_id)
+        .limit(page_limit(limit))
+    )
+    return render(List[schemas.CustomerStats], [row._asdict() for row in rows])
 
 
 @router.get("/{customer_id}", response_model=schemas.Customer, operation_id="read_customer")
-def read_customer(customer_id: int, db: Session = Depends(get_db)):
-    db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    if db_customer is None:
+async def read_customer(
+    customer_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)
+):
+    cached = await cache.lookup("customer", customer_id)
+    if cached is None:
+        db_customer = await db.get(models.Customer, customer_id)
+        if db_customer is None:
+            raise HTTPException(status_code=404, detail="Customer not found")
+        cached = {
+            "etag": entity_etag(db_customer),
+            "body": schemas.Customer.model_validate(db_customer).model_dump(mode="json"),
+        }
+        await cache.store("customer", customer_id, cached)
+    return render(schemas.Customer, conditional_get(request, response, cached["etag"], cached["body"]), response)
+
+
+@router.get("/{customer_id}/stats", response_model=schemas.CustomerStats, operation_id="read_customer_stats")
+async def read_customer_stats(customer_id: int, db: AsyncSession = Depends(get_read_db)):
+    row = (
+        await db.execute(
+            select(
+                models.Customer.id.label("customer_id"),
+                models.Customer.name,
+                func.coalesce(models.CustomerStats.order_count, 0).label("order_count"),
+                func.coalesce(models.CustomerStats.total_spent, 0.0).label("total_spent"),
+            )
+            .outerjoin(models.CustomerStats, models.CustomerStats.customer_id == models.Customer.id)
+            .filter(models.Customer.id == customer_id)
+        )
+    ).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return db_customer
+    return render(schemas.CustomerStats, row._asdict())
 
 
-@router.put("/{customer_id}", response_model=schemas.Customer, operation_id="update_customer")
-def update_customer(customer_id: int, customer: schemas.Customer, db: Session = Depends(get_db)):
-    db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
+@router.put(
+    "/{customer_id}",
+    response_model=schemas.Customer,
+    operation_id="update_customer",
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_customer(
+    customer_id: int,
+    customer: schemas.Customer,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+):
+    db_customer = await db.get(models.Customer, customer_id)
     if db_customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
+    check_if_match(request, entity_etag(db_customer))
 
     if customer.email != db_customer.email:
-        existing_customer = db.query(models.Customer).filter(models.Customer.email == customer.email).first()
+        existing_customer = await db.scalar(select(models.Customer).filter(models.Customer.email == customer.email))
         if existing_customer:
             raise HTTPException(status_code=400, detail="Email already registered")
 
     for key, value in customer.dict(exclude_unset=True).items():
         setattr(db_customer, key, value)
 
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    data = changes.fields("customer", db_customer)
+    await changes.record(db, "customer", "updated", [(id, data) for id in {customer_id, db_customer.id}])
+    await db.commit()
+    await db.refresh(db_customer)
+    await cache.invalidate("customer", customer_id, db_customer.id)
+    response.headers["ETag"] = entity_etag(db_customer)
+    return render(schemas.Customer, db_customer, response)
 
 
-@router.delete("/{customer_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_customer(customer_id: int, db: Session = Depends(get_db)):
-    db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
+@router.delete("/{customer_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(idempotency_key)])
+async def delete_customer(customer_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    db_customer = await db.get(models.Customer, customer_id)
     if db_customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
+    check_if_match(request, entity_etag(db_customer))
 
-    db.delete(db_customer)
-    db.commit()
+    await db.delete(db_customer)
+    await changes.record(db, "customer", "deleted", [(customer_id, None)])
+    await db.commit()
+    await cache.invalidate("customer", customer_id)
     return None
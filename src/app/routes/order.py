@@ -1,110 +1,379 @@
-from typing import List
+from datetime import date, timedelta
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import models, schemas
-from ..database import get_db
+from .. import cache, changes, models, schemas
+from ..aggregates import apply_order, counts_towards_aggregates, order_lines
+from ..archive import get_archived_order
+from ..bulk import request_body, row_result, run_bulk
+from ..catalog import catalog
+from ..conditional import check_if_match, conditional_get, entity_etag, page_etag
+from ..database import get_db, get_read_db
+from ..export import EXPORT_RESPONSES, export_response
+from ..idempotency import idempotency_key
+from ..inventory import end_holds, hold, holds_stock, order_quantities, return_stock, take_stock
+from ..loading import loader_options
+from ..metrics import InstrumentedRoute
+from ..pagination import LIMIT_DESCRIPTION, paginate
+from ..serialization import render
 
-router = APIRouter(prefix="/orders", tags=["Orders"], responses={404: {"description": "Not found"}})
+router = APIRouter(
+    prefix="/orders",
+    tags=["Orders"],
+    responses={404: {"description": "Not found"}},
+    route_class=InstrumentedRoute,
+)
 
+VALID_STATUSES: set[str] = {"pending", "shipped", "delivered", "cancelled"}
 
-@router.post("/", response_model=schemas.Order, status_code=status.HTTP_201_CREATED, operation_id="create_order")
-def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
-    customer = db.query(models.Customer).filter(models.Customer.id == order.customer_id).first()
+
+async def get_order(db: AsyncSession, order_id: int) -> models.Order | None:
+    """Fetch an order with everything schemas.Order serializes loaded up front."""
+    return await db.scalar(
+        select(models.Order).options(*loader_options(models.Order, schemas.Order)).filter(models.Order.id == order_id)
+    )
+
+
+async def place_order(db: AsyncSession, order: schemas.OrderCreate) -> tuple[models.Order, set[int]]:
+    """
+    Add an order to the session, taking stock for its items, without committing.
+
+    Returns the order and the ids of the products whose stock changed. Raises an HTTPException,
+    leaving partial writes to be rolled back by the caller, when the order cannot be placed.
+    """
+    customer = await db.get(models.Customer, order.customer_id)
     if not customer:
         raise HTTPException(status_code=400, detail="Customer does not exist")
 
-    # create order
-    db_order = models.Order(customer_id=order.customer_id, status=order.status)
-    db.add(db_order)
-    db.flush()  # Flush to get the order ID
+    # total quantity requested per product; a product may appear on several lines
+    quantities: dict[int, int] = {}
+    for item in order.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
 
-    total_amount = 0.0
+    # prices come from the catalog snapshot when it has them, the others from a single query
+    prices = catalog.prices(quantities)
+    missing = [product_id for product_id in quantities if product_id not in prices]
+    if missing:
+        rows = await db.execute(select(models.Product.id, models.Product.price).filter(models.Product.id.in_(missing)))
+        prices.update((row.id, row.price) for row in rows)
 
-    # add items to order
     for item in order.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            db.rollback()
+        if item.product_id not in prices:
             raise HTTPException(status_code=404, detail=f"Product ID {item.product_id} does not exist")
 
-        if product.stock < item.quantity:
-            db.rollback()
-            raise HTTPException(
-                status_code=400,
-                detail=f"Insufficient stock for product ID {item.product_id}. Available: {product.stock}, Requested: {item.quantity}",
-            )
-
-        # create order item
-        order_item = models.OrderItem(
-            order_id=db_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price_at_time=product.price,
+    # create order
+    total_amount = sum(item.quantity * prices[item.product_id] for item in order.items)
+    db_order = models.Order(customer_id=order.customer_id, status=order.status, total_amount=total_amount)
+    db.add(db_order)
+    await db.flush()  # Flush to get the order ID
+    await changes.record(db, "order", "created", [(db_order.id, changes.fields("order", db_order))])
+
+    if quantities:
+        # add items to order
+        await db.execute(
+            insert(models.OrderItem),
+            [
+                {
+                    "order_id": db_order.id,
+                    "product_id": item.product_id,
+                    "quantity": item.quantity,
+                    "price_at_time": prices[item.product_id],
+                }
+                for item in order.items
+            ],
         )
-        db.add(order_item)
 
-        # update product stock
-        product.stock -= item.quantity
+        # the stock is checked and taken by the database, so concurrent orders cannot oversell
+        if holds_stock(db_order.status):
+            short = await take_stock(db, quantities, db_order.id, "order")
+            if short:
+                raise await insufficient_stock(db, short, quantities)
+            await hold(db, db_order)
+
+    if counts_towards_aggregates(db_order.status):
+        lines = [(item.product_id, item.quantity, prices[item.product_id]) for item in order.items]
+        await apply_order(db, db_order, lines)
+
+    return db_order, set(quantities)
+
+
+async def insufficient_stock(db: AsyncSession, short: set[int], quantities: dict[int, int]) -> HTTPException:
+    product_id = min(short)
+    available = await db.scalar(select(models.Product.stock).filter(models.Product.id == product_id))
+    if available is None:
+        return HTTPException(status_code=404, detail=f"Product ID {product_id} does not exist")
+    return HTTPException(
+        status_code=400,
+        detail=f"Insufficient stock for product ID {product_id}. "
+        f"Available: {available}, Requested: {quantities[product_id]}",
+    )
+
+
+async def remove_order(db: AsyncSession, db_order: models.Order) -> set[int]:
+    """Delete an order (with its items loaded), restocking its products; returns the restocked product ids."""
+    restocked: set[int] = set()
+    if counts_towards_aggregates(db_order.status):
+        await apply_order(db, db_order, order_lines(db_order), -1)
+    if holds_stock(db_order.status):
+        quantities = order_quantities(db_order)
+        await return_stock(db, quantities, db_order.id, "deleted")
+        restocked = set(quantities)
+    if db_order.status == "pending":
+        await end_holds(db, [db_order.id])
+
+    await db.delete(db_order)
+    await changes.record(db, "order", "deleted", [(db_order.id, None)])
+    return restocked
+
+
+async def change_status(db: AsyncSession, db_order: models.Order, status: str) -> set[int]:
+    """
+    Set the status of an order (with its items loaded), without committing.
 
-        # calculate total amount
-        total_amount += item.quantity * product.price
+    Cancelling an order returns its stock, and reinstating it takes the stock again (raising an
+    HTTPException when it has run out); the order also moves in or out of the sales aggregates.
+    Returns the ids of the products whose stock changed.
+    """
+    changed: set[int] = set()
+    if holds_stock(status) != holds_stock(db_order.status):
+        quantities = order_quantities(db_order)
+        if holds_stock(status):
+            short = await take_stock(db, quantities, db_order.id, "reinstated")
+            if short:
+                raise await insufficient_stock(db, short, quantities)
+        else:
+            await return_stock(db, quantities, db_order.id, "cancelled")
+        changed = set(quantities)
+    if db_order.status == "pending" and status != "pending":
+        await end_holds(db, [db_order.id])
 
-    # update order total amount
-    db_order.total_amount = total_amount
+    counted = counts_towards_aggregates(status)
+    if counted != counts_towards_aggregates(db_order.status):
+        await apply_order(db, db_order, order_lines(db_order), 1 if counted else -1)
+    db_order.status = status
+    await changes.record(db, "order", "updated", [(db_order.id, {"status": status})])
+    return changed
+
+
+@router.post(
+    "/",
+    response_model=schemas.Order,
+    status_code=status.HTTP_201_CREATED,
+    operation_id="create_order",
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_order(order: schemas.OrderCreate, response: Response, db: AsyncSession = Depends(get_db)):
+    db_order, changed = await place_order(db, order)
+
+    await db.commit()
+    if changed:
+        await cache.invalidate("product", *changed)
+    await db.refresh(db_order, attribute_names=["items"])
+    response.headers["ETag"] = entity_etag(db_order)
+    return render(schemas.Order, db_order, response, status.HTTP_201_CREATED)
+
+
+@router.post(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="create_orders_bulk",
+    openapi_extra=request_body(schemas.OrderCreate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_orders_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        results, changed = [], set()
+        for index, order in rows:
+            # each order gets a savepoint, so a failed order does not undo the rest of the chunk
+            try:
+                async with db.begin_nested():
+                    db_order, order_changed = await place_order(db, order)
+            except HTTPException as err:
+                results.append(row_result(index, "error", error=err.detail))
+                continue
+            results.append(row_result(index, "created", id=db_order.id))
+            changed |= order_changed
+
+        await db.commit()
+        if changed:
+            await cache.invalidate("product", *changed)
+        return results
+
+    return await run_bulk(request, db, schemas.OrderCreate, write_chunk)
+
+
+@router.put(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="update_orders_status_bulk",
+    openapi_extra=request_body(schemas.OrderStatusBulkUpdate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_orders_status_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        stmt = select(models.Order).options(*loader_options(models.Order, schemas.Order))
+        orders = {order.id: order for order in await db.scalars(stmt.filter(models.Order.id.in_(ids)))}
+        results, changed = [], set()
+        for index, row in rows:
+            if row.id not in orders:
+                results.append(row_result(index, "error", id=row.id, error="Order not found"))
+            elif row.status not in VALID_STATUSES:
+                results.append(row_result(index, "error", id=row.id, error=f"Invalid status: {row.status}"))
+            else:
+                # reinstating a cancelled order can fail for lack of stock, without undoing the other rows
+                try:
+                    async with db.begin_nested():
+                        changed |= await change_status(db, orders[row.id], row.status)
+                except HTTPException as err:
+                    results.append(row_result(index, "error", id=row.id, error=err.detail))
+                    continue
+                results.append(row_result(index, "updated", id=row.id))
+        await db.commit()
+        if changed:
+            await cache.invalidate("product", *changed)
+        return results
 
-    db.commit()
-    db.refresh(db_order)
-    return db_order
+    return await run_bulk(request, db, schemas.OrderStatusBulkUpdate, write_chunk)
 
 
-@router.get("/", response_model=List[schemas.Order], operation_id="read_orders")
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    orders = db.query(models.Order).offset(skip).limit(limit).all()
-    return orders
+@router.post(
+    "/bulk/delete",
+    response_model=schemas.BulkResult,
+    operation_id="delete_orders_bulk",
+    openapi_extra=request_body(schemas.BulkDelete),
+    dependencies=[Depends(idempotency_key)],
+)
+async def delete_orders_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        stmt = select(models.Order).options(*loader_options(models.Order, schemas.Order))
+        orders = {order.id: order for order in await db.scalars(stmt.filter(models.Order.id.in_(ids)))}
+        results, restocked = [], set()
+        for index, row in rows:
+            if row.id not in orders:
+                results.append(row_result(index, "error", id=row.id, error="Order not found"))
+                continue
+            restocked |= await remove_order(db, orders.pop(row.id))
+            results.append(row_result(index, "deleted", id=row.id))
+        await db.commit()
+        if restocked:
+            await cache.invalidate("product", *restocked)
+        return results
+
+    return await run_bulk(request, db, schemas.BulkDelete, write_chunk)
+
+
+@router.get("/", response_model=schemas.Page[schemas.Order], operation_id="read_orders")
+async def read_orders(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, description=LIMIT_DESCRIPTION),
+    cursor: Optional[str] = None,
+    customer_id: Optional[int] = None,
+    status: Optional[str] = None,
+    from_date: Optional[date] = Query(None, alias="from", description="Orders placed on or after this date"),
+    to_date: Optional[date] = Query(None, alias="to", description="Orders placed on or before this date"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    stmt = select(models.Order).options(*loader_options(models.Order, schemas.Order))
+    if customer_id is not None:
+        stmt = stmt.filter(models.Order.customer_id == customer_id)
+    if status is not None:
+        stmt = stmt.filter(models.Order.status == status)
+    if from_date is not None:
+        stmt = stmt.filter(models.Order.order_date >= from_date)
+    if to_date is not None:
+        stmt = stmt.filter(models.Order.order_date < to_date + timedelta(days=1))
+    page = await paginate(db, stmt, models.Order, skip, limit, cursor)
+    etag = page_etag(page["items"], page["next_cursor"])
+    return render(schemas.Page[schemas.Order], conditional_get(request, response, etag, page), response)
+
+
+@router.get("/export", response_class=StreamingResponse, responses=EXPORT_RESPONSES, operation_id="export_orders")
+async def export_orders(request: Request):
+    return export_response(request, models.Order, "orders")
+
+
+@router.get("/summary", response_model=schemas.OrderSummary, operation_id="read_orders_summary")
+async def read_orders_summary(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    stmt = select(
+        func.coalesce(func.sum(models.DailySales.order_count), 0).label("order_count"),
+        func.coalesce(func.sum(models.DailySales.units_sold), 0).label("units_sold"),
+        func.coalesce(func.sum(models.DailySales.revenue), 0.0).label("revenue"),
+    )
+    if from_date is not None:
+        stmt = stmt.filter(models.DailySales.day >= from_date)
+    if to_date is not None:
+        stmt = stmt.filter(models.DailySales.day <= to_date)
+    totals = (await db.execute(stmt)).one()
+    summary = {"from_date": from_date, "to_date": to_date, **totals._asdict()}
+    return render(schemas.OrderSummary, summary)
 
 
 @router.get("/{order_id}", response_model=schemas.Order, operation_id="read_order")
-def read_order(order_id: int, db: Session = Depends(get_db)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+async def read_order(order_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    db_order = await get_order(db, order_id)
+    if db_order is None:
+        db_order = await get_archived_order(db, order_id)
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
-    return db_order
+    return render(schemas.Order, conditional_get(request, response, entity_etag(db_order), db_order), response)
 
 
-@router.put("/{order_id}/status", response_model=schemas.Order, operation_id="update_order_status")
-def update_order_status(order_id: int, status: str, db: Session = Depends(get_db)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+@router.put(
+    "/{order_id}/status",
+    response_model=schemas.Order,
+    operation_id="update_order_status",
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_order_status(
+    order_id: int, status: str, request: Request, response: Response, db: AsyncSession = Depends(get_db)
+):
+    db_order = await get_order(db, order_id)
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    check_if_match(request, entity_etag(db_order))
 
-    valid_statuses: set[str] = {"pending", "shipped", "delivered", "cancelled"}
-    if status not in valid_statuses:
+    if status not in VALID_STATUSES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid status. Valid statuses are: {', '.join(valid_statuses)}",
+            detail=f"Invalid status. Valid statuses are: {', '.join(VALID_STATUSES)}",
         )
 
-    db_order.status = status
-    db.commit()
-    db.refresh(db_order)
-    return db_order
+    changed = await change_status(db, db_order, status)
+    await db.commit()
+    if changed:
+        await cache.invalidate("product", *changed)
+    await db.refresh(db_order, attribute_names=["status", "updated_at", "items"])
+    response.headers["ETag"] = entity_etag(db_order)
+    return render(schemas.Order, db_order, response)
 
 
-@router.delete("/{order_id}", status_code=status.HTTP_204_NO_CONTENT, operation_id="delete_order")
-def delete_order(order_id: int, db: Session = Depends(get_db)):
-    db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
+@router.delete(
+    "/{order_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="delete_order",
+    dependencies=[Depends(idempotency_key)],
+)
+async def delete_order(order_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    db_order = await get_order(db, order_id)
     if db_order is None:
         raise HTTPException(status_code=404, detail="Order not found")
+    check_if_match(request, entity_etag(db_order))
 
     # Restock products
-    if db_order.status != "cancelled":
-        for item in db_order.items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            if product:
-                product.stock += item.quantity
-
-    db.delete(db_order)
-    db.commit()
+    restocked = await remove_order(db, db_order)
+    await db.commit()
+    if restocked:
+        await cache.invalidate("product", *restocked)
     return None
@@ -1,57 +1,285 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import models, schemas
-from ..database import get_db
+from .. import cache, changes, models, schemas
+from ..bulk import request_body, row_result, run_bulk, update_batches
+from ..catalog import catalog
+from ..conditional import check_if_match, conditional_get, entity_etag, page_etag
+from ..database import get_db, get_read_db
+from ..export import EXPORT_RESPONSES, export_response
+from ..idempotency import idempotency_key
+from ..metrics import InstrumentedRoute
+from ..pagination import LIMIT_DESCRIPTION, page_limit, paginate
+from ..search import search_page
+from ..serialization import render
 
-router = APIRouter(prefix="/products", tags=["Products"], responses={404: {"description": "Not found"}})
+router = APIRouter(
+    prefix="/products",
+    tags=["Products"],
+    responses={404: {"description": "Not found"}},
+    route_class=InstrumentedRoute,
+)
 
 
-@router.post("/", response_model=schemas.Product, status_code=status.HTTP_201_CREATED, operation_id="create_product")
-def create_product(product: schemas.Product, db: Session = Depends(get_db)):
+@router.post(
+    "/",
+    response_model=schemas.Product,
+    status_code=status.HTTP_201_CREATED,
+    operation_id="create_product",
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_product(product: schemas.Product, response: Response, db: AsyncSession = Depends(get_db)):
     db_product = models.Product(**product.dict())
     db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    await changes.record(db, "product", "created", [(db_product.id, changes.fields("product", db_product))])
+    await db.commit()
+    await db.refresh(db_product)
+    await cache.invalidate("product")
+    response.headers["ETag"] = entity_etag(db_product)
+    return render(schemas.Product, db_product, response, status.HTTP_201_CREATED)
 
 
-@router.get("/", response_model=List[schemas.Product], operation_id="read_products")
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = db.query(models.Product).offset(skip).limit(limit).all()
-    return products
+@router.post(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="create_products_bulk",
+    openapi_extra=request_body(schemas.ProductCreate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def create_products_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = (
+            await db.scalars(
+                insert(models.Product).returning(models.Product.id, sort_by_parameter_order=True),
+                [row.dict() for _, row in rows],
+            )
+        ).all()
+        await changes.record(
+            db, "product", "created", [(id, changes.fields("product", row)) for (_, row), id in zip(rows, ids)]
+        )
+        await db.commit()
+        await cache.invalidate("product")
+        return [row_result(index, "created", id=product_id) for (index, _), product_id in zip(rows, ids)]
+
+    return await run_bulk(request, db, schemas.ProductCreate, write_chunk)
+
+
+@router.put(
+    "/bulk",
+    response_model=schemas.BulkResult,
+    operation_id="update_products_bulk",
+    openapi_extra=request_body(schemas.ProductBulkUpdate),
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_products_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        existing = set((await db.scalars(select(models.Product.id).filter(models.Product.id.in_(ids)))).all())
+        if existing:
+            updated = [row for _, row in rows if row.id in existing]
+            for batch in update_batches(updated):
+                await db.execute(update(models.Product), batch)
+            await changes.record(
+                db, "product", "updated", [(row.id, changes.fields("product", row)) for row in updated]
+            )
+            await db.commit()
+            await cache.invalidate("product", *existing)
+        return [
+            row_result(index, "updated", id=row.id)
+            if row.id in existing
+            else row_result(index, "error", id=row.id, error="Product not found")
+            for index, row in rows
+        ]
+
+    return await run_bulk(request, db, schemas.ProductBulkUpdate, write_chunk)
+
+
+@router.post(
+    "/bulk/delete",
+    response_model=schemas.BulkResult,
+    operation_id="delete_products_bulk",
+    openapi_extra=request_body(schemas.BulkDelete),
+    dependencies=[Depends(idempotency_key)],
+)
+async def delete_products_bulk(request: Request, db: AsyncSession = Depends(get_db)):
+    async def write_chunk(rows):
+        ids = [row.id for _, row in rows]
+        existing = set((await db.scalars(select(models.Product.id).filter(models.Product.id.in_(ids)))).all())
+        if existing:
+            await db.execute(delete(models.Product).filter(models.Product.id.in_(existing)))
+            await changes.record(db, "product", "deleted", [(id, None) for id in existing])
+            await db.commit()
+            await cache.invalidate("product", *existing)
+        return [
+            row_result(index, "deleted", id=row.id)
+            if row.id in existing
+            else row_result(index, "error", id=row.id, error="Product not found")
+            for index, row in rows
+        ]
+
+    return await run_bulk(request, db, schemas.BulkDelete, write_chunk)
+
+
+@router.get("/", response_model=schemas.Page[schemas.Product], operation_id="read_products")
+async def read_products(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, description=LIMIT_DESCRIPTION),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    params = {"skip": skip, "limit": limit, "cursor": cursor}
+    # pages the catalog snapshot can build skip the cache, which only holds pages read from the database
+    page = catalog.page(skip, limit, cursor)
+    cached = await cache.lookup_list("product", params) if page is None else None
+    if cached is None:
+        from_database = page is None
+        if from_database:
+            page = await paginate(db, select(models.Product), models.Product, skip, limit, cursor)
+        cached = {
+            "etag": page_etag(page["items"], page["next_cursor"]),
+            "body": schemas.Page[schemas.Product].model_validate(page, from_attributes=True).model_dump(mode="json"),
+        }
+        if from_database:
+            await cache.store_list("product", params, cached)
+    return render(
+        schemas.Page[schemas.Product], conditional_get(request, response, cached["etag"], cached["body"]), response
+    )
+
+
+@router.get("/search", response_model=schemas.Page[schemas.Product], operation_id="search_products")
+async def search_products(
+    request: Request,
+    response: Response,
+    q: Optional[str] = Query(None, description="Words to find in the name or description (prefixes match too)"),
+    prefix: Optional[str] = Query(None, description="Start of the name (case-insensitive)"),
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_stock: Optional[int] = None,
+    max_stock: Optional[int] = None,
+    sort: Literal["relevance", "name", "price", "stock", "id"] = "relevance",
+    order: Literal["asc", "desc"] = "asc",
+    skip: int = 0,
+    limit: int = Query(100, ge=1, description=LIMIT_DESCRIPTION),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    stmt = select(models.Product)
+    if min_price is not None:
+        stmt = stmt.filter(models.Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.filter(models.Product.price <= max_price)
+    if min_stock is not None:
+        stmt = stmt.filter(models.Product.stock >= min_stock)
+    if max_stock is not None:
+        stmt = stmt.filter(models.Product.stock <= max_stock)
+    sort_columns = {
+        "name": models.Product.name,
+        "price": models.Product.price,
+        "stock": func.coalesce(models.Product.stock, 0),
+        "id": models.Product.id,
+    }
+    page = await search_page(db, stmt, models.Product, q, prefix, sort_columns, sort, order, skip, limit, cursor)
+    etag = page_etag(page["items"], page["next_cursor"])
+    return render(schemas.Page[schemas.Product], conditional_get(request, response, etag, page), response)
+
+
+@router.get("/export", response_class=StreamingResponse, responses=EXPORT_RESPONSES, operation_id="export_products")
+async def export_products(request: Request):
+    return export_response(request, models.Product, "products")
+
+
+@router.get("/top", response_model=List[schemas.ProductSales], operation_id="read_top_products")
+async def read_top_products(
+    by: Literal["revenue", "units"] = "revenue",
+    limit: int = Query(10, ge=1, description=LIMIT_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db),
+):
+    column = models.ProductSales.revenue if by == "revenue" else models.ProductSales.units_sold
+    rows = await db.execute(
+        select(
+            models.ProductSales.product_id,
+            models.Product.name,
+            models.ProductSales.order_count,
+            models.ProductSales.units_sold,
+            models.ProductSales.revenue,
+        )
+        .join(models.Product, models.Product.id == models.ProductSales.product_id)
+        .filter(models.ProductSales.order_count > 0)
+        .order_by(column.desc(), models.ProductSales.product_id)
+        .limit(page_limit(limit))
+    )
+    return render(List[schemas.ProductSales], [row._asdict() for row in rows])
 
 
 @router.get("/{product_id}", response_model=schemas.Product, operation_id="read_product")
-def read_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
+async def read_product(product_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    record = catalog.get(product_id)
+    if record is not None:
+        cached = {"etag": entity_etag(record), "body": schemas.Product.model_validate(record).model_dump(mode="json")}
+    else:
+        cached = await cache.lookup("product", product_id)
+    if cached is None:
+        db_product = await db.get(models.Product, product_id)
+        if db_product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        cached = {
+            "etag": entity_etag(db_product),
+            "body": schemas.Product.model_validate(db_product).model_dump(mode="json"),
+        }
+        await cache.store("product", product_id, cached)
+    return render(schemas.Product, conditional_get(request, response, cached["etag"], cached["body"]), response)
 
 
-@router.put("/{product_id}", response_model=schemas.Product, operation_id="update_product")
-def update_product(product_id: int, product: schemas.Product, db: Session = Depends(get_db)):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+@router.put(
+    "/{product_id}",
+    response_model=schemas.Product,
+    operation_id="update_product",
+    dependencies=[Depends(idempotency_key)],
+)
+async def update_product(
+    product_id: int,
+    product: schemas.Product,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+):
+    db_product = await db.get(models.Product, product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    check_if_match(request, entity_etag(db_product))
 
     for var, value in product.dict().items():
         setattr(db_product, var, value)
 
-    db.commit()
-    db.refresh(db_product)
-    return db_product
+    data = changes.fields("product", db_product)
+    await changes.record(db, "product", "updated", [(id, data) for id in {product_id, db_product.id}])
+    await db.commit()
+    await db.refresh(db_product)
+    await cache.invalidate("product", product_id, db_product.id)
+    response.headers["ETag"] = entity_etag(db_product)
+    return render(schemas.Product, db_product, response)
 
 
-@router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT, operation_id="delete_product")
-def delete_product(product_id: int, db: Session = Depends(get_db)):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+@router.delete(
+    "/{product_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    operation_id="delete_product",
+    dependencies=[Depends(idempotency_key)],
+)
+async def delete_product(product_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    db_product = await db.get(models.Product, product_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    check_if_match(request, entity_etag(db_product))
 
-    db.delete(db_product)
-    db.commit()
+    await db.delete(db_product)
+    await changes.record(db, "product", "deleted", [(product_id, None)])
+    await db.commit()
+    await cache.invalidate("product", product_id)
     return None
@@ -2,12 +2,26 @@
 Script to generate sample data for testing the API.
 To run this script, execute:
     python src/app/sample_data.py
+
+To generate a large synthetic dataset for benchmarks instead, execute (from src/):
+    python -m app.sample_data --customers 100000 --products 10000 --orders 1000000
 """
 
+import argparse
+import random
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Iterator
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.session import Session
 
 from app import models
+from app.aggregates import rebuild_aggregates
 from app.database import SessionLocal
+from app.migrations import migrate
+
+SYNTHETIC_STATUSES: dict[str, int] = {"pending": 20, "shipped": 20, "delivered": 55, "cancelled": 5}
 
 
 def create_sample_data() -> None:
@@ -130,7 +144,135 @@ def create_sample_data() -> None:
         db.commit()
         print("Created order 2 for Bob.")
 
-    except Exception as err:
+        rebuild_aggregates(db)
+        print("Built sales aggregates.")
+
+    except SQLAlchemyError as err:
+        db.rollback()
+        print(f"Error occurred: {err}")
+    finally:
+        db.close()
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    batch: list[dict] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _next_id(db: Session, model: Any) -> int:
+    return (db.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def create_synthetic_data(
+    customers: int,
+    products: int,
+    orders: int,
+    items_per_order: int = 3,
+    batch_size: int = 10_000,
+    seed: int = 0,
+) -> None:
+    """
+    Append a synthetic dataset of the given size to the database, for benchmarks.
+
+    Rows are written with multi-row inserts in batches of `batch_size`, without building ORM
+    objects, so millions of rows can be generated. The same seed always generates the same data.
+    Orders reference the generated customers and products only, with up to `items_per_order` items.
+    """
+    rng = random.Random(seed)
+    db: Session = SessionLocal()
+    now = datetime.utcnow()
+
+    try:
+        first_customer = _next_id(db, models.Customer)
+        customer_rows = (
+            {
+                "id": customer_id,
+                "name": f"Customer {customer_id}",
+                "email": f"customer{customer_id}@example.com",
+                "phone": f"555-{rng.randrange(10_000_000):07d}",
+                "address": f"{rng.randrange(1, 10_000)} Synthetic Ave",
+                "created_at": now,
+                "updated_at": now,
+            }
+            for customer_id in range(first_customer, first_customer + customers)
+        )
+        for batch in _batches(customer_rows, batch_size):
+            db.execute(insert(models.Customer), batch)
+            db.commit()
+        print(f"Created {customers} customers.")
+
+        first_product = _next_id(db, models.Product)
+        prices = [round(rng.uniform(1, 500), 2) for _ in range(products)]
+        product_rows = (
+            {
+                "id": first_product + n,
+                "name": f"Product {first_product + n}",
+                "description": f"Synthetic product {first_product + n}",
+                "price": price,
+                # plenty of stock, so that write workloads do not run out
+                "stock": rng.randrange(1_000, 1_000_000),
+                "created_at": now,
+                "updated_at": now,
+            }
+            for n, price in enumerate(prices)
+        )
+        for batch in _batches(product_rows, batch_size):
+            db.execute(insert(models.Product), batch)
+            db.commit()
+        print(f"Created {products} products.")
+
+        if orders and customers and products:
+            statuses, weights = list(SYNTHETIC_STATUSES), list(SYNTHETIC_STATUSES.values())
+            first_order = _next_id(db, models.Order)
+            items_per_order = min(items_per_order, products)
+            order_batch: list[dict] = []
+            item_batch: list[dict] = []
+            for order_id in range(first_order, first_order + orders):
+                order_date = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+                total_amount = 0.0
+                for n in rng.sample(range(products), rng.randint(1, items_per_order)):
+                    quantity = rng.randint(1, 5)
+                    total_amount += quantity * prices[n]
+                    item_batch.append(
+                        {
+                            "order_id": order_id,
+                            "product_id": first_product + n,
+                            "quantity": quantity,
+                            "price_at_time": prices[n],
+                        }
+                    )
+                order_batch.append(
+                    {
+                        "id": order_id,
+                        "customer_id": first_customer + rng.randrange(customers),
+                        "order_date": order_date,
+                        "status": rng.choices(statuses, weights)[0],
+                        "total_amount": round(total_amount, 2),
+                        "created_at": order_date,
+                        "updated_at": order_date,
+                    }
+                )
+                if len(order_batch) >= batch_size:
+                    db.execute(insert(models.Order), order_batch)
+                    db.execute(insert(models.OrderItem), item_batch)
+                    db.commit()
+                    order_batch, item_batch = [], []
+            if order_batch:
+                db.execute(insert(models.Order), order_batch)
+                db.execute(insert(models.OrderItem), item_batch)
+                db.commit()
+            print(f"Created {orders} orders.")
+
+        rebuild_aggregates(db)
+        print("Built sales aggregates.")
+
+    except SQLAlchemyError as err:
         db.rollback()
         print(f"Error occurred: {err}")
     finally:
@@ -138,4 +280,21 @@ def create_sample_data() -> None:
 
 
 if __name__ == "__main__":
-    create_sample_data()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=0, help="synthetic customers to generate")
+    parser.add_argument("--products", type=int, default=0, help="synthetic products to generate")
+    parser.add_argument("--orders", type=int, default=0, help="synthetic orders to generate")
+    parser.add_argument("--items-per-order", type=int, default=3, help="maximum items per synthetic order")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows per insert")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.customers or args.products or args.orders:
+        from app.database import engine
+
+        migrate(engine)
+        create_synthetic_data(
+            args.customers, args.products, args.orders, args.items_per_order, args.batch_size, args.seed
+        )
+    else:
+        create_sample_data()
@@ -1,8 +1,10 @@
-from datetime import datetime
-from typing import List, Optional
+from datetime import date, datetime
+from typing import Any, Dict, Generic, List, Optional, TypeVar
 
 from pydantic import BaseModel, Field
 
+T = TypeVar("T")
+
 
 # Product Schemas
 class ProductBase(BaseModel):
@@ -90,3 +92,105 @@ class CustomerWithOrders(Customer):
 class OrderWithDetails(Order):
     customer: Customer
     items: List[OrderItem] = []
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+# Bulk Schemas
+class ProductBulkUpdate(ProductBase):
+    id: int
+
+
+class CustomerBulkUpdate(CustomerBase):
+    id: int
+
+
+class OrderStatusBulkUpdate(BaseModel):
+    id: int
+    status: str
+
+
+class BulkDelete(BaseModel):
+    id: int
+
+
+class BulkRowResult(BaseModel):
+    index: int
+    status: str
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BulkRowResult]
+
+
+# Change Feed Schemas
+class Change(BaseModel):
+    id: int
+    entity: str
+    entity_id: int
+    action: str
+    data: Optional[Dict[str, Any]] = None
+    created_at: datetime
+
+
+class ChangePage(BaseModel):
+    changes: List[Change]
+    next_since: int = Field(description="Pass as since to get the changes that follow")
+
+
+# Batch Schemas
+class BatchOperation(BaseModel):
+    operation_id: str = Field(description="Name of the operation (the MCP tool) to run")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Path and query parameters")
+    body: Optional[Any] = Field(None, description="Request body, for operations that take one")
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    atomic: bool = Field(False, description="Roll back every operation if one fails, and skip the rest")
+
+
+class BatchOperationResult(BaseModel):
+    index: int
+    operation_id: str
+    status_code: Optional[int] = Field(None, description="HTTP status of the operation; null when it was skipped")
+    body: Optional[Any] = None
+
+
+class BatchResult(BaseModel):
+    committed: bool
+    succeeded: int
+    failed: int
+    results: List[BatchOperationResult]
+
+
+# Aggregate Schemas
+class CustomerStats(BaseModel):
+    customer_id: int
+    name: str
+    order_count: int
+    total_spent: float
+
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: str
+    order_count: int
+    units_sold: int
+    revenue: float
+
+
+class OrderSummary(BaseModel):
+    from_date: Optional[date] = None
+    to_date: Optional[date] = None
+    order_count: int
+    units_sold: int
+    revenue: float
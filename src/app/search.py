@@ -0,0 +1,96 @@
+"""
+Product and customer search.
+
+`q` is matched against the full-text index of a table (the columns in models.SEARCH_COLUMNS): every
+word must occur in the row, as a whole word or as the start of one. `prefix` matches the start of
+the name, ignoring case. On SQLite the index is an FTS5 table kept in sync by triggers, on
+PostgreSQL a GIN index on a tsvector expression; both are created with the tables (see models.py).
+Other databases fall back to unindexed LIKE matching.
+"""
+
+import re
+from typing import Any, Optional
+
+from sqlalchemy import ColumnElement, Select, column, func, literal_column, or_, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import SEARCH_COLUMNS, search_document
+from .pagination import paginate_sorted
+
+_WORD = re.compile(r"\w+")
+
+
+def _words(text: Optional[str]) -> list[str]:
+    return _WORD.findall(text.lower()) if text else []
+
+
+def _like_prefix(text: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", text.lower()) + "%"
+
+
+def _fts5_query(words: list[str], prefix_words: list[str]) -> str:
+    # words are quoted, so that nothing in them is read as FTS5 syntax
+    terms = [f'"{word}"*' for word in words]
+    if prefix_words:
+        phrase = " + ".join(f'"{word}"' for word in prefix_words)
+        terms.append(f"name : ^ {phrase}*")
+    return " ".join(terms)
+
+
+def apply_search(
+    stmt: Select, model: Any, dialect: str, q: Optional[str], prefix: Optional[str]
+) -> tuple[Select, Optional[ColumnElement]]:
+    """Filter a query on a model by full-text words and name prefix; also returns a relevance key (lower is better)."""
+    words, prefix_words = _words(q), _words(prefix)
+    if not words and not prefix_words:
+        return stmt, None
+    tablename = model.__tablename__
+
+    if dialect == "sqlite":
+        fts = table(f"{tablename}_fts", column("rowid"), column("rank"))
+        stmt = stmt.join(fts, fts.c.rowid == model.id).filter(
+            literal_column(fts.name).op("MATCH")(_fts5_query(words, prefix_words))
+        )
+        # bm25() scores, more negative for better matches
+        return stmt, fts.c.rank if words else None
+
+    relevance = None
+    if prefix_words:
+        stmt = stmt.filter(func.lower(model.name).like(_like_prefix(prefix.strip()), escape="\\"))
+    if words and dialect == "postgresql":
+        document = literal_column(search_document(tablename))
+        query = func.to_tsquery("simple", " & ".join(f"{word}:*" for word in words))
+        stmt = stmt.filter(document.op("@@")(query))
+        relevance = -func.ts_rank(document, query)
+    elif words:
+        columns = [getattr(model, name) for name in SEARCH_COLUMNS[tablename]]
+        for word in words:
+            stmt = stmt.filter(or_(*(func.lower(col).like(f"%{word}%") for col in columns)))
+    return stmt, relevance
+
+
+async def search_page(
+    db: AsyncSession,
+    stmt: Select,
+    model: Any,
+    q: Optional[str],
+    prefix: Optional[str],
+    sort_columns: dict[str, ColumnElement],
+    sort: str,
+    order: str,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+) -> dict:
+    """
+    Run a search one page at a time.
+
+    `stmt` selects the model, with any other filters applied. Results are sorted by relevance
+    (best first, or by id when there are no search words) or by one of `sort_columns`.
+    """
+    stmt, relevance = apply_search(stmt, model, db.bind.dialect.name, q, prefix)
+    if sort == "relevance":
+        sort_key = relevance if relevance is not None else model.id
+    else:
+        sort_key = sort_columns[sort]
+    return await paginate_sorted(db, stmt, model, sort_key, order == "desc", skip, limit, cursor)
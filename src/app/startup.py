@@ -0,0 +1,101 @@
+"""
+Fast start, for containers started on demand.
+
+With FAST_START, the work that used to happen before the first request is deferred or moved out:
+
+- the database engines and their pools are created on first use (see app/database.py);
+- the MCP server (fastapi_mcp and the mcp SDK are the slowest imports) is set up in the background
+  once the server is up, and /mcp requests arriving before it is ready wait for it;
+- run.py neither migrates nor seeds the database: `python -m app.cli setup` does that, as a
+  deployment step run once rather than by every container.
+
+Independently of FAST_START, OPENAPI_SCHEMA_FILE names a schema file built ahead of time, e.g. when
+building the image (from src/):
+    python -m app.cli build-schema --output openapi.json
+
+It holds the OpenAPI schema, which the app serves instead of generating it, and the MCP tools, which
+the MCP server loads instead of converting the schema. A file built for other routes or another
+version of the app is ignored, with a warning.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from importlib.metadata import version
+from typing import Any, Optional
+
+from fastapi import FastAPI, Request
+from starlette.routing import Route
+
+logger = logging.getLogger(__name__)
+
+FAST_START: bool = os.getenv("FAST_START", "false").lower() in ("1", "true", "yes")
+OPENAPI_SCHEMA_FILE: str = os.getenv("OPENAPI_SCHEMA_FILE", "")
+
+
+def routes_fingerprint(app: FastAPI) -> str:
+    """Identifies what the schema of an app is built from: its version, routes, and the fastapi-mcp release."""
+    routes = sorted(
+        (route.path, sorted(route.methods or ()), route.name)
+        for route in app.routes
+        if isinstance(route, Route) and route.include_in_schema
+    )
+    key = json.dumps([app.version, version("fastapi-mcp"), routes])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def build_schema(app: FastAPI) -> dict[str, Any]:
+    """The OpenAPI schema and MCP tools of an app, to save with json.dump for load_schema."""
+    from .mcp_server import create_mcp, mcp_schema
+
+    return {"fingerprint": routes_fingerprint(app), "openapi": app.openapi(), "mcp": mcp_schema(create_mcp(app))}
+
+
+def load_schema(app: FastAPI, path: str = OPENAPI_SCHEMA_FILE) -> Optional[dict[str, Any]]:
+    """The prebuilt schema in path, if it was built for the routes of the app."""
+    if not path:
+        return None
+    try:
+        with open(path, encoding="utf-8") as file:
+            schema = json.load(file)
+    except (OSError, ValueError) as err:
+        logger.warning("Cannot load the prebuilt schema %s, generating it instead: %s", path, err)
+        return None
+    if schema.get("fingerprint") != routes_fingerprint(app):
+        logger.warning("The prebuilt schema %s was built for other routes, generating it instead", path)
+        return None
+    return schema
+
+
+class LazyMCP:
+    """The MCP server of an app, set up on first use; the transport serving /mcp requests."""
+
+    def __init__(self, app: FastAPI, prebuilt: Optional[dict[str, Any]] = None) -> None:
+        self.app = app
+        self.prebuilt = prebuilt
+        self._transport: Any = None
+        self._lock = asyncio.Lock()
+
+    async def transport(self) -> Any:
+        if self._transport is None:
+            async with self._lock:
+                if self._transport is None:
+                    # imports fastapi_mcp: in a thread, so that the requests in flight keep being served
+                    self._transport = await asyncio.to_thread(self._setup)
+        return self._transport
+
+    async def handle_request(self, request: Request) -> Any:
+        """Serve an /mcp request, setting the server up if this is the first one."""
+        transport = await self.transport()
+        return await transport.handle_fastapi_request(request)
+
+    def _setup(self) -> Any:
+        start = time.perf_counter()
+        from .mcp_server import create_mcp, create_transport
+
+        mcp = create_mcp(self.app, self.prebuilt["mcp"] if self.prebuilt else None)
+        logger.info("MCP server ready in %.2fs", time.perf_counter() - start)
+        return create_transport(mcp)
@@ -0,0 +1,140 @@
+"""
+Benchmark of response compression: CPU time against bytes on the wire, per encoding and level.
+
+Typical payloads are fetched from the app in-process (against the database configured by
+DATABASE_URL): a product, pages of products and orders, the first chunk of an order export, and
+an order page as the result of an MCP tool call. Each payload is compressed with every available
+encoding (gzip, and br/zstd when their packages are installed) at a range of levels, and the
+report gives the compressed size, the time to compress and decompress, and the time to deliver
+the payload (compression plus transfer) at a few link speeds. The best encoding for a link is the
+one with the lowest delivery time.
+
+To run this benchmark, execute from the src directory:
+    python -m benchmarks.compression --repeat 20
+    python -m benchmarks.compression --bandwidths 10,100,1000 --payloads orders_1000
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from functools import partial
+from typing import Callable
+
+import httpx
+
+from app.compression import AVAILABLE_ENCODINGS, Compressor
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+LEVELS: dict[str, tuple[int, ...]] = {"gzip": (1, 4, 6, 9), "br": (1, 4, 6, 11), "zstd": (1, 3, 9, 19)}
+
+DECOMPRESSORS: dict[str, Callable[[bytes], bytes]] = {
+    "gzip": gzip.decompress,
+    "br": lambda data: brotli.decompress(data),
+    "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+}
+
+
+async def fetch_payloads() -> dict[str, bytes]:
+    """Uncompressed response bodies of typical requests."""
+    from app import models
+    from app.database import async_read_engine
+    from app.export import _ndjson
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Accept-Encoding": "identity"}
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client,
+    ):
+
+        async def get(path: str, **params) -> bytes:
+            response = await client.get(path, params=params)
+            response.raise_for_status()
+            return response.content
+
+        products = json.loads(await get("/products/", limit=1))["items"]
+        payloads = {
+            "product": await get(f"/products/{products[0]['id']}") if products else b"{}",
+            "products_100": await get("/products/", limit=100),
+            "orders_100": await get("/orders/", limit=100),
+            "orders_1000": await get("/orders/", limit=1000),
+        }
+        # one chunk of an export stream (the transport would read the whole export before returning it)
+        rows = _ndjson(async_read_engine, models.Order)
+        payloads["export_chunk"] = (await anext(rows)).encode()
+        await rows.aclose()
+    # fastapi-mcp returns the API response pretty-printed as the text of a JSON-RPC result
+    text = json.dumps(json.loads(payloads["orders_100"]), indent=2)
+    payloads["mcp_orders_100"] = json.dumps(
+        {"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}], "isError": False}}
+    ).encode()
+    return payloads
+
+
+def timed(fn: Callable[[], bytes], repeat: int) -> tuple[float, bytes]:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def compress(encoding: str, level: int, payload: bytes) -> bytes:
+    compressor = Compressor(encoding, level)
+    return compressor.compress(payload) + compressor.finish()
+
+
+def report(name: str, payload: bytes, bandwidths: list[float], repeat: int) -> None:
+    links = "".join(f"{f'@{mbit:g} Mbit/s':>14}" for mbit in bandwidths)
+    print(f"\n{name}: {len(payload) / 1024:.1f} KiB")
+    print(f"{'encoding':<10}{'level':>6}{'size KiB':>10}{'ratio':>7}{'comp ms':>9}{'MB/s':>8}{'decomp ms':>11}{links}")
+
+    def delivery(seconds: float, size: int) -> str:
+        return "".join(f"{(seconds + size * 8 / (mbit * 1e6)) * 1000:>11.2f} ms" for mbit in bandwidths)
+
+    print(
+        f"{'identity':<10}{'-':>6}{len(payload) / 1024:>10.1f}{1:>7.1f}{0:>9.3f}{'-':>8}{0:>11.3f}"
+        f"{delivery(0, len(payload))}"
+    )
+    for encoding in AVAILABLE_ENCODINGS:
+        for level in LEVELS[encoding]:
+            # partial binds this iteration's encoding, level and data
+            seconds, data = timed(partial(compress, encoding, level, payload), repeat)
+            decompress_seconds, restored = timed(partial(DECOMPRESSORS[encoding], data), repeat)
+            assert restored == payload
+            print(
+                f"{encoding:<10}{level:>6}{len(data) / 1024:>10.1f}{len(payload) / len(data):>7.1f}"
+                f"{seconds * 1000:>9.3f}{len(payload) / seconds / 1e6:>8.0f}{decompress_seconds * 1000:>11.3f}"
+                f"{delivery(seconds, len(data))}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", help="comma-separated payload names (default: all)")
+    parser.add_argument("--bandwidths", default="10,100,1000", help="comma-separated link speeds, in Mbit/s")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = asyncio.run(fetch_payloads())
+    if args.payloads:
+        payloads = {name: payload for name, payload in payloads.items() if name in args.payloads.split(",")}
+    bandwidths = [float(mbit) for mbit in args.bandwidths.split(",")]
+    print(f"encodings: {', '.join(AVAILABLE_ENCODINGS)}; delivery time = compression + transfer")
+    for name, payload in payloads.items():
+        report(name, payload, bandwidths, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
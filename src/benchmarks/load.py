@@ -0,0 +1,734 @@
+"""
+Load test of the REST API and of the MCP endpoint.
+
+Replays a mixed read/write workload covering every operation_id, over HTTP and as MCP tool calls
+through the /mcp endpoint, and reports latency percentiles and throughput per operation, along
+with the allocations made during the run. Results can be saved as a JSON baseline and compared
+against a later run, e.g. before and after a change.
+
+The app is driven in-process by default (through an ASGI transport, so no server or network is
+in the way) against the database configured by DATABASE_URL; pass --url to load a running server
+instead, in which case only the client's allocations are measured. Entities created by the run
+are deleted at the end, so runs against the same dataset are repeatable. To generate a large
+dataset first, execute (from src/):
+    python -m app.sample_data --customers 100000 --products 10000 --orders 1000000
+
+To run this benchmark, execute from the src directory:
+    python -m benchmarks.load --requests 2000 --concurrency 16 --save baseline.json
+    python -m benchmarks.load --requests 2000 --concurrency 16 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Callable, Optional
+
+import httpx
+
+# weight of each kind of operation in the default mix
+WORKLOADS: dict[str, dict[str, float]] = {
+    "mixed": {"read": 8, "write": 2, "export": 0.05},
+    "read": {"read": 1},
+    "write": {"write": 1},
+}
+
+MCP_HEADERS = {"Accept": "application/json, text/event-stream"}
+MCP_PROTOCOL_VERSION = "2025-03-26"
+
+# products are created with an explicit id (the create_product body includes it); they count down
+# from here so they do not collide with the ids the database hands out
+PRODUCT_ID_START = 2_000_000_000
+
+STATUSES = ("pending", "shipped", "delivered", "cancelled")
+
+
+@dataclass
+class Call:
+    """One request, described so that it can be sent over HTTP or as an MCP tool call."""
+
+    method: str
+    path: str
+    path_params: dict[str, Any] = field(default_factory=dict)
+    query: dict[str, Any] = field(default_factory=dict)
+    body: Any = None
+    # receives the decoded response body, to keep track of created entities
+    record: Optional[Callable[[Any], None]] = None
+    # called once the call is done, to hand back the entity it was working on
+    release: Optional[Callable[[], None]] = None
+
+    def arguments(self) -> dict[str, Any]:
+        """MCP tool arguments: path and query parameters, and the fields of the body."""
+        return {**self.path_params, **self.query, **(self.body or {})}
+
+
+class State:
+    """Ids the workload draws from: a sample of the dataset for reads, and the entities created by the run."""
+
+    def __init__(self, rng: random.Random, products: list[int], customers: list[int], orders: list[int]) -> None:
+        self.rng = rng
+        self.dataset = {"product": products, "customer": customers, "order": orders}
+        self.created: dict[str, list[int]] = {"product": [], "customer": [], "order": []}
+        self._product_ids = itertools.count(PRODUCT_ID_START, -1)
+        self._serial = itertools.count(1)
+        self._run = f"{int(time.time())}-{rng.randrange(10**6)}"
+
+    def existing(self, entity: str) -> Optional[int]:
+        ids = self.dataset[entity] or self.created[entity]
+        return self.rng.choice(ids) if ids else None
+
+    def lease(self, entity: str) -> Optional[int]:
+        """Take one of the run's own entities until the returned id is handed back, so no other call deletes it."""
+        ids = self.take(entity)
+        return ids[0] if ids else None
+
+    def give_back(self, entity: str, entity_id: int) -> Callable[[], None]:
+        return lambda: self.created[entity].append(entity_id)
+
+    def take(self, entity: str, count: int = 1) -> list[int]:
+        ids = self.created[entity]
+        return [ids.pop(self.rng.randrange(len(ids))) for _ in range(min(count, len(ids)))]
+
+    def product_id(self) -> int:
+        return next(self._product_ids)
+
+    def email(self) -> str:
+        return f"bench-{self._run}-{next(self._serial)}@example.com"
+
+    def recorder(self, entity: str) -> Callable[[Any], None]:
+        def record(body: Any) -> None:
+            if isinstance(body, dict) and isinstance(body.get("id"), int):
+                self.created[entity].append(body["id"])
+            elif isinstance(body, dict) and "results" in body:
+                self.created[entity].extend(r["id"] for r in body["results"] if r["status"] == "created")
+
+        return record
+
+
+def _product(state: State, product_id: int) -> dict:
+    price = round(state.rng.uniform(1, 100), 2)
+    return {
+        "id": product_id,
+        "name": f"Bench product {product_id}",
+        "price": price,
+        "stock": 1_000_000,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+
+
+def _customer(state: State, customer_id: Optional[int] = None) -> dict:
+    customer = {"name": "Bench customer", "email": state.email(), "phone": "555-0000000"}
+    if customer_id is not None:
+        customer.update(id=customer_id, created_at=datetime.utcnow().isoformat())
+    return customer
+
+
+def _order(state: State) -> Optional[dict]:
+    customer_id, product_id = state.existing("customer"), state.existing("product")
+    if customer_id is None or product_id is None:
+        return None
+    return {"customer_id": customer_id, "items": [{"product_id": product_id, "quantity": 1}]}
+
+
+def _bulk(rows: list) -> Optional[dict]:
+    return {"rows": rows} if rows and all(row is not None for row in rows) else None
+
+
+def build_operations(bulk_size: int) -> dict[str, tuple[str, Callable[[State], Optional[Call]]]]:
+    """Map every operation_id to its kind and to a function building a call to it, or None when it cannot run yet."""
+
+    def read(path: str, entity: Optional[str] = None, name: str = "", **query: Any):
+        def build(state: State) -> Optional[Call]:
+            if entity is None:
+                return Call("GET", path, query=dict(query))
+            entity_id = state.existing(entity)
+            return None if entity_id is None else Call("GET", path, {name: entity_id}, dict(query))
+
+        return "read", build
+
+    def write(build: Callable[[State], Optional[Call]]):
+        return "write", build
+
+    def export(path: str):
+        return "export", lambda state: Call("GET", path)
+
+    def own(entity: str, make: Callable[[State, int], Call]) -> Callable[[State], Optional[Call]]:
+        # updates and deletes only touch entities created by the run, leaving the dataset as it was
+        def build(state: State) -> Optional[Call]:
+            entity_id = state.lease(entity)
+            if entity_id is None:
+                return None
+            call = make(state, entity_id)
+            call.release = state.give_back(entity, entity_id)
+            return call
+
+        return build
+
+    def take(
+        entity: str, make: Callable[[State, list[int]], Call], count: int = 1
+    ) -> Callable[[State], Optional[Call]]:
+        def build(state: State) -> Optional[Call]:
+            ids = state.take(entity, count)
+            return make(state, ids) if ids else None
+
+        return build
+
+    def create_product(state: State) -> Call:
+        return Call("POST", "/products/", body=_product(state, state.product_id()), record=state.recorder("product"))
+
+    def create_order(state: State) -> Optional[Call]:
+        order = _order(state)
+        return None if order is None else Call("POST", "/orders/", body=order, record=state.recorder("order"))
+
+    def run_batch(state: State) -> Optional[Call]:
+        # an agent's workflow in one request: look the customer and a few products up, then order them
+        orders = [_order(state) for _ in range(3)]
+        if any(order is None for order in orders):
+            return None
+        customer_id = orders[0]["customer_id"]
+        items = [item for order in orders for item in order["items"]]
+        operations = [{"operation_id": "read_customer", "params": {"customer_id": customer_id}}]
+        operations += [{"operation_id": "read_product", "params": {"product_id": item["product_id"]}} for item in items]
+        operations.append({"operation_id": "create_order", "body": {"customer_id": customer_id, "items": items}})
+        record = state.recorder("order")
+        return Call(
+            "POST",
+            "/batch/",
+            body={"operations": operations, "atomic": True},
+            record=lambda body: record(body["results"][-1]["body"]),
+        )
+
+    def create_orders_bulk(state: State) -> Optional[Call]:
+        body = _bulk([_order(state) for _ in range(bulk_size)])
+        return None if body is None else Call("POST", "/orders/bulk", body=body, record=state.recorder("order"))
+
+    return {
+        "read_root__get": read("/"),
+        "read_products": read("/products/", limit=100),
+        "read_product": read("/products/{product_id}", "product", "product_id"),
+        "read_top_products": read("/products/top", by="revenue"),
+        "search_products": read("/products/search", q="product", limit=100),
+        "read_customers": read("/customers/", limit=100),
+        "read_customer": read("/customers/{customer_id}", "customer", "customer_id"),
+        "read_customer_stats": read("/customers/{customer_id}/stats", "customer", "customer_id"),
+        "read_top_customers": read("/customers/top"),
+        "search_customers": read("/customers/search", prefix="customer", sort="name", limit=100),
+        "read_orders": read("/orders/", limit=100),
+        "read_order": read("/orders/{order_id}", "order", "order_id"),
+        "read_orders_summary": read("/orders/summary", **{"from": str(date.today().replace(day=1))}),
+        # without waiting, so that polls do not hold a worker for the long-polling timeout
+        "poll_changes": read("/changes/poll", wait=0),
+        "export_products": export("/products/export"),
+        "export_customers": export("/customers/export"),
+        "export_orders": export("/orders/export"),
+        "create_product": write(create_product),
+        "update_product": write(
+            own(
+                "product",
+                lambda state, id: Call("PUT", "/products/{product_id}", {"product_id": id}, body=_product(state, id)),
+            )
+        ),
+        "delete_product": write(
+            take("product", lambda state, ids: Call("DELETE", "/products/{product_id}", {"product_id": ids[0]}))
+        ),
+        "create_products_bulk": write(
+            lambda state: Call(
+                "POST",
+                "/products/bulk",
+                body={
+                    "rows": [
+                        {k: v for k, v in _product(state, 0).items() if k not in ("id", "created_at")}
+                        for _ in range(bulk_size)
+                    ]
+                },
+                record=state.recorder("product"),
+            )
+        ),
+        "update_products_bulk": write(
+            own(
+                "product",
+                lambda state, id: Call(
+                    "PUT",
+                    "/products/bulk",
+                    body={"rows": [{k: v for k, v in _product(state, id).items() if k != "created_at"}]},
+                ),
+            )
+        ),
+        "delete_products_bulk": write(
+            take(
+                "product",
+                lambda state, ids: Call("POST", "/products/bulk/delete", body={"rows": [{"id": id} for id in ids]}),
+                bulk_size,
+            )
+        ),
+        "create_customer": write(
+            lambda state: Call("POST", "/customers/", body=_customer(state), record=state.recorder("customer"))
+        ),
+        "update_customer": write(
+            own(
+                "customer",
+                lambda state, id: Call(
+                    "PUT", "/customers/{customer_id}", {"customer_id": id}, body=_customer(state, id)
+                ),
+            )
+        ),
+        "delete_customer_customers__customer_id__delete": write(
+            take("customer", lambda state, ids: Call("DELETE", "/customers/{customer_id}", {"customer_id": ids[0]}))
+        ),
+        "create_customers_bulk": write(
+            lambda state: Call(
+                "POST",
+                "/customers/bulk",
+                body={"rows": [_customer(state) for _ in range(bulk_size)]},
+                record=state.recorder("customer"),
+            )
+        ),
+        "update_customers_bulk": write(
+            own(
+                "customer",
+                lambda state, id: Call(
+                    "PUT",
+                    "/customers/bulk",
+                    body={"rows": [{k: v for k, v in _customer(state, id).items() if k != "created_at"}]},
+                ),
+            )
+        ),
+        "delete_customers_bulk": write(
+            take(
+                "customer",
+                lambda state, ids: Call("POST", "/customers/bulk/delete", body={"rows": [{"id": id} for id in ids]}),
+                bulk_size,
+            )
+        ),
+        "create_order": write(create_order),
+        "update_order_status": write(
+            own(
+                "order",
+                lambda state, id: Call(
+                    "PUT", "/orders/{order_id}/status", {"order_id": id}, {"status": state.rng.choice(STATUSES)}
+                ),
+            )
+        ),
+        "delete_order": write(
+            take("order", lambda state, ids: Call("DELETE", "/orders/{order_id}", {"order_id": ids[0]}))
+        ),
+        "create_orders_bulk": write(create_orders_bulk),
+        "update_orders_status_bulk": write(
+            own(
+                "order",
+                lambda state, id: Call(
+                    "PUT", "/orders/bulk", body={"rows": [{"id": id, "status": state.rng.choice(STATUSES)}]}
+                ),
+            )
+        ),
+        "delete_orders_bulk": write(
+            take(
+                "order",
+                lambda state, ids: Call("POST", "/orders/bulk/delete", body={"rows": [{"id": id} for id in ids]}),
+                bulk_size,
+            )
+        ),
+        "run_batch": write(run_batch),
+    }
+
+
+class HttpTransport:
+    name = "http"
+
+    def __init__(self, client: httpx.AsyncClient) -> None:
+        self.client = client
+
+    async def start(self) -> set[str] | None:
+        return None
+
+    async def call(self, operation_id: str, call: Call) -> tuple[bool, Any]:
+        response = await self.client.request(
+            call.method, call.path.format(**call.path_params), params=call.query, json=call.body
+        )
+        # read the whole body, streamed exports included
+        content = await response.aread()
+        ok = response.status_code < 400
+        if not ok or not call.record:
+            return ok, None
+        return ok, json.loads(content) if content else None
+
+
+class McpTransport:
+    """Calls operations as MCP tools over the streamable HTTP transport mounted at /mcp."""
+
+    name = "mcp"
+
+    def __init__(self, client: httpx.AsyncClient, path: str = "/mcp") -> None:
+        self.client = client
+        self.path = path
+        self.headers = dict(MCP_HEADERS)
+        self._ids = itertools.count(1)
+
+    async def _rpc(self, method: str, params: Optional[dict] = None) -> Any:
+        message: dict[str, Any] = {"jsonrpc": "2.0", "id": next(self._ids), "method": method}
+        if params is not None:
+            message["params"] = params
+        response = await self.client.post(self.path, json=message, headers=self.headers)
+        response.raise_for_status()
+        reply = response.json()
+        if "error" in reply:
+            raise RuntimeError(f"MCP {method} failed: {reply['error']}")
+        return reply["result"]
+
+    async def start(self) -> set[str]:
+        """Open a session; returns the names of the available tools."""
+        response = await self.client.post(
+            self.path,
+            json={
+                "jsonrpc": "2.0",
+                "id": next(self._ids),
+                "method": "initialize",
+                "params": {
+                    "protocolVersion": MCP_PROTOCOL_VERSION,
+                    "capabilities": {},
+                    "clientInfo": {"name": "benchmarks.load", "version": "1"},
+                },
+            },
+            headers=self.headers,
+        )
+        response.raise_for_status()
+        if "mcp-session-id" in response.headers:
+            self.headers["mcp-session-id"] = response.headers["mcp-session-id"]
+        await self.client.post(
+            self.path, json={"jsonrpc": "2.0", "method": "notifications/initialized"}, headers=self.headers
+        )
+        return {tool["name"] for tool in (await self._rpc("tools/list"))["tools"]}
+
+    async def call(self, operation_id: str, call: Call) -> tuple[bool, Any]:
+        result = await self._rpc("tools/call", {"name": operation_id, "arguments": call.arguments()})
+        if result.get("isError"):
+            return False, None
+        if not call.record:
+            return True, None
+        text = "".join(part.get("text", "") for part in result.get("content", []))
+        try:
+            return True, json.loads(text)
+        except ValueError:
+            return True, None
+
+
+@dataclass
+class Stats:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(stats: dict[str, Stats], elapsed: float) -> dict[str, dict]:
+    summary = {}
+    everything = Stats()
+    for operation_id, op_stats in sorted(stats.items()):
+        everything.latencies += op_stats.latencies
+        everything.errors += op_stats.errors
+        summary[operation_id] = _summary(op_stats, elapsed)
+    summary["_total"] = _summary(everything, elapsed)
+    return summary
+
+
+def _summary(stats: Stats, elapsed: float) -> dict:
+    if not stats.latencies:
+        return {"count": 0, "errors": stats.errors}
+    return {
+        "count": len(stats.latencies),
+        "errors": stats.errors,
+        "p50_ms": round(percentile(stats.latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(stats.latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(stats.latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(stats.latencies) / elapsed, 1),
+    }
+
+
+async def run_workload(
+    transport_factory: Callable[[], Any],
+    operations: dict[str, tuple[str, Callable[[State], Optional[Call]]]],
+    weights: dict[str, float],
+    state: State,
+    requests: int,
+    concurrency: int,
+    seed: int,
+) -> tuple[dict[str, Stats], float]:
+    """Send `requests` calls from `concurrency` concurrent clients; returns the stats per operation and time taken."""
+    stats: dict[str, Stats] = {}
+    remaining = itertools.count(requests, -1)
+
+    async def worker(number: int, transport: Any, available: Optional[set[str]]) -> None:
+        names = [name for name in operations if available is None or name in available]
+        names = [name for name in names if weights.get(operations[name][0], 0) > 0]
+        op_weights = [weights[operations[name][0]] for name in names]
+        rng = random.Random(seed * 1000 + number)
+        while names and next(remaining) > 0:
+            # draw operations until one can run (deletes need something created first)
+            for _ in range(100):
+                operation_id = rng.choices(names, op_weights)[0]
+                call = operations[operation_id][1](state)
+                if call is not None:
+                    break
+            else:
+                continue
+            op_stats = stats.setdefault(operation_id, Stats())
+            start = time.perf_counter()
+            try:
+                ok, body = await transport.call(operation_id, call)
+            except (httpx.HTTPError, RuntimeError):
+                ok, body = False, None
+            op_stats.latencies.append(time.perf_counter() - start)
+            if call.release:
+                call.release()
+            if not ok:
+                op_stats.errors += 1
+            elif call.record and body is not None:
+                call.record(body)
+
+    # sessions are opened one at a time: fastapi-mcp starts its MCP session manager lazily, on the
+    # first request, and concurrent first requests can get there before it is ready
+    transports = [transport_factory() for _ in range(concurrency)]
+    available = [await transport.start() for transport in transports]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(number, transports[number], available[number]) for number in range(concurrency)))
+    return stats, time.perf_counter() - start
+
+
+async def sample_ids(client: httpx.AsyncClient, in_process: bool, size: int) -> dict[str, list[int]]:
+    """Ids of existing rows for the read operations to pick from."""
+    if in_process:
+        # a random sample across the whole table, rather than its first page
+        from sqlalchemy import func, select
+
+        from app import models
+        from app.database import AsyncReadSessionLocal
+
+        async with AsyncReadSessionLocal() as db:
+            return {
+                entity: list(await db.scalars(select(model.id).order_by(func.random()).limit(size)))
+                for entity, model in (
+                    ("product", models.Product),
+                    ("customer", models.Customer),
+                    ("order", models.Order),
+                )
+            }
+    ids = {}
+    for entity in ("product", "customer", "order"):
+        response = await client.get(f"/{entity}s/", params={"limit": size})
+        response.raise_for_status()
+        ids[entity] = [row["id"] for row in response.json()["items"]]
+    return ids
+
+
+async def cleanup(client: httpx.AsyncClient, state: State) -> None:
+    """Delete the entities created by the run, orders first."""
+    for entity in ("order", "customer", "product"):
+        ids = state.created[entity]
+        for start in range(0, len(ids), 500):
+            rows = [{"id": id} for id in ids[start : start + 500]]
+            await client.post(f"/{entity}s/bulk/delete", json={"rows": rows})
+        ids.clear()
+
+
+def allocation_report(snapshot: tracemalloc.Snapshot, peak: int, requests: int, top: int) -> dict:
+    """Peak traced memory, memory still held at the end and the sites holding the most of it."""
+    sites = snapshot.statistics("lineno")
+    retained = sum(stat.size for stat in sites)
+    return {
+        "requests": requests,
+        "peak_kb": round(peak / 1024, 1),
+        "retained_kb": round(retained / 1024, 1),
+        "retained_blocks": sum(stat.count for stat in sites),
+        "top_sites": [
+            {"site": str(stat.traceback[0]), "kb": round(stat.size / 1024, 1), "blocks": stat.count}
+            for stat in sites[:top]
+        ],
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict) -> None:
+    for transport, summary in results["results"].items():
+        print(f"\n{transport.upper()}")
+        print(f"{'operation':<48} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        for operation_id, row in summary.items():
+            if not row["count"]:
+                continue
+            print(
+                f"{operation_id:<48} {row['count']:>6} {row['errors']:>6} {row['p50_ms']:>9.2f} "
+                f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['throughput_rps']:>9.1f}"
+            )
+        allocations = results["allocations"].get(transport)
+        if allocations:
+            print(
+                f"allocations over {allocations['requests']} requests: peak {allocations['peak_kb']} KiB, "
+                f"retained {allocations['retained_kb']} KiB in {allocations['retained_blocks']} blocks"
+            )
+            for site in allocations["top_sites"]:
+                print(f"  {site['kb']:>10.1f} KiB {site['blocks']:>8} blocks  {site['site']}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print the change of every operation against a baseline; returns the regressions beyond `threshold` percent."""
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('revision') or 'baseline'} ({baseline['meta'].get('timestamp')})")
+    for transport, summary in results["results"].items():
+        for operation_id, row in summary.items():
+            before = baseline["results"].get(transport, {}).get(operation_id)
+            if not before or not before.get("count") or not row.get("count"):
+                continue
+            p95 = (row["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            rps = (row["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+            line = f"{transport}:{operation_id}"
+            print(
+                f"{line:<54} p95 {before['p95_ms']:>8.2f} -> {row['p95_ms']:>8.2f} ms ({p95:+6.1f}%)"
+                f"  req/s {rps:+6.1f}%"
+            )
+            # the total regresses on latency or throughput; single operations, with enough samples, on latency
+            if (operation_id == "_total" and (p95 > threshold or -rps > threshold)) or (
+                p95 > threshold and row["count"] >= 20
+            ):
+                regressions.append(line)
+    return regressions
+
+
+async def benchmark(args: argparse.Namespace) -> dict:
+    in_process = args.url is None
+    if in_process:
+        from app.main import app
+
+        # errors are counted from the status code, as they would be against a server
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        base_url = "http://bench"
+        # the app's startup and shutdown run as they would in a server, background tasks included
+        lifespan = app.router.lifespan_context(app)
+    else:
+        transport = None
+        base_url = args.url
+        lifespan = nullcontext()
+
+    weights = dict(WORKLOADS[args.workload])
+    operations = build_operations(args.bulk_size)
+    if args.operations:
+        operations = {name: op for name, op in operations.items() if name in args.operations.split(",")}
+    if args.exclude:
+        operations = {name: op for name, op in operations.items() if name not in args.exclude.split(",")}
+
+    results: dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "target": args.url or "in-process",
+            "args": vars(args),
+        },
+        "results": {},
+        "allocations": {},
+    }
+
+    async with lifespan, httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        ids = await sample_ids(client, in_process, args.sample)
+        rng = random.Random(args.seed)
+        state = State(rng, ids["product"], ids["customer"], ids["order"])
+        transports = {
+            "http": lambda: HttpTransport(client),
+            "mcp": lambda: McpTransport(client, args.mcp_path),
+        }
+        try:
+            for name in args.transports.split(","):
+                if args.warmup:
+                    await run_workload(
+                        transports[name], operations, weights, state, args.warmup, args.concurrency, args.seed
+                    )
+                stats, elapsed = await run_workload(
+                    transports[name], operations, weights, state, args.requests, args.concurrency, args.seed
+                )
+                results["results"][name] = summarize(stats, elapsed)
+                if args.alloc_requests:
+                    # a separate pass, since tracing allocations slows everything down
+                    tracemalloc.start()
+                    await run_workload(
+                        transports[name],
+                        operations,
+                        weights,
+                        state,
+                        args.alloc_requests,
+                        args.concurrency,
+                        args.seed,
+                    )
+                    snapshot = tracemalloc.take_snapshot()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results["allocations"][name] = allocation_report(
+                        snapshot, peak, args.alloc_requests, args.top_allocations
+                    )
+        finally:
+            await cleanup(client, state)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server (default: drive the app in-process)")
+    parser.add_argument("--mcp-path", default="/mcp")
+    parser.add_argument("--transports", default="http,mcp", help="comma-separated: http, mcp")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--operations", help="comma-separated operation_ids to run (default: all)")
+    parser.add_argument("--exclude", help="comma-separated operation_ids to leave out")
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per transport")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests per transport")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--bulk-size", type=int, default=10, help="rows per bulk request")
+    parser.add_argument("--sample", type=int, default=1000, help="existing ids sampled per entity for reads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument(
+        "--alloc-requests",
+        type=int,
+        default=200,
+        help="requests per transport of the allocation tracing pass (0 to skip it)",
+    )
+    parser.add_argument("--top-allocations", type=int, default=10)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold, in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmark of the order queries at scale: without the order indexes, with them, and after archiving.
+
+Works on a copy of the SQLite database configured by DATABASE_URL, which is left untouched. The
+queries are the ones the API runs on orders: loading the items of a page of orders, looking up
+the items of an order to restock it, a customer's orders (all of them, and in a month), the
+pending orders (first page and a later one), the orders of a day and a product's order lines.
+Each is timed in three states of the copy:
+
+- before: without the indexes added by migration 2 (see app/migrations.py), like databases
+  created before it;
+- indexed: after migration 2, whose run time is reported;
+- archived: after moving the delivered and cancelled orders placed before the last
+  --archive-months months to the archive tables (see app/archive.py), also timed.
+
+The parameters are sampled among the orders that are not archived, so every query finds rows in
+every state. To generate a large dataset first (10M orders take a while, and several GB), execute
+(from src/):
+    python -m app.sample_data --customers 1000000 --products 100000 --orders 10000000
+
+To run this benchmark, execute from the src directory:
+    python -m benchmarks.orders --repeat 50
+    python -m benchmarks.orders --work-dir /var/tmp --archive-months 3
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy import Engine, Select, create_engine, func, or_, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app import models
+from app.archive import ARCHIVED_STATUSES, archive_orders, month_start
+from app.database import SQLALCHEMY_DATABASE_URL, tune_sqlite
+from app.migrations import MIGRATIONS
+
+PAGE_SIZE = 100
+
+
+@dataclass
+class Samples:
+    """Query parameters drawn from the orders that stay in place when archiving."""
+
+    order_ids: list[int]
+    customer_ids: list[int]
+    product_ids: list[int]
+    pending_ids: list[int]
+    days: list[datetime]
+
+
+def _page(stmt: Select) -> Select:
+    return stmt.order_by(models.Order.id).limit(PAGE_SIZE + 1)
+
+
+QUERIES: dict[str, Callable[[Samples, random.Random], Select]] = {
+    "items of a page of orders": lambda samples, rng: select(models.OrderItem).where(
+        models.OrderItem.order_id.in_(rng.sample(samples.order_ids, PAGE_SIZE))
+    ),
+    "items of an order (restock)": lambda samples, rng: select(
+        models.OrderItem.product_id, models.OrderItem.quantity
+    ).where(models.OrderItem.order_id == rng.choice(samples.order_ids)),
+    "orders of a customer": lambda samples, rng: _page(
+        select(models.Order).where(models.Order.customer_id == rng.choice(samples.customer_ids))
+    ),
+    "orders of a customer in a month": lambda samples, rng: _page(
+        select(models.Order).where(
+            models.Order.customer_id == rng.choice(samples.customer_ids),
+            models.Order.order_date >= (day := rng.choice(samples.days)),
+            models.Order.order_date < day + timedelta(days=30),
+        )
+    ),
+    "pending orders, first page": lambda samples, rng: _page(
+        select(models.Order).where(models.Order.status == "pending")
+    ),
+    "pending orders, later page": lambda samples, rng: _page(
+        select(models.Order).where(models.Order.status == "pending", models.Order.id > rng.choice(samples.pending_ids))
+    ),
+    "orders of a day": lambda samples, rng: _page(
+        select(models.Order).where(
+            models.Order.order_date >= (day := rng.choice(samples.days)),
+            models.Order.order_date < day + timedelta(days=1),
+        )
+    ),
+    "order lines of a product": lambda samples, rng: (
+        select(models.OrderItem)
+        .where(models.OrderItem.product_id == rng.choice(samples.product_ids))
+        .order_by(models.OrderItem.id)
+        .limit(PAGE_SIZE + 1)
+    ),
+}
+
+
+def copy_database(work_dir: str) -> str:
+    """Copy the configured SQLite database (WAL included) to a new file in work_dir."""
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise SystemExit("This benchmark needs a SQLite database file in DATABASE_URL")
+    fd, path = tempfile.mkstemp(suffix=".db", dir=work_dir)
+    os.close(fd)
+    source, target = sqlite3.connect(url.database), sqlite3.connect(path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return path
+
+
+def order_indexes() -> list:
+    """The indexes migration 2 adds (the id indexes predate it)."""
+    indexes = [*models.Order.__table__.indexes, *models.OrderItem.__table__.indexes]
+    return [index for index in indexes if [column.name for column in index.columns] != ["id"]]
+
+
+def sample(engine: Engine, cutoff: datetime, count: int, rng: random.Random) -> Samples:
+    kept = or_(models.Order.order_date >= cutoff, models.Order.status.notin_(ARCHIVED_STATUSES))
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(models.Order.id, models.Order.customer_id).where(kept).order_by(func.random()).limit(count)
+        ).all()
+        pending_ids = connection.scalars(
+            select(models.Order.id).where(models.Order.status == "pending").order_by(func.random()).limit(count)
+        ).all()
+        product_ids = connection.scalars(select(models.Product.id).order_by(func.random()).limit(count)).all()
+        newest = connection.scalar(select(func.max(models.Order.order_date)))
+    if len(rows) < PAGE_SIZE or not pending_ids or not product_ids:
+        raise SystemExit("Not enough orders to benchmark; generate a dataset first (see the docstring)")
+    span = max((newest - cutoff).days, 1)
+    days = [cutoff + timedelta(days=rng.randrange(span)) for _ in range(count)]
+    return Samples(
+        order_ids=[row.id for row in rows],
+        customer_ids=[row.customer_id for row in rows],
+        product_ids=list(product_ids),
+        pending_ids=list(pending_ids),
+        days=days,
+    )
+
+
+def measure(engine: Engine, samples: Samples, repeat: int, warmup: int, seed: int) -> dict[str, list[float]]:
+    """Run every query `repeat` times with random parameters; returns their durations in ms."""
+    timings: dict[str, list[float]] = {}
+    with engine.connect() as connection:
+        for name, query in QUERIES.items():
+            rng = random.Random(seed)
+            durations = []
+            for n in range(warmup + repeat):
+                stmt = query(samples, rng)
+                start = time.perf_counter()
+                connection.execute(stmt).all()
+                if n >= warmup:
+                    durations.append((time.perf_counter() - start) * 1000)
+            timings[name] = durations
+    return timings
+
+
+def counts(engine: Engine) -> str:
+    with engine.connect() as connection:
+        orders = connection.scalar(select(func.count()).select_from(models.Order))
+        items = connection.scalar(select(func.count()).select_from(models.OrderItem))
+        archived = connection.scalar(select(func.count()).select_from(models.ArchivedOrder))
+    return f"{orders:,} orders, {items:,} order items, {archived:,} archived orders"
+
+
+def report(results: dict[str, dict[str, list[float]]]) -> None:
+    print(f"\n{'query (median / p95 ms)':<34}" + "".join(f"{state:>20}" for state in results))
+    for name in QUERIES:
+        cells = []
+        for timings in results.values():
+            durations = sorted(timings[name])
+            p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            cells.append(f"{statistics.median(durations):>10.2f} / {p95:>7.2f}")
+        print(f"{name:<34}" + "".join(cells))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30, help="timed runs of each query per state")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed runs of each query per state")
+    parser.add_argument("--archive-months", type=int, default=6, help="months of orders kept when archiving")
+    parser.add_argument("--sample", type=int, default=1000, help="orders, customers and products sampled")
+    parser.add_argument("--work-dir", help="where to copy the database (default: the temporary directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = copy_database(args.work_dir or tempfile.gettempdir())
+    print(f"Copied the database to {path} in {time.perf_counter() - start:.1f}s")
+    engine = create_engine(f"sqlite:///{path}")
+    tune_sqlite(engine)
+    try:
+        index_migration = next(migration for migration in MIGRATIONS if migration.version == 2)
+        with engine.begin() as connection:
+            # the tables of the current schema (such as the archive), as migration 1 would create them
+            models.Base.metadata.create_all(connection)
+            for index in order_indexes():
+                index.drop(connection, checkfirst=True)
+        print(counts(engine))
+
+        with engine.connect() as connection:
+            newest = connection.scalar(select(func.max(models.Order.order_date)))
+        if newest is None:
+            raise SystemExit("No orders to benchmark; generate a dataset first (see the docstring)")
+        cutoff = month_start(newest, args.archive_months)
+        samples = sample(engine, cutoff, args.sample, random.Random(args.seed))
+
+        results: dict[str, dict[str, list[float]]] = {}
+        results["before"] = measure(engine, samples, args.repeat, args.warmup, args.seed)
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            index_migration.apply(connection)
+        print(f"Migration 2 ({index_migration.description}): {time.perf_counter() - start:.1f}s")
+        results["indexed"] = measure(engine, samples, args.repeat, args.warmup, args.seed)
+
+        start = time.perf_counter()
+        with Session(engine) as db:
+            archived = archive_orders(db, cutoff)
+        print(f"Archived {archived:,} orders placed before {cutoff:%Y-%m-%d}: {time.perf_counter() - start:.1f}s")
+        print(counts(engine))
+        results["archived"] = measure(engine, samples, args.repeat, args.warmup, args.seed)
+
+        report(results)
+    finally:
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of response serialization for list endpoints: the default path (response_model
+validation + JSON encoding, as FastAPI does it) against the FAST_JSON path (compiled mappers +
+orjson).
+
+To run this benchmark, execute from the src directory:
+    python -m benchmarks.serialization --rows 100 --repeat 200
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+import orjson
+from pydantic import TypeAdapter
+
+from app import models, schemas
+from app.serialization import mapper
+
+
+def build_page(rows: int, items_per_order: int) -> dict:
+    """Build a page of transient orders, shaped like the result of read_orders."""
+    orders = []
+    for order_id in range(1, rows + 1):
+        order = models.Order(
+            id=order_id,
+            customer_id=order_id % 50 + 1,
+            status="pending",
+            order_date=datetime.utcnow(),
+            total_amount=19.99 * items_per_order,
+        )
+        order.items = [
+            models.OrderItem(id=order_id * 100 + n, product_id=n + 1, quantity=1, price_at_time=19.99)
+            for n in range(items_per_order)
+        ]
+        orders.append(order)
+    return {"items": orders, "next_cursor": None}
+
+
+def validated(page: dict, adapter: TypeAdapter) -> bytes:
+    # what FastAPI does with a response_model: validate, dump to JSON-compatible data, encode
+    content = adapter.dump_python(adapter.validate_python(page, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def fast(page: dict, to_dict) -> bytes:
+    return orjson.dumps(to_dict(page))
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100, help="orders per page")
+    parser.add_argument("--items", type=int, default=3, help="items per order")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    page = build_page(args.rows, args.items)
+    adapter = TypeAdapter(schemas.Page[schemas.Order])
+    to_dict = mapper(schemas.Page[schemas.Order])
+    assert json.loads(validated(page, adapter)) == json.loads(fast(page, to_dict))
+
+    before = timed(lambda: validated(page, adapter), args.repeat)
+    after = timed(lambda: fast(page, to_dict), args.repeat)
+    print(f"{args.rows} orders x {args.items} items, {args.repeat} runs")
+    print(f"response_model validation: {before * 1000:8.3f} ms/page")
+    print(f"FAST_JSON:                 {after * 1000:8.3f} ms/page ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark of the cold start: import time, time to the first response and to the first MCP call.
+
+Each configuration is measured in fresh processes, as a newly started container would be:
+
+- default: run.py as configured by default, which brings the schema up to date and checks for
+  sample data before serving;
+- fast: FAST_START (see app/startup.py), which skips those steps, creates the database engines on
+  first use and sets the MCP server up once the server is up;
+- fast+schema: FAST_START with a schema file built by `python -m app.cli build-schema`.
+
+For every run, the report gives the time to import app.main, the time from starting run.py to the
+first response of GET /, and the time from then to listing the MCP tools (which waits for the MCP
+server in the fast configurations). The slowest imports of app.main are listed per configuration
+(from python -X importtime). The servers use a SQLite database set up by `python -m app.cli
+setup` in a temporary directory, unless --database-url names one.
+
+To run this benchmark, execute from the src directory:
+    python -m benchmarks.startup --runs 5 --save startup.json
+    python -m benchmarks.startup --configs default,fast+schema --top-imports 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any
+
+import httpx
+
+from benchmarks.load import McpTransport, git_revision
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+
+def configurations(schema_file: str) -> dict[str, dict[str, str]]:
+    return {
+        "default": {"FAST_START": "false"},
+        "fast": {"FAST_START": "true"},
+        "fast+schema": {"FAST_START": "true", "OPENAPI_SCHEMA_FILE": schema_file},
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_time(env: dict[str, str]) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict[str, str], top: int) -> list[dict[str, Any]]:
+    """The packages whose modules take the longest to import with app.main (their own time, not their imports')."""
+    command = [sys.executable, "-X", "importtime", "-c", "import app.main"]
+    output = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+    packages: dict[str, int] = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:") :].split("|")
+        if own.strip().isdigit():
+            package = name.strip().split(".")[0]
+            packages[package] = packages.get(package, 0) + int(own)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "ms": round(us / 1000, 1)} for package, us in ranked]
+
+
+async def list_tools(base_url: str) -> int:
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        return len(await McpTransport(client).start())
+
+
+def serve(env: dict[str, str], timeout: float) -> dict[str, float]:
+    """Start run.py and time its first response, then its first MCP tool listing."""
+    port = free_port()
+    env = {**env, "HOST": "127.0.0.1", "PORT": str(port), "LOG_LEVEL": "warning"}
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "run.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        with httpx.Client(base_url=base_url, timeout=5) as client:
+            while True:
+                if server.poll() is not None:
+                    raise SystemExit(f"run.py exited with status {server.returncode}:\n{server.stderr.read()}")
+                if time.perf_counter() - start > timeout:
+                    raise SystemExit(f"run.py did not respond within {timeout}s")
+                try:
+                    if client.get("/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+        first_response = time.perf_counter() - start
+        asyncio.run(list_tools(base_url))
+        first_tools = time.perf_counter() - start - first_response
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+    return {"first_response_s": first_response, "first_tools_s": first_tools}
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    return {"median": statistics.median(values), "min": min(values), "max": max(values)}
+
+
+def print_results(results: dict) -> None:
+    metrics = ("import_s", "first_response_s", "first_tools_s")
+    print(f"\n{'configuration (median, min-max s)':<34}" + "".join(f"{metric:>22}" for metric in metrics))
+    for name, result in results["results"].items():
+        cells = [
+            f"{row['median']:>7.2f} ({row['min']:.2f}-{row['max']:.2f})"
+            for row in (result["summary"][metric] for metric in metrics)
+        ]
+        print(f"{name:<34}" + "".join(f"{cell:>22}" for cell in cells))
+    for name, result in results["results"].items():
+        if result["imports"]:
+            print(f"\nslowest imports of app.main ({name}):")
+            for row in result["imports"]:
+                print(f"  {row['ms']:>9.1f} ms  {row['package']}")
+
+
+def benchmark(args: argparse.Namespace, work_dir: str) -> dict:
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'startup.db')}"
+        subprocess.run([sys.executable, "-m", "app.cli", "setup"], env=env, capture_output=True, check=True)
+
+    schema_file = os.path.join(work_dir, "openapi.json")
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "app.cli", "build-schema", "--output", schema_file],
+        env=env,
+        capture_output=True,
+        check=True,
+    )
+    build_time = time.perf_counter() - start
+
+    results: dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "args": vars(args),
+            "build_schema_s": build_time,
+        },
+        "results": {},
+    }
+    configs = configurations(schema_file)
+    names = args.configs.split(",") if args.configs else list(configs)
+    # the first import compiles the bytecode; it is not what a container with a built image does
+    import_time({**env, **configs[names[0]]})
+    for name in names:
+        config_env = {**env, **configs[name]}
+        runs: list[dict[str, float]] = []
+        for run in range(args.runs):
+            runs.append({"import_s": import_time(config_env), **serve(config_env, args.timeout)})
+            print(f"{name} #{run + 1}: " + ", ".join(f"{key} {value:.2f}" for key, value in runs[-1].items()))
+        results["results"][name] = {
+            "env": configs[name],
+            "runs": runs,
+            "summary": {key: summarize([row[key] for row in runs]) for key in runs[0]},
+            "imports": slowest_imports(config_env, args.top_imports) if args.top_imports else [],
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per configuration")
+    parser.add_argument("--configs", help="comma-separated: default, fast, fast+schema (default: all)")
+    parser.add_argument("--database-url", help="database of the servers (default: a new SQLite database)")
+    parser.add_argument("--top-imports", type=int, default=10, help="slowest imports to list (0 to skip)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for the first response")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = benchmark(args, work_dir)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,71 @@
-"""Entrypoint for running the FastAPI application."""
+"""
+Entrypoint for running the FastAPI application.
+
+By default (RUN_MODE=dev) a single server is started, after bringing the database schema up to date
+(see app/migrations.py) and populating the database with sample data.
+
+With RUN_MODE=production the app is imported once in a master process, which then binds the
+listening socket and forks WEB_WORKERS workers (one per available core by default) that share it,
+along with the memory pages of the preloaded app. The master restarts workers that die, replaces
+them one at a time on SIGHUP (each new worker is up before an old one is stopped), and on SIGTERM
+or SIGINT lets every worker finish its in-flight requests before exiting. New workers are forked
+from the master, so SIGHUP recycles them (e.g. to release memory) but does not load new code;
+deploying new code takes a new master. Sample data is only
+created when SEED_DATA is set.
+
+With FAST_START (see app/startup.py), the database is neither migrated nor seeded here: run
+`python -m app.cli setup` once per deployment instead.
+"""
 
 import asyncio
+import gc
+import logging
+import os
+import signal
+import socket
+import time
 
 import uvicorn
 
-from app.database import engine
+from app import database
+from app.cache import MemoryBackend, backend
+from app.cli import setup_database
 from app.main import app
-from app.models import Base
-from app.sample_data import create_sample_data
+from app.startup import FAST_START
+
+logger = logging.getLogger(__name__)
+
+RUN_MODE: str = os.getenv("RUN_MODE", "dev").lower()
+HOST: str = os.getenv("HOST", "0.0.0.0")
+PORT: int = int(os.getenv("PORT", "8000"))
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "info")
+
+# production mode
+WEB_WORKERS: int = int(os.getenv("WEB_WORKERS", "0"))  # 0: one per available core
+GRACEFUL_TIMEOUT: int = int(os.getenv("GRACEFUL_TIMEOUT", "30"))  # seconds to drain in-flight requests
+WORKER_BOOT_TIMEOUT: float = float(os.getenv("WORKER_BOOT_TIMEOUT", "30"))
+SOCKET_BACKLOG: int = int(os.getenv("SOCKET_BACKLOG", "2048"))
+
+# sample data is created in dev mode, and in production mode only when asked for
+SEED_DATA: bool = os.getenv("SEED_DATA", "true" if RUN_MODE == "dev" else "false").lower() in ("1", "true", "yes")
+
+
+def prepare_database() -> None:
+    # with FAST_START, `python -m app.cli setup` prepares the database once per deployment instead
+    if not FAST_START:
+        setup_database(seed=SEED_DATA)
 
 
 def start() -> None:
     """Start the FastAPI application."""
-    # Create database tables
-    Base.metadata.create_all(bind=engine)
+    if RUN_MODE == "production":
+        Master().run()
+        return
 
-    # Populate the database (only if empty)
-    create_sample_data()
+    prepare_database()
 
     # Run the FastAPI app
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info")
+    config = uvicorn.Config(app, host=HOST, port=PORT, log_level=LOG_LEVEL)
     server = uvicorn.Server(config)
 
     try:
@@ -30,5 +76,201 @@ def start() -> None:
         print("Server shut down.")
 
 
+def default_workers() -> int:
+    # the cores this process may run on, which a container can limit below the machine's count
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def bind_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(SOCKET_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, ready_fd: int | None = None) -> None:
+    """Serve requests on the shared socket until told to stop; runs in a forked worker."""
+    # uvicorn handles SIGINT and SIGTERM with a graceful shutdown; SIGHUP is meant for the master
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    config = uvicorn.Config(app, log_level=LOG_LEVEL, timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+    server = uvicorn.Server(config)
+
+    async def serve() -> None:
+        serving = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started and not serving.done():
+            await asyncio.sleep(0.05)
+        # tell the master this worker accepts connections, when it waits for that
+        if ready_fd is not None:
+            if server.started:
+                os.write(ready_fd, b"1")
+            os.close(ready_fd)
+        await serving
+
+    asyncio.run(serve())
+
+
+class Master:
+    """Pre-forking process manager for the production mode."""
+
+    def __init__(self) -> None:
+        self.workers: dict[int, int] = {}  # pid -> worker number, for the logs
+        self.started: dict[int, float] = {}  # worker number -> when it was last started
+        self.signals: list[int] = []
+        self.stopping = False
+        self.sock: socket.socket | None = None
+
+    def run(self) -> None:
+        if not hasattr(os, "fork"):
+            raise RuntimeError("RUN_MODE=production requires a platform with os.fork()")
+
+        prepare_database()
+        count = WEB_WORKERS or default_workers()
+        if count > 1 and isinstance(backend, MemoryBackend):
+            print("Warning: each worker has its own in-memory cache; use a Redis CACHE_URL to share invalidations.")
+
+        self.sock = bind_socket()
+        # connections opened while preparing the database must not be shared with the workers
+        if not FAST_START:
+            database.engine.dispose()
+        # keep the collector from touching the preloaded objects, so their pages stay shared
+        gc.collect()
+        gc.freeze()
+
+        for handled in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(handled, lambda signum, frame: self.signals.append(signum))
+
+        print(f"Starting {count} workers on {HOST}:{PORT} (master pid {os.getpid()})")
+        for number in range(count):
+            self.spawn(number)
+
+        while not self.stopping:
+            self.reap()
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.rolling_restart()
+                else:
+                    self.stopping = True
+            time.sleep(0.2)
+
+        self.shutdown()
+
+    def spawn(self, number: int, wait: bool = False) -> int | None:
+        """Fork a worker; with wait, block until it accepts connections (or give up and stop it)."""
+        if self.sock is None:
+            raise RuntimeError("The socket must be bound before workers are started")
+        pipe = os.pipe() if wait else None
+        pid = os.fork()
+        if pid == 0:
+            if pipe is not None:
+                os.close(pipe[0])
+            try:
+                run_worker(self.sock, pipe[1] if pipe is not None else None)
+                os._exit(0)
+            except BaseException:
+                logger.exception("Worker %d failed", number)
+                os._exit(1)
+
+        self.workers[pid] = number
+        self.started[number] = time.monotonic()
+        if pipe is not None:
+            ready_read, ready_write = pipe
+            os.close(ready_write)
+            ready = self.wait_ready(ready_read)
+            os.close(ready_read)
+            if not ready:
+                print(f"Worker {number} (pid {pid}) did not start within {WORKER_BOOT_TIMEOUT}s")
+                self.stop(pid)
+                return None
+        print(f"Worker {number} started (pid {pid})")
+        return pid
+
+    @staticmethod
+    def wait_ready(ready_fd: int) -> bool:
+        deadline = time.monotonic() + WORKER_BOOT_TIMEOUT
+        os.set_blocking(ready_fd, False)
+        while time.monotonic() < deadline:
+            try:
+                return os.read(ready_fd, 1) == b"1"
+            except BlockingIOError:
+                time.sleep(0.05)
+        return False
+
+    def reap(self) -> None:
+        """Collect exited workers, replacing them unless shutting down."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            number = self.workers.pop(pid, None)
+            if number is None or self.stopping:
+                continue
+            print(f"Worker {number} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            # a worker that cannot even boot would otherwise be restarted in a tight loop
+            if time.monotonic() - self.started[number] < 1:
+                time.sleep(1)
+            self.spawn(number)
+
+    def stop(self, pid: int) -> None:
+        """Stop a worker gracefully, waiting for its in-flight requests to finish."""
+        number = self.workers.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        self.wait_exit([pid])
+        print(f"Worker {number} (pid {pid}) stopped")
+
+    def rolling_restart(self) -> None:
+        print("Restarting workers")
+        for pid, number in list(self.workers.items()):
+            # the old worker keeps serving until its replacement is up
+            if self.spawn(number, wait=True) is None:
+                print("Rolling restart aborted")
+                return
+            self.stop(pid)
+
+    def shutdown(self) -> None:
+        print("Shutting down workers...")
+        pids = list(self.workers)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.wait_exit(pids)
+        self.workers.clear()
+        if self.sock is not None:
+            self.sock.close()
+        print("Server shut down.")
+
+    @staticmethod
+    def wait_exit(pids: list[int]) -> None:
+        """Wait for workers to exit, killing those still running after the graceful timeout."""
+        remaining = set(pids)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                        remaining.discard(pid)
+                except ChildProcessError:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
 if __name__ == "__main__":
     start()
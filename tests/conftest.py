@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the app reads its settings when it is imported: point it at a scratch database first
+DATABASE_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_DIR}/test.db"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.cli import setup_database  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    setup_database(seed=True)
+    with TestClient(app) as client:
+        yield client
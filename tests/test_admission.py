@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.admission import ConcurrencyLimit, TokenBuckets, admission
+from app.batch import batch_routes
+from app.main import app
+from app.mcp_server import create_mcp
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    # one token a second, up to 3
+    monkeypatch.setattr(admission, "buckets", TokenBuckets(1, 3))
+
+
+def _statuses(client, count, **kwargs):
+    return [client.get("/", **kwargs).status_code for _ in range(count)]
+
+
+def test_clients_over_their_rate_get_429(client, buckets):
+    statuses = _statuses(client, 6)
+    assert statuses == [200, 200, 200, 429, 429, 429]
+    response = client.get("/")
+    assert int(response.headers["retry-after"]) >= 1
+
+
+def test_host_header_does_not_skip_the_rate_limit(client, buckets):
+    assert _statuses(client, 6, headers={"Host": "apiserver"}) == [200, 200, 200, 429, 429, 429]
+
+
+def test_clients_have_their_own_buckets(client, monkeypatch):
+    monkeypatch.setattr(admission, "buckets", TokenBuckets(1, 1))
+    monkeypatch.setattr(admission, "client_header", "x-client")
+    assert client.get("/", headers={"X-Client": "a"}).status_code == 200
+    assert client.get("/", headers={"X-Client": "b"}).status_code == 200
+    assert client.get("/", headers={"X-Client": "a"}).status_code == 429
+
+
+@pytest.fixture
+def full_read_limit(monkeypatch):
+    # every slot of the read limit taken, and no room to queue
+    limit, _ = admission.route_limit(batch_routes(app)["read_customer"])
+    monkeypatch.setattr(limit, "active", limit.limit)
+    monkeypatch.setattr(limit, "queue_size", 0)
+    return limit
+
+
+def test_requests_over_the_concurrency_limit_get_503(client, full_read_limit):
+    response = client.get("/customers/1")
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+    # other classes of requests are unaffected
+    assert client.get("/customers/").status_code == 200
+
+
+def test_requests_queue_for_a_slot_until_their_deadline():
+    async def run():
+        limit = ConcurrencyLimit("read", 1, 1)
+        assert await limit.acquire(1) is None
+        queued = asyncio.create_task(limit.acquire(1))
+        await asyncio.sleep(0)
+        # the queue is full
+        assert await limit.acquire(1) is not None
+        # the slot goes to the request waiting for it
+        limit.release(0.01)
+        assert await queued is None
+        assert limit.active == 1
+        # and a request that waits past its deadline is turned away
+        assert await limit.acquire(0.01) is not None
+        assert not limit.waiters
+
+    asyncio.run(run())
+
+
+def test_mcp_tool_calls_are_not_charged_again(client, monkeypatch):
+    monkeypatch.setattr(admission, "buckets", TokenBuckets(1, 1))
+    assert _statuses(client, 2) == [200, 429]
+
+    async def call_as_mcp_tool():
+        async with create_mcp(app)._http_client as http_client:
+            return [(await http_client.get("/")).status_code for _ in range(2)]
+
+    assert asyncio.run(call_as_mcp_tool()) == [200, 200]
+
+
+def test_batch_operations_are_charged_one_by_one(client, buckets):
+    operations = [{"operation_id": "read_customer", "params": {"customer_id": 1}} for _ in range(4)]
+    response = client.post("/batch/", json={"operations": operations})
+    assert response.status_code == 200
+    # the batch request takes one token, then each operation takes its own
+    assert [result["status_code"] for result in response.json()["results"]] == [200, 200, 429, 429]
+
+
+def test_batch_operations_respect_the_concurrency_limits(client, full_read_limit):
+    operations = [{"operation_id": "read_customer", "params": {"customer_id": 1}}]
+    response = client.post("/batch/", json={"operations": operations})
+    assert response.json()["results"][0]["status_code"] == 503
@@ -0,0 +1,29 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture(params=["upsert", "fallback"])
+def dialect(request, monkeypatch):
+    # databases without INSERT ... ON CONFLICT take the update-then-insert path
+    if request.param == "fallback":
+        monkeypatch.setattr("app.aggregates._UPSERT_INSERTS", {})
+    return request.param
+
+
+def test_orders_update_the_aggregates(client, dialect):
+    customer = client.post("/customers/", json={"name": "Aggregated", "email": f"{uuid.uuid4().hex}@example.com"})
+    customer_id = customer.json()["id"]
+    created = client.post("/products/bulk", json=[{"name": "Aggregated product", "price": 2.5, "stock": 10}])
+    product_id = created.json()["results"][0]["id"]
+
+    for _ in range(2):
+        response = client.post(
+            "/orders/", json={"customer_id": customer_id, "items": [{"product_id": product_id, "quantity": 2}]}
+        )
+        assert response.status_code == 201, response.text
+
+    stats = client.get(f"/customers/{customer_id}/stats").json()
+    assert (stats["order_count"], stats["total_spent"]) == (2, 10.0)
+    top = {row["product_id"]: row for row in client.get("/products/top", params={"limit": 1000}).json()}
+    assert (top[product_id]["order_count"], top[product_id]["units_sold"]) == (2, 4)
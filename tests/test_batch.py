@@ -0,0 +1,60 @@
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def products(client):
+    created = client.post(
+        "/products/bulk",
+        json=[
+            {"name": "Batched product", "price": 1.0, "stock": 5},
+            {"name": "Short product", "price": 1.0, "stock": 1},
+        ],
+    )
+    return [result["id"] for result in created.json()["results"]]
+
+
+def _operations(customer_id, products):
+    plentiful, short = products
+    return [
+        {"operation_id": "create_customer", "body": {"name": "Before", "email": f"{uuid.uuid4().hex}@example.com"}},
+        # takes the stock of the first product, then fails on the second
+        {
+            "operation_id": "create_order",
+            "body": {
+                "customer_id": customer_id,
+                "items": [{"product_id": plentiful, "quantity": 2}, {"product_id": short, "quantity": 3}],
+            },
+        },
+        {"operation_id": "create_customer", "body": {"name": "After", "email": f"{uuid.uuid4().hex}@example.com"}},
+    ]
+
+
+def _stocks(client, products):
+    return [client.get(f"/products/{product_id}").json()["stock"] for product_id in products]
+
+
+def test_failed_operation_rolls_back_only_its_own_writes(client, products):
+    response = client.post("/batch/", json={"operations": _operations(1, products)})
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch["committed"] is True
+    assert (batch["succeeded"], batch["failed"]) == (2, 1)
+    assert [result["status_code"] for result in batch["results"]] == [201, 400, 201]
+
+    for result in (batch["results"][0], batch["results"][2]):
+        assert client.get(f"/customers/{result['body']['id']}").status_code == 200
+    assert _stocks(client, products) == [5, 1]
+
+
+def test_atomic_batch_rolls_back_every_operation(client, products):
+    response = client.post("/batch/", json={"operations": _operations(1, products), "atomic": True})
+    assert response.status_code == 200
+    batch = response.json()
+    assert batch["committed"] is False
+    # the operations after the failure are skipped
+    assert [result["status_code"] for result in batch["results"]] == [201, 400, None]
+
+    assert client.get(f"/customers/{batch['results'][0]['body']['id']}").status_code == 404
+    assert _stocks(client, products) == [5, 1]
@@ -0,0 +1,41 @@
+import uuid
+
+
+def _email():
+    return f"{uuid.uuid4().hex}@example.com"
+
+
+def test_bulk_update_keeps_omitted_customer_fields(client):
+    full = client.post(
+        "/customers/", json={"name": "Full", "email": _email(), "phone": "555-0100", "address": "1 Main St"}
+    ).json()
+    other = client.post(
+        "/customers/", json={"name": "Other", "email": _email(), "phone": "555-0101", "address": "2 Main St"}
+    ).json()
+
+    response = client.put(
+        "/customers/bulk",
+        json=[
+            {"id": full["id"], "name": "Renamed", "email": full["email"]},
+            {"id": other["id"], "name": "Other", "email": other["email"], "phone": None},
+        ],
+    )
+    assert response.json()["succeeded"] == 2
+
+    full = client.get(f"/customers/{full['id']}").json()
+    assert (full["name"], full["phone"], full["address"]) == ("Renamed", "555-0100", "1 Main St")
+    other = client.get(f"/customers/{other['id']}").json()
+    assert (other["phone"], other["address"]) == (None, "2 Main St")
+
+
+def test_bulk_update_keeps_omitted_product_fields(client):
+    created = client.post(
+        "/products/bulk", json=[{"name": "Lamp", "description": "A desk lamp", "price": 20.0, "stock": 5}]
+    ).json()
+    product_id = created["results"][0]["id"]
+
+    response = client.put("/products/bulk", json=[{"id": product_id, "name": "Lamp", "price": 25.0, "stock": 5}])
+    assert response.json()["succeeded"] == 1
+
+    product = client.get(f"/products/{product_id}").json()
+    assert (product["price"], product["description"]) == (25.0, "A desk lamp")
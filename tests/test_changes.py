@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import delete, func, select
+
+from app import models
+from app.changes import CHANGES_BUFFER_SIZE, ChangeFeed
+from app.database import SessionLocal
+
+
+@pytest.fixture
+def feed(client, monkeypatch):
+    # a feed of its own, started from the current end of the log
+    feed = ChangeFeed(CHANGES_BUFFER_SIZE)
+    monkeypatch.setattr("app.routes.changes.feed", feed)
+    client.portal.call(feed.start)
+    yield feed
+    client.portal.call(feed.stop)
+
+
+def _last_id() -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.max(models.Change.id))) or 0
+
+
+def _append(change_id: int) -> None:
+    with SessionLocal() as db:
+        db.add(models.Change(id=change_id, entity="product", entity_id=1, action="updated"))
+        db.commit()
+
+
+def _poll(client, since, **params):
+    response = client.get("/changes/poll", params={"since": since, "wait": 1, **params})
+    assert response.status_code == 200, response.text
+    page = response.json()
+    return [change["id"] for change in page["changes"]], page["next_since"]
+
+
+def test_poll_returns_the_changes_after_since(client, feed):
+    since = feed.last_id
+    created = client.post("/products/bulk", json=[{"name": "Followed", "price": 1.0, "stock": 1}])
+    product_id = created.json()["results"][0]["id"]
+
+    response = client.get("/changes/poll", params={"since": since, "entities": "product", "wait": 1})
+    changes = response.json()["changes"]
+    assert [(change["entity_id"], change["action"]) for change in changes] == [(product_id, "created")]
+    assert response.json()["next_since"] == changes[-1]["id"]
+
+
+def test_changes_after_a_gap_wait_for_the_missing_id(client, feed):
+    since = _last_id()
+    # a writer that has not committed yet holds since + 1
+    _append(since + 2)
+    assert _poll(client, since, wait=0.5) == ([], since)
+
+    _append(since + 1)
+    assert _poll(client, since) == ([since + 1, since + 2], since + 2)
+
+
+def test_gaps_are_skipped_after_the_gap_timeout(client, feed, monkeypatch):
+    # a transaction that rolled back leaves its id unused for good
+    monkeypatch.setattr("app.changes.GAP_TIMEOUT", 0)
+    since = _last_id()
+    _append(since + 2)
+    assert _poll(client, since) == ([since + 2], since + 2)
+
+
+def test_resuming_from_deleted_changes_fails_with_410(client, feed):
+    since = feed.last_id
+    for name in ("Swept", "Kept"):
+        client.post("/products/bulk", json=[{"name": name, "price": 1.0, "stock": 1}])
+    assert _poll(client, since) == ([since + 1, since + 2], since + 2)
+    # the changes up to the first of them have been swept
+    with SessionLocal() as db:
+        db.execute(delete(models.Change).where(models.Change.id <= since + 1))
+        db.commit()
+
+    # older than the feed's buffer: read from the table, where they are no longer kept
+    response = client.get("/changes/poll", params={"since": since - 1, "wait": 0})
+    assert response.status_code == 410
+    # the feed's buffer still has them
+    assert _poll(client, since) == ([since + 1, since + 2], since + 2)
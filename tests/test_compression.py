@@ -0,0 +1,33 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def products(client):
+    rows = [{"name": f"Compressed product {i}", "price": 1.0, "stock": 1} for i in range(50)]
+    assert client.post("/products/bulk", json=rows).json()["succeeded"] == len(rows)
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+def test_large_responses_are_compressed_with_their_length(client):
+    with client.stream("GET", "/products/", params={"limit": 50}, headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        raw = b"".join(response.iter_raw())
+    assert int(response.headers["content-length"]) == len(raw)
+    assert len(json.loads(gzip.decompress(raw))["items"]) == 50
+
+
+def test_streamed_exports_are_compressed(client):
+    with client.stream("GET", "/products/export", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    rows = [json.loads(line) for line in gzip.decompress(raw).splitlines()]
+    assert len(rows) >= 50
@@ -0,0 +1,55 @@
+import uuid
+
+import pytest
+from fastapi import Response
+
+from app.main import app
+
+
+def _create(client, key, name):
+    return client.post(
+        "/products/bulk", json=[{"name": name, "price": 1.0, "stock": 1}], headers={"Idempotency-Key": key}
+    )
+
+
+def test_retries_replay_the_first_response(client):
+    key = uuid.uuid4().hex
+    first = _create(client, key, "Idempotent")
+    retry = _create(client, key, "Idempotent")
+
+    assert retry.status_code == first.status_code
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    product_id = first.json()["results"][0]["id"]
+    assert client.get(f"/products/{product_id}").status_code == 200
+
+
+def test_key_reused_for_a_different_body_is_rejected(client):
+    key = uuid.uuid4().hex
+    assert _create(client, key, "First body").status_code == 200
+    response = _create(client, key, "Second body")
+    assert response.status_code == 422
+    assert "different request" in response.json()["detail"]
+
+
+@pytest.fixture
+def cookie_route():
+    async def set_cookies(response: Response):
+        response.set_cookie("first", "1")
+        response.set_cookie("second", "2")
+        return {"ok": True}
+
+    app.add_api_route("/test-cookies", set_cookies, methods=["POST"])
+    yield "/test-cookies"
+    app.router.routes.pop()
+
+
+def test_replays_keep_repeated_headers(client, cookie_route):
+    key = uuid.uuid4().hex
+    for replayed in (False, True):
+        response = client.post(cookie_route, headers={"Idempotency-Key": key})
+        assert response.status_code == 200
+        assert ("idempotent-replayed" in response.headers) is replayed
+        cookies = [value.split(";")[0] for value in response.headers.get_list("set-cookie")]
+        assert cookies == ["first=1", "second=2"]
@@ -0,0 +1,21 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_concurrent_orders_do_not_oversell(client):
+    customer = client.post("/customers/", json={"name": "Concurrent", "email": f"{uuid.uuid4().hex}@example.com"})
+    customer_id = customer.json()["id"]
+    created = client.post("/products/bulk", json=[{"name": "Scarce product", "price": 1.0, "stock": 10}])
+    product_id = created.json()["results"][0]["id"]
+
+    def order(_):
+        return client.post(
+            "/orders/", json={"customer_id": customer_id, "items": [{"product_id": product_id, "quantity": 1}]}
+        )
+
+    with ThreadPoolExecutor(max_workers=30) as executor:
+        responses = list(executor.map(order, range(30)))
+
+    statuses = [response.status_code for response in responses]
+    assert sorted(statuses) == [201] * 10 + [400] * 20
+    assert client.get(f"/products/{product_id}").json()["stock"] == 0
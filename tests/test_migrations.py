@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert, inspect, select, text
+from sqlalchemy.orm import Session
+
+from app import database, migrations, models
+from app.archive import archive_orders
+
+
+def _table_sql(engine, name):
+    with engine.connect() as connection:
+        return connection.scalar(text("SELECT sql FROM sqlite_master WHERE name = :name"), {"name": name})
+
+
+@pytest.fixture
+def old_database(tmp_path, monkeypatch):
+    """A database migrated before migration 4, with orders 1 and 2 live and order 3 archived."""
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with monkeypatch.context() as patch:
+        for model in (models.Order, models.OrderItem):
+            patch.setitem(model.__table__.dialect_options["sqlite"], "autoincrement", False)
+        patch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:3])
+        migrations.migrate(engine)
+    assert "AUTOINCREMENT" not in _table_sql(engine, "orders")
+
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(insert(models.Customer).values(id=1, name="Old", email="old@example.com"))
+        connection.execute(insert(models.Product).values(id=1, name="Old", price=1.0, stock=1))
+        for order_id in (1, 2):
+            connection.execute(insert(models.Order).values(id=order_id, customer_id=1, order_date=now))
+            connection.execute(
+                insert(models.OrderItem).values(id=order_id, order_id=order_id, product_id=1, price_at_time=1.0)
+            )
+        connection.execute(insert(models.ArchivedOrder).values(id=3, customer_id=1, order_date=now))
+        connection.execute(
+            insert(models.ArchivedOrderItem).values(id=3, order_id=3, product_id=1, quantity=1, price_at_time=1.0)
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_migration_keeps_archived_order_ids(old_database):
+    assert migrations.migrate(old_database) == [4]
+
+    assert "AUTOINCREMENT" in _table_sql(old_database, "orders")
+    assert "AUTOINCREMENT" in _table_sql(old_database, "order_items_detail")
+    indexes = {index["name"] for index in inspect(old_database).get_indexes("orders")}
+    assert {"ix_orders_customer_id_order_date", "ix_orders_status_id"} <= indexes
+    with Session(old_database) as db:
+        assert db.scalars(select(models.Order.id).order_by(models.Order.id)).all() == [1, 2]
+        order = models.Order(customer_id=1, items=[models.OrderItem(product_id=1, price_at_time=1.0)])
+        db.add(order)
+        db.commit()
+        assert (order.id, order.items[0].id) == (4, 4)
+
+
+def test_migration_is_a_no_op_on_new_databases(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/new.db")
+    migrations.migrate(engine)
+    assert "AUTOINCREMENT" in _table_sql(engine, "orders")
+    assert migrations.migrate(engine) == []
+
+
+def test_archived_order_ids_are_not_handed_out_again(client):
+    customer_id = client.get("/customers/", params={"limit": 1}).json()["items"][0]["id"]
+    created = client.post("/products/bulk", json=[{"name": "Archived", "price": 1.0, "stock": 10}])
+    product_id = created.json()["results"][0]["id"]
+    order = {"customer_id": customer_id, "items": [{"product_id": product_id, "quantity": 1}]}
+
+    order_id = client.post("/orders/", json=order).json()["id"]
+    assert client.put(f"/orders/{order_id}/status", params={"status": "cancelled"}).status_code == 200
+    with Session(database.engine) as db:
+        assert archive_orders(db, datetime.utcnow() + timedelta(days=1)) >= 1
+
+    assert client.post("/orders/", json=order).json()["id"] > order_id
+    assert client.get(f"/orders/{order_id}").json()["status"] == "cancelled"
+
+
+def test_migration_computes_the_aggregates_of_existing_orders(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/orders.db")
+    # a database created before the migrations and the summary tables, with orders
+    tables = [models.Customer.__table__, models.Product.__table__, models.Order.__table__, models.OrderItem.__table__]
+    models.Base.metadata.create_all(engine, tables=[*tables, models.order_items])
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(insert(models.Customer).values(id=1, name="Old", email="old@example.com"))
+        connection.execute(insert(models.Product).values(id=1, name="Old", price=2.0, stock=1))
+        for order_id, status in ((1, "delivered"), (2, "pending"), (3, "cancelled")):
+            connection.execute(
+                insert(models.Order).values(id=order_id, customer_id=1, order_date=now, status=status, total_amount=4)
+            )
+            connection.execute(
+                insert(models.OrderItem).values(order_id=order_id, product_id=1, quantity=2, price_at_time=2.0)
+            )
+
+    migrations.migrate(engine)
+    with Session(engine) as db:
+        stats = db.get(models.CustomerStats, 1)
+        assert (stats.order_count, stats.total_spent) == (2, 8.0)
+        sales = db.get(models.ProductSales, 1)
+        assert (sales.order_count, sales.units_sold, sales.revenue) == (2, 4, 8.0)
+        assert db.scalar(select(models.DailySales.order_count)) == 2
+    engine.dispose()
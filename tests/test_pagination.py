@@ -0,0 +1,72 @@
+import pytest
+
+from app.pagination import MAX_PAGE_LIMIT, encode_cursor
+
+
+@pytest.mark.parametrize("path", ["/products/", "/customers/", "/orders/", "/products/search", "/customers/search"])
+@pytest.mark.parametrize("limit", [-5, -1, 0])
+def test_list_rejects_limits_below_one(client, path, limit):
+    assert client.get(path, params={"limit": limit}).status_code == 422
+
+
+@pytest.mark.parametrize("path", ["/products/top", "/customers/top"])
+@pytest.mark.parametrize("limit", [-1, 0])
+def test_top_rejects_limits_below_one(client, path, limit):
+    assert client.get(path, params={"limit": limit}).status_code == 422
+
+
+@pytest.mark.parametrize("path", ["/products/", "/customers/", "/orders/", "/products/search", "/customers/search"])
+def test_list_caps_oversized_limits(client, path, monkeypatch):
+    monkeypatch.setattr("app.pagination.MAX_PAGE_LIMIT", 1)
+    response = client.get(path, params={"limit": 100000})
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["items"]) == 1
+    assert page["next_cursor"] is not None
+
+
+def test_cursor_follows_capped_pages(client, monkeypatch):
+    monkeypatch.setattr("app.pagination.MAX_PAGE_LIMIT", 1)
+    first = client.get("/customers/", params={"limit": 100000}).json()
+    second = client.get("/customers/", params={"limit": 100000, "cursor": first["next_cursor"]}).json()
+    assert second["items"][0]["id"] > first["items"][-1]["id"]
+
+
+def test_oversized_limit_is_capped_at_max_page_limit(client):
+    page = client.get("/products/", params={"limit": MAX_PAGE_LIMIT + 1}).json()
+    assert len(page["items"]) <= MAX_PAGE_LIMIT
+
+
+@pytest.mark.parametrize(
+    "path, sort, position",
+    [
+        ("/products/search", "name", {"id": 1, "key": [1, 2]}),
+        ("/products/search", "name", {"id": 1, "key": 5}),
+        ("/products/search", "price", {"id": 1, "key": "cheap"}),
+        ("/products/search", "stock", {"id": 1, "key": 1.5}),
+        ("/products/search", "stock", {"id": 1, "key": {"a": 1}}),
+        ("/customers/search", "email", {"id": 1, "key": True}),
+        ("/customers/search", "name", {"id": "1", "key": "a"}),
+        ("/customers/search", "name", {"id": 1}),
+    ],
+)
+def test_search_rejects_malformed_cursors(client, path, sort, position):
+    response = client.get(path, params={"sort": sort, "cursor": encode_cursor(position)})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("sort", ["name", "price", "stock", "id", "relevance"])
+def test_search_follows_its_own_cursors(client, sort):
+    first = client.get("/products/search", params={"sort": sort, "limit": 1}).json()
+    response = client.get("/products/search", params={"sort": sort, "limit": 1, "cursor": first["next_cursor"]})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["id"] != first["items"][0]["id"]
+
+
+def test_search_by_relevance_follows_its_own_cursors(client):
+    client.post("/products/bulk", json=[{"name": f"Relevance lamp {i}", "price": 1.0, "stock": 1} for i in range(2)])
+    first = client.get("/products/search", params={"q": "relevance lamp", "limit": 1}).json()
+    response = client.get("/products/search", params={"q": "relevance lamp", "cursor": first["next_cursor"]})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["id"] != first["items"][0]["id"]